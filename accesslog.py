@@ -0,0 +1,126 @@
+"""
+Access log: one line per request, in the Combined Log Format of Apache
+and nginx without the referer and user agent, followed by the time it
+took to serve the request, e.g.
+    127.0.0.1 - - [17/Oct/2026:18:47:14 +0000] "GET /index.md HTTP/1.1" 200 15765 2.314ms
+
+The workers never write to the log themselves: writing to a terminal or
+a pipe can block, and formatting the line costs time. They put the
+fields of the request in a queue, and a background thread formats the
+lines and writes them in batches, with a single write and flush for all
+the lines queued meanwhile.
+"""
+
+"""
+queue.SimpleQueue is an unbounded FIFO queue, safe to use from several
+threads. get() blocks until an item is available, get_nowait() raises
+queue.Empty when there is none.
+"""
+import queue
+import threading
+import atexit
+import sys
+import time
+
+# Access log written by a background thread
+class AccessLog(object):
+
+    # largest number of lines written at once
+    BATCH_SIZE = 256
+
+    """
+    [stream]
+    text file the lines are written to, e.g. sys.stdout.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    """
+    queues a request to be logged. Returns at once.
+    [client_address] (host, port) of the client
+    [request_line] e.g. 'GET /index.md HTTP/1.1', or '-'
+    [status] e.g. '200 OK'
+    [length] number of bytes of the response body
+    [latency] time it took to serve the request, in seconds
+    """
+    def log(self, client_address, request_line, status, length, latency):
+        if self.thread is None:
+            self.start()
+        self.queue.put((client_address, request_line, status, length, latency, time.time()))
+
+    """
+    starts the writer thread (on first use: a worker process starts its
+    own after being forked).
+    """
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            # daemon: the thread does not keep the process alive
+            self.thread = threading.Thread(target=self.run, name='AccessLog', daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+
+    """
+    writes the lines queued, waits for the writer thread to exit, and
+    closes the file of the log (but not the standard output).
+    """
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+        if self.stream not in (sys.stdout, sys.stderr):
+            self.stream.close()
+
+    """
+    body of the writer thread: waits for a record, then writes it along
+    with every record queued meanwhile.
+    """
+    def run(self):
+        while True:
+            record = self.queue.get()
+            lines = []
+            while record is not None:
+                lines.append(self.format(*record))
+                if len(lines) >= self.BATCH_SIZE:
+                    break
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if lines:
+                try:
+                    self.stream.write(''.join(lines))
+                    self.stream.flush()
+                except (OSError, ValueError):
+                    # e.g. the terminal went away
+                    pass
+            if record is None:
+                return
+
+    """
+    formats a record into a line of the log.
+    """
+    def format(self, client_address, request_line, status, length, latency, timestamp):
+        return '{host} - - [{time}] "{request_line}" {status} {length} {latency:.3f}ms\n'.format(
+            host=client_address[0] if client_address else '-',
+            time=time.strftime('%d/%b/%Y:%H:%M:%S +0000', time.gmtime(timestamp)),
+            request_line=request_line,
+            status=status.split(' ', 1)[0],
+            length=length,
+            latency=latency * 1000
+        )
+
+"""
+returns the access log of a path: '-' is the standard output, and an
+empty path (or None) disables the log and returns None.
+"""
+def create(path):
+    if not path:
+        return None
+    if path == '-':
+        return AccessLog(sys.stdout)
+    return AccessLog(open(path, 'a', encoding='utf-8'))
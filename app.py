@@ -13,15 +13,79 @@ start_response(status, response_headers).
 """
 
 import os
+import time
+import zlib
+"""
+hashlib computes message digests: sha256() returns an object whose
+update(data) method hashes more data, and hexdigest() the digest of all
+of it, as hexadecimal.
+"""
+import hashlib
+"""
+mimetypes maps file name extensions to MIME types.
+guess_type(url) returns a tuple (type, encoding), e.g. ('text/css', None).
+"""
+import mimetypes
 from pathlib import Path
+"""
+urllib.parse splits and decodes URLs.
+parse_qs(qs, keep_blank_values) parses a query string into a dictionary,
+e.g. 'raw&lang=en' into {'raw': [''], 'lang': ['en']}.
+"""
+from urllib.parse import parse_qs
+"""
+email.utils formats and parses the dates of e-mail headers, which HTTP
+uses too, e.g. 'Sat, 17 Oct 2026 18:46:28 GMT'.
+"""
+from email.utils import formatdate, parsedate_to_datetime
+import markdown2
 from markdown2 import Markdown
 from preprocessor import Preprocessor
+from cache import LRUCache, DiskCache
+from singleflight import Flights
+from lanes import Lane
+import compression
+
+# markdown files downloaded raw (unknown to older versions of mimetypes)
+mimetypes.add_type('text/markdown', '.md')
+mimetypes.add_type('text/markdown', '.markdown')
 
 class Kernel:
 
+    # size of the blocks a static file is read in, when it cannot be sent
+    # with os.sendfile
+    BLOCK_SIZE = 65536
+
+    # compressed variants of the responses, created on first use:
+    # { (key, encoding): compressed body }
+    compressed = None
+
+    # rendered pages, created on first use: { key: utf-8 page }
+    pages = None
+
+    # rendered pages on disk, created on first use
+    disk = None
+
+    # the renders in progress, shared by the requests for the same page
+    flights = Flights()
+
+    # the key of the page last rendered from a markdown file and template,
+    # whatever their version: { key without version: key }
+    latest = {}
+
+    # the worker rendering again the pages served stale, created on first
+    # use
+    revalidation = None
+
+    # options of the markdown converter. With the version of markdown2,
+    # they are part of the address of a page in the cache on disk: a page
+    # converted with other options is another page
+    MARKDOWN_OPTIONS = {}
+
     def app(environ, start_response, config):
-        # The path for the markdown file
-        path = environ['PATH_INFO']
+        # The path for the markdown file. The server passes it as a latin-1
+        # string of the raw bytes of the URL (PEP 3333): file names are utf-8.
+        path = environ['PATH_INFO'].encode('latin-1').decode('utf-8', 'replace')
 
         # If is root path and no path has been specified, then set the index file as a default fallback.
         if path == '/':
@@ -32,9 +96,29 @@ class Kernel:
             path = path[1:]
 
         # The markdown file
-        markdown_path = config.wd().joinpath(path);
+        markdown_path = Kernel.resolve(config.wd(), path)
+        # The content coding of the response (None: not compressed)
+        encoding = None
+        # The version of the files the response is built from (None: the
+        # response has no validators)
+        version = None
+        # Whether the response is a page older than its files
+        stale = False
 
-        if not (markdown_path.is_dir()) and markdown_path.exists() and (markdown_path.suffix == '.md' or markdown_path.suffix == '.markdown'):
+        # Any other file is a static asset, from the working directory or
+        # else from the theme directory (e.g. the CSS of the template)
+        if markdown_path is not None and markdown_path.suffix not in ('.md', '.markdown'):
+            static_path = markdown_path
+            if not static_path.is_file():
+                static_path = Kernel.resolve(config.template_file_path().parent, path)
+            if static_path is not None and static_path.is_file():
+                return Kernel.static(environ, start_response, config, static_path)
+
+        # The markdown source itself, e.g. /index.md?raw
+        if markdown_path is not None and markdown_path.is_file() and 'raw' in parse_qs(environ.get('QUERY_STRING', ''), keep_blank_values=True):
+            return Kernel.static(environ, start_response, config, markdown_path)
+
+        if markdown_path is not None and not (markdown_path.is_dir()) and markdown_path.exists() and (markdown_path.suffix == '.md' or markdown_path.suffix == '.markdown'):
 
             # The template file
             template_path = config.template_file_path()
@@ -43,26 +127,68 @@ class Kernel:
                 status = b'503 Service Unavailable'
                 content = [b'503 - Something went wrong. Template file could not be found. Please provide a template.html file']
             else:
-                # The markdown
-                markdown = markdown_path.read_bytes()
-                markdown += b'\n'
-                markdowner = Markdown()
-                html = markdowner.convert(markdown)
-
-                # The template
-                template = template_path.read_text()
-
-                # Expand the content
-                preprocessor = Preprocessor(template, html)
-                html = preprocessor.process()
-                html = html.encode('utf-8')
+                # The page changes whenever its markdown file or the template
+                # changes: it is cached, with its compressed variants, under
+                # this key
+                version = Kernel.version(markdown_path, template_path)
+                key = ('page', str(markdown_path), str(template_path), version)
+                if Kernel.not_modified(environ, version):
+                    # The client has this version of the page already: it is
+                    # not rendered at all
+                    status = '304 Not Modified'
+                    content = []
+                else:
+                    encoding = Kernel.negotiate(environ, config)
+                    html = None
+                    if encoding is not None:
+                        html = Kernel.compressed_cache(config).get((key, encoding))
+                    sources = None
+                    if html is None:
+                        # The page was rendered already: at most compressed
+                        page = Kernel.page_cache(config).get(key)
+                        if page is None:
+                            # Not by this process: maybe by another one, or
+                            # before a restart
+                            sources = Kernel.sources(config, markdown_path, template_path)
+                            page = Kernel.rendered(config, sources)
+                            if page is not None:
+                                Kernel.cache_page(config, key, None, page)
+                        if page is None:
+                            # The files changed since the page was last
+                            # rendered: the previous page may be served for
+                            # a while, as the page is rendered in the
+                            # background
+                            previous = Kernel.stale(config, key)
+                            if previous is not None:
+                                Kernel.revalidate(config, key, sources)
+                                key, page = previous
+                                version = key[-1]
+                                stale = True
+                                if encoding is not None:
+                                    html = Kernel.compressed_cache(config).get((key, encoding))
+                        if html is None and page is not None:
+                            # compressed whatever its size, as when it is
+                            # streamed (see Kernel.stream): the same page has
+                            # the same Content-Encoding, cached or not
+                            html, encoding = Kernel.compress(config, key, page, encoding, 0)
+                    if html is not None:
+                        content = [html]
+                    elif environ['REQUEST_METHOD'] == 'HEAD':
+                        # The headers are known without rendering the page,
+                        # but not its length: an empty iterator (unlike an
+                        # empty list) does not tell a length to the server
+                        content = iter([])
+                    else:
+                        # The page is sent as it is rendered: the template up
+                        # to the content first, while the markdown is converted
+                        # (or once rendered by a request for the same page)
+                        content = Kernel.render(config, key, sources, encoding)
 
-                # The return status
-                status = '200 OK'
-                content = [html]
+                    # The return status
+                    status = '200 OK'
         else:
             # If index file could not be found, report it.
-            if markdown_path.name == config.index_file_name():
+            if markdown_path is not None and markdown_path.name == config.index_file_name():
                 print(
                     "Could not find the directory index file to display. "
                     "Provide a directory index file by saving a file as "
@@ -73,9 +199,22 @@ class Kernel:
             status = '404 Not Found'
             # The file could not be found.
             if not config.notfound_file_path().is_dir() and config.notfound_file_path().exists():
-                html = config.notfound_file_path().read_text()
-                html = html.encode('utf-8')
-                content = [html]
+                notfound_path = config.notfound_file_path()
+                version = Kernel.version(notfound_path)
+                key = ('page', str(notfound_path), version)
+                if Kernel.not_modified(environ, version):
+                    status = '304 Not Modified'
+                    content = []
+                else:
+                    encoding = Kernel.negotiate(environ, config)
+                    html = None
+                    if encoding is not None:
+                        html = Kernel.compressed_cache(config).get((key, encoding))
+                    if html is None:
+                        html = notfound_path.read_text()
+                        html = html.encode('utf-8')
+                        html, encoding = Kernel.compress(config, key, html, encoding)
+                    content = [html]
             # Oh the irony... The 404 error template could not be found, so send hand-written (app generated) error message.
             else:
                 content = [
@@ -86,6 +225,15 @@ class Kernel:
 
         # The headers are a list of 2-tuples like (name, type)
         response_headers = [('Content-Type','text/html')]
+        # Caches between the server and the client must keep a variant of
+        # the page per Accept-Encoding request header
+        response_headers.append(('Vary', 'Accept-Encoding'))
+        if encoding is not None:
+            response_headers.append(('Content-Encoding', encoding))
+        if version is not None:
+            response_headers.extend(Kernel.validators(version))
+        if stale:
+            response_headers.append(('Warning', '110 - "Response is Stale"'))
         # use the start_response function to start a response
         # which will send the headers above as answer to a client's request
         start_response(status, response_headers)
@@ -93,3 +241,466 @@ class Kernel:
         # the 'b' before the string is just for sending a bytes object
         # (remember, the WSGIServer expects bytes strings as a response!)
         return content
+
+    """
+    Renders a page, or waits for its render by another request (see
+    singleflight.py), and yields it like Kernel.stream. The render is only
+    joined once the generator is started, by a worker of the render lane:
+    a response which never gets there (e.g. the render lane is full) has
+    no part in it.
+    """
+    def render(config, key, sources, encoding):
+        # the page may have been rendered while the response waited for a
+        # worker of the render lane
+        page = Kernel.page_cache(config).get(key)
+        if page is None:
+            flight, leader = Kernel.flights.join(key)
+            if leader:
+                # the previous leader may have landed between the lookup
+                # and the join
+                page = Kernel.page_cache(config).get(key)
+                if page is None:
+                    yield from Kernel.stream(config, key, sources, encoding, flight)
+                    return
+                Kernel.flights.land(key, flight, result=page)
+                Kernel.flights.spare()
+            else:
+                page = Kernel.flights.follow(flight)
+        else:
+            Kernel.flights.spare()
+        data, encoding = Kernel.compress(config, key, page, encoding, 0)
+        yield data
+
+    """
+    Renders a markdown file into the template, and yields the page as
+    utf-8 bytes piece by piece: the template up to the content macro is
+    yielded before the markdown is converted. With an encoding, every
+    piece is compressed and flushed as it is yielded: the size of the page
+    is not known when the headers are sent, so a page is compressed
+    whatever its size (the compression-min-size setting does not apply). Once complete, the
+    page is cached under key (and on disk under its digest), and so is the
+    whole compressed page.
+    [sources]
+    the markdown, template and digest returned by Kernel.sources.
+    [flight]
+    the flight of the page, which this render leads: it is landed with
+    the page, or the error the render failed with.
+    """
+    def stream(config, key, sources, encoding, flight):
+        markdown, template, digest = sources
+
+        # The markdown, converted once the template prefix is sent
+        converted = False
+        def content():
+            nonlocal converted
+            markdowner = Markdown(**Kernel.MARKDOWN_OPTIONS)
+            html = markdowner.convert(markdown + b'\n')
+            converted = True
+            return html
+
+        Kernel.flights.count_render()
+        # Expand the content
+        pieces = Preprocessor(template, content).stream()
+        compressor = None
+        if encoding is not None:
+            compressor = compression.compressor(encoding, config.compression_level())
+        # the pieces of the page, and of the compressed page, cached once
+        # complete
+        page = []
+        body = []
+        try:
+            for html in pieces:
+                html = html.encode('utf-8')
+                page.append(html)
+                if compressor is not None:
+                    html = compressor.compress(html)
+                    html += compressor.flush(zlib.Z_SYNC_FLUSH)
+                    body.append(html)
+                yield html
+            if compressor is not None:
+                data = compressor.flush()
+                body.append(data)
+                yield data
+        except GeneratorExit:
+            # The client went away: the render stops, unless the markdown is
+            # converted already (the rest of the page costs next to nothing)
+            # or other requests wait for the page. It is then completed and
+            # cached (but not compressed, the compressed page is incomplete)
+            if not converted and Kernel.flights.abandon(key, flight):
+                raise
+            compressor = None
+            try:
+                for html in pieces:
+                    page.append(html.encode('utf-8'))
+            except Exception as error:
+                Kernel.flights.land(key, flight, error=error)
+                return
+        except BaseException as error:
+            Kernel.flights.land(key, flight, error=error)
+            raise
+        page = b''.join(page)
+        Kernel.cache_page(config, key, digest, page)
+        if compressor is not None:
+            Kernel.compressed_cache(config).put((key, encoding), b''.join(body))
+        Kernel.flights.land(key, flight, result=page)
+
+    """
+    Reads the sources of a page: its markdown (bytes) and its template.
+    Returns them with their digest, the address of the page in the cache
+    on disk (None when it is disabled): the SHA-256 of the sources and of
+    the converter, which is all the page depends on.
+    """
+    def sources(config, markdown_path, template_path):
+        markdown = markdown_path.read_bytes()
+        template = template_path.read_text()
+        digest = None
+        if config.disk_cache():
+            converter = 'markdown2 {version} {options}'.format(
+                version=markdown2.__version__,
+                options=sorted(Kernel.MARKDOWN_OPTIONS.items())
+            )
+            sha256 = hashlib.sha256()
+            for part in (converter.encode('utf-8'), template.encode('utf-8'), markdown):
+                # each part is preceded by its length, so that the bytes of
+                # one part cannot pass for the bytes of another
+                sha256.update(b'%d:' % len(part))
+                sha256.update(part)
+            digest = sha256.hexdigest()
+        return markdown, template, digest
+
+    """
+    Returns the page rendered from the sources, if it is in the cache on
+    disk, or None.
+    """
+    def rendered(config, sources):
+        markdown, template, digest = sources
+        if digest is None:
+            return None
+        return Kernel.disk_cache(config).get(digest)
+
+    """
+    Caches a page once rendered: in memory under key, and on disk under
+    the digest of its sources.
+    """
+    def cache_page(config, key, digest, page):
+        Kernel.page_cache(config).put(key, page)
+        Kernel.latest[key[:-1]] = key
+        if digest is not None:
+            Kernel.disk_cache(config).put(digest, page)
+
+    """
+    Returns the key and the page previously rendered from the files of a
+    page which is not rendered yet, if it may be served instead (see the
+    stale-while-revalidate setting): it is still in the cache, and the
+    files changed no longer than the setting ago. Returns None otherwise.
+    """
+    def stale(config, key):
+        window = config.stale_while_revalidate()
+        if not window:
+            return None
+        previous = Kernel.latest.get(key[:-1])
+        if previous is None or previous == key:
+            return None
+        changed = max(mtime for mtime, size in key[-1]) / 1000000000
+        if time.time() - changed > window:
+            return None
+        page = Kernel.page_cache(config).get(previous)
+        if page is None:
+            return None
+        return previous, page
+
+    """
+    Renders a page again in the background (once: not if it is being
+    rendered already). The requests for the page which are not served
+    stale meanwhile wait for this render (see Kernel.render).
+    """
+    def revalidate(config, key, sources):
+        flight = Kernel.flights.lead(key)
+        if flight is None:
+            return
+        if Kernel.revalidation is None:
+            Kernel.revalidation = Lane('revalidate', 1, config.render_queue_size())
+        if not Kernel.revalidation.submit(Kernel.refresh, config, key, sources, flight):
+            # the queue is full: the page is rendered by the next request
+            # which is not served stale. Requests which joined the flight
+            # meanwhile have sent their headers already, they cannot be
+            # failed: the page is rendered for them here
+            if not Kernel.flights.abandon(key, flight):
+                Kernel.refresh(config, key, sources, flight)
+
+    """
+    Renders a page in the background, leading its flight (see
+    Kernel.revalidate). The page is cached, but sent to no one.
+    """
+    def refresh(config, key, sources, flight):
+        for data in Kernel.stream(config, key, sources, None, flight):
+            pass
+
+    """
+    Returns the version of a response built from the given files: their
+    modification times (in nanoseconds) and sizes. It changes whenever
+    one of the files is saved.
+    """
+    def version(*file_paths):
+        version = []
+        for file_path in file_paths:
+            stat = file_path.stat()
+            version.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(version)
+
+    """
+    Returns the validators of a version of a response, as headers:
+    [ETag]
+    an opaque tag of the version, e.g. W/"1700000000000000000-2a". It is
+    weak (W/): the compressed and uncompressed bodies share it.
+    [Last-Modified]
+    the date at which the newest of the files was modified.
+    The client sends them back in the If-None-Match and If-Modified-Since
+    headers of its next request for the same URL.
+    """
+    def validators(version):
+        return [
+            ('ETag', Kernel.etag(version)),
+            ('Last-Modified', formatdate(Kernel.last_modified(version), usegmt=True))
+        ]
+
+    def etag(version):
+        return 'W/"{}"'.format('-'.join(
+            '{:x}-{:x}'.format(mtime, size) for mtime, size in version
+        ))
+
+    def last_modified(version):
+        # HTTP dates are in whole seconds
+        return max(mtime for mtime, size in version) // 1000000000
+
+    """
+    Returns True if the client already has this version of the response
+    (conditional GET, RFC 7232): it is answered with 304 Not Modified and
+    no body. If-None-Match takes precedence over If-Modified-Since.
+    """
+    def not_modified(environ, version):
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return False
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            # weak comparison: W/"x" matches "x"
+            etag = Kernel.etag(version)[2:]
+            for tag in if_none_match.split(','):
+                tag = tag.strip()
+                if tag == '*' or tag.replace('W/', '', 1) == etag:
+                    return True
+            return False
+        if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError, IndexError):
+                # an invalid date is ignored
+                return False
+            return Kernel.last_modified(version) <= since
+        return False
+
+    """
+    Returns the content coding of the response preferred by the client
+    (its Accept-Encoding request header), or None if the response is not
+    to be compressed.
+    """
+    def negotiate(environ, config):
+        if not config.compression():
+            return None
+        return compression.negotiate(environ.get('HTTP_ACCEPT_ENCODING'))
+
+    """
+    Returns the cache of the compressed responses.
+    """
+    def compressed_cache(config):
+        if Kernel.compressed is None:
+            Kernel.compressed = LRUCache(config.compression_cache_size())
+        return Kernel.compressed
+
+    """
+    Returns the cache of the rendered pages, bounded by the memory they
+    use (the page-cache-size setting), the least recently used evicted
+    first.
+    """
+    def page_cache(config):
+        if Kernel.pages is None:
+            Kernel.pages = LRUCache(config.page_cache_size())
+        return Kernel.pages
+
+    """
+    Returns the cache of the rendered pages on disk, in the cache
+    directory of the repository.
+    """
+    def disk_cache(config):
+        if Kernel.disk is None:
+            Kernel.disk = DiskCache(config.cache_dir())
+        return Kernel.disk
+
+    """
+    Returns the counters of the caches (hits, misses, evictions...), for
+    the statistics of the server.
+    """
+    def stats():
+        stats = {}
+        if Kernel.pages is not None:
+            stats['pages'] = Kernel.pages.stats()
+        if Kernel.disk is not None:
+            stats['disk'] = Kernel.disk.stats()
+        if Kernel.compressed is not None:
+            stats['compressed'] = Kernel.compressed.stats()
+        stats['flights'] = Kernel.flights.stats()
+        if Kernel.revalidation is not None:
+            stats['revalidate'] = Kernel.revalidation.stats()
+        return stats
+
+    """
+    Compresses a response body with the negotiated encoding, and caches
+    it under key: the next request for the same version of the response
+    is answered from the cache without rendering or compressing it again.
+    Returns the body and its encoding (None if it was left uncompressed,
+    e.g. too small to be worth it).
+    [min_size]
+    the smallest body compressed (None: the compression-min-size setting).
+    """
+    def compress(config, key, data, encoding, min_size=None):
+        if min_size is None:
+            min_size = config.compression_min_size()
+        if encoding is None or len(data) < min_size:
+            return data, None
+        data = compression.compress(data, encoding, config.compression_level())
+        Kernel.compressed_cache(config).put((key, encoding), data)
+        return data, encoding
+
+    """
+    Returns the file path of a request path inside the directory, or None
+    if the request path points outside of it (e.g. "/../../etc/passwd") or
+    into a hidden file or directory (e.g. ".muggle/config.json", ".git").
+    """
+    def resolve(directory, path):
+        if any(part.startswith('.') for part in Path(path).parts):
+            return None
+        directory = directory.resolve()
+        file_path = directory.joinpath(path).resolve()
+        if file_path != directory and directory not in file_path.parents:
+            return None
+        return file_path
+
+    """
+    Responds with a static file. The file is returned wrapped in the
+    wsgi.file_wrapper of the server, which sends it with os.sendfile
+    without reading it into memory. Text files (CSS, JavaScript, SVG...)
+    are compressed instead when the client accepts it, unless they are
+    larger than the compression-max-size setting. A part of the file can
+    be requested with a Range header (e.g. to resume a download).
+    """
+    def static(environ, start_response, config, file_path):
+        content_type, encoding = mimetypes.guess_type(file_path.name)
+        if content_type is None:
+            content_type = 'application/octet-stream'
+        elif content_type.startswith('text/'):
+            content_type += '; charset=utf-8'
+        version = Kernel.version(file_path)
+        response_headers = [ ('Content-Type', content_type), ('Accept-Ranges', 'bytes') ]
+        if compression.compressible(content_type):
+            response_headers.append(('Vary', 'Accept-Encoding'))
+        response_headers.extend(Kernel.validators(version))
+        if Kernel.not_modified(environ, version):
+            start_response('304 Not Modified', response_headers)
+            return []
+        static_file = open(file_path, 'rb')
+        size = os.fstat(static_file.fileno()).st_size
+        byte_range = Kernel.byte_range(environ, version, size)
+        if byte_range is not None and not byte_range:
+            # The range is outside of the file
+            static_file.close()
+            response_headers.append(('Content-Range', 'bytes */{size}'.format(size=size)))
+            response_headers.append(('Content-Length', '0'))
+            start_response('416 Range Not Satisfiable', response_headers)
+            return []
+        if byte_range is None and compression.compressible(content_type):
+            encoding = Kernel.negotiate(environ, config)
+            if encoding is not None and config.compression_min_size() <= size <= config.compression_max_size():
+                key = ('static', str(file_path), version)
+                data = Kernel.compressed_cache(config).get((key, encoding))
+                if data is None:
+                    with static_file:
+                        data = static_file.read()
+                    data, encoding = Kernel.compress(config, key, data, encoding)
+                else:
+                    static_file.close()
+                response_headers.append(('Content-Encoding', encoding))
+                response_headers.append(('Content-Length', str(len(data))))
+                start_response('200 OK', response_headers)
+                return [data]
+        if byte_range is None:
+            status = '200 OK'
+            length = size
+        else:
+            # e.g. Content-Range: bytes 1000-1999/5000
+            status = '206 Partial Content'
+            length = len(byte_range)
+            response_headers.append(('Content-Range', 'bytes {start}-{end}/{size}'.format(
+                start=byte_range.start, end=byte_range.stop - 1, size=size)))
+            static_file.seek(byte_range.start)
+        # The server sends Content-Length bytes from the current position
+        # of the file
+        response_headers.append(('Content-Length', str(length)))
+        start_response(status, response_headers)
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            return file_wrapper(static_file, Kernel.BLOCK_SIZE)
+        return Kernel.blocks(static_file, length)
+
+    """
+    Returns the part of a file of the given size requested by the Range
+    header, as a range of byte positions, e.g. 'bytes=1000-1999' gives
+    range(1000, 2000), 'bytes=1000-' the rest of the file from 1000 and
+    'bytes=-500' its last 500 bytes. An empty range means the range is
+    outside of the file (416 Range Not Satisfiable).
+    Returns None if the whole file is to be sent: no Range header, a
+    malformed or multiple range (allowed to be ignored), or an If-Range
+    header which does not match the current version of the file.
+    """
+    def byte_range(environ, version, size):
+        value = environ.get('HTTP_RANGE')
+        if value is None or environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return None
+        if_range = environ.get('HTTP_IF_RANGE')
+        if if_range is not None:
+            # If-Range requires a strong validator: the ETag is weak, so
+            # only the Last-Modified date can match
+            if if_range != formatdate(Kernel.last_modified(version), usegmt=True):
+                return None
+        unit, equals, spec = value.partition('=')
+        if unit.strip().lower() != 'bytes' or ',' in spec:
+            return None
+        first, dash, last = spec.strip().partition('-')
+        try:
+            if not first:
+                # the last bytes of the file
+                suffix = int(last)
+                return range(max(size - suffix, 0) if suffix else size, size)
+            start = int(first)
+            end = int(last) if last else None
+        except ValueError:
+            return None
+        if not dash or (end is not None and end < start):
+            return None
+        if start >= size:
+            return range(0)
+        # the last byte position is inclusive
+        return range(start, size if end is None else min(end + 1, size))
+
+    """
+    Reads count bytes of a file block by block (for servers without a
+    file wrapper).
+    """
+    def blocks(static_file, count):
+        with static_file:
+            while count > 0:
+                block = static_file.read(min(Kernel.BLOCK_SIZE, count))
+                if not block:
+                    return
+                count -= len(block)
+                yield block
@@ -0,0 +1,182 @@
+"""
+Caches of the responses: in memory, shared by the worker threads of a
+process, and on disk, shared by the processes and kept across restarts.
+"""
+
+"""
+collections.OrderedDict is a dict which remembers the order in which its
+keys were inserted. move_to_end(key) moves a key to the end, and
+popitem(last=False) pops the first key: together they make a least
+recently used (LRU) order, the least recently used key being the first.
+"""
+import collections
+import os
+"""
+tempfile.mkstemp(suffix, prefix, dir) creates a new file with a unique
+name in dir, and returns an open file descriptor of it and its path.
+"""
+import tempfile
+import threading
+
+# Least recently used cache, bounded by the total size of its values
+class LRUCache(object):
+
+    """
+    [max_size]
+    the total size (in bytes) of the values held. When a new value does
+    not fit, the least recently used values are evicted to make room.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        # { key: (value, size) }
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        # lookups which found a value, lookups which did not, and values
+        # evicted to make room for others
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    """
+    returns the value cached for key, or default.
+    """
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    """
+    caches value for key. size defaults to len(value). A value larger
+    than the whole cache is not cached.
+    """
+    def put(self, key, value, size=None):
+        if size is None:
+            size = len(value)
+        if size > self.max_size:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                evicted_key, (evicted, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    """
+    returns the counters of the cache, e.g.
+    {'entries': 12, 'size': 402112, 'hits': 340, 'misses': 12, 'evictions': 0}
+    """
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+# Cache of rendered pages on disk, addressed by the digest of their sources
+class DiskCache(object):
+
+    """
+    The pages rendered by every process (and every run) of the server are
+    kept in a directory, one file per page, named after the digest of
+    what the page is rendered from: the same sources always give the same
+    page, so an entry never goes stale, and is never invalidated. Saving a
+    document gives it a new digest, and the entries nobody asks for any
+    more stay behind: the directory may be deleted at any time.
+    A page is written to a temporary file first, then renamed to its name:
+    the rename is atomic, so that a process never reads a partly written
+    page, and two processes writing the same page at once both write the
+    same bytes.
+    [directory]
+    directory of the cache, created on first use.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        # lookups which found a page, lookups which did not, pages written,
+        # and pages which could not be written (e.g. the disk is full)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    """
+    returns the path of the page of a digest (hexadecimal). The pages are
+    spread over 256 subdirectories, by the first 2 digits of the digest,
+    so that no directory grows too large.
+    """
+    def path(self, digest):
+        return self.directory.joinpath(digest[:2], digest)
+
+    """
+    returns the page of a digest, or None.
+    """
+    def get(self, digest):
+        try:
+            data = self.path(digest).read_bytes()
+        except OSError:
+            data = None
+        with self.lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    """
+    writes the page of a digest. Errors are counted, not raised: the page
+    is rendered again next time.
+    [os.replace]
+    os.replace(src, dst) renames src to dst, replacing dst if it exists,
+    in a single atomic step (rename(2)).
+    [os.fsync]
+    forces the data of the file to the disk before it gets its name, so
+    that a crash does not leave an empty file under that name.
+    """
+    def put(self, digest, data):
+        path = self.path(digest)
+        temporary = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, temporary = tempfile.mkstemp(suffix='.tmp', prefix='.', dir=str(path.parent))
+            with os.fdopen(fd, 'wb') as temporary_file:
+                temporary_file.write(data)
+                temporary_file.flush()
+                os.fsync(temporary_file.fileno())
+            os.replace(temporary, str(path))
+        except OSError:
+            if temporary is not None:
+                try:
+                    os.unlink(temporary)
+                except OSError:
+                    pass
+            with self.lock:
+                self.errors += 1
+            return
+        with self.lock:
+            self.writes += 1
+
+    """
+    returns the counters of the cache, e.g.
+    {'hits': 120, 'misses': 4, 'writes': 4, 'errors': 0}
+    """
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'errors': self.errors
+            }
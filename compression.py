@@ -0,0 +1,74 @@
+"""
+HTTP content negotiation of the response compression. The client lists
+the encodings it accepts in the Accept-Encoding request header, e.g.
+    Accept-Encoding: gzip, deflate;q=0.5
+and the server answers with the body compressed in one of them, naming
+it in the Content-Encoding response header. Only the encodings of the
+standard library are offered: gzip (gzip module) and deflate (zlib
+module; in HTTP, "deflate" is the zlib format).
+"""
+
+import gzip
+import zlib
+
+# supported encodings, by order of preference
+ENCODINGS = ('gzip', 'deflate')
+
+"""
+returns the preferred supported encoding of an Accept-Encoding header,
+or None if the body should be sent as is.
+"""
+def negotiate(accept_encoding):
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for item in accept_encoding.split(','):
+        # e.g. 'deflate;q=0.5'
+        name, semicolon, parameters = item.partition(';')
+        name = name.strip().lower()
+        quality = 1.0
+        parameter, equals, value = parameters.partition('=')
+        if parameter.strip().lower() == 'q':
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[name] = quality
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+"""
+compresses data with the given encoding.
+"""
+def compress(data, encoding, level):
+    if encoding == 'gzip':
+        # mtime=0 makes the output depend on the data only
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    return zlib.compress(data, level)
+
+"""
+returns a compressor of the given encoding, for a body which is sent as
+it is produced: compressor.compress(data) returns the compressed bytes
+available so far, compressor.flush(zlib.Z_SYNC_FLUSH) forces out the rest
+of data (so that the client can decode it already), and compressor.flush()
+ends the body.
+"""
+def compressor(encoding, level):
+    if encoding == 'gzip':
+        # wbits 16 + MAX_WBITS: gzip header and trailer
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return zlib.compressobj(level)
+
+"""
+whether a content type is worth compressing: text formats are, images,
+archives and other binary (already compressed) formats are not.
+"""
+def compressible(content_type):
+    content_type = content_type.split(';')[0].strip().lower()
+    return (content_type.startswith('text/')
+        or content_type.endswith(('+xml', '+json', '/xml', '/json', '/javascript'))
+        or content_type == 'image/svg+xml')
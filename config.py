@@ -1,3 +1,4 @@
+import sys
 import json
 
 from pathlib import Path
@@ -36,11 +37,61 @@ class Config:
     Or you can visit it manually for example through
     telnet localhost 8888
 
-    returns tuple of (HOST, PORT)
+    returns tuple of (HOST, PORT), or the path of the Unix domain socket
+    if "unix-socket" is set.
     """
     def server_address(self):
+        if self.unix_socket():
+            return self.unix_socket()
         return (self.json['server']['host'], self.json['server']['port'])
 
+    """
+    path of a Unix domain socket to listen on instead of host and port,
+    e.g. for a reverse proxy on the same machine. Empty: TCP.
+    """
+    def unix_socket(self):
+        return self.json['server'].get('unix-socket', '')
+
+    """
+    length of the queue of connections not accepted yet (listen backlog).
+    None: the default of the server core.
+    """
+    def listen_backlog(self):
+        backlog = self.json['server'].get('listen-backlog')
+        return None if backlog is None else int(backlog)
+
+    """
+    whether TCP_NODELAY is set on the client connections: the segments of
+    a response are sent at once, instead of being held back by Nagle's
+    algorithm until the previous ones are acknowledged.
+    """
+    def tcp_nodelay(self):
+        return bool(self.json['server'].get('tcp-nodelay', True))
+
+    """
+    number of seconds the kernel holds a new connection back until the
+    client sends its request (TCP_DEFER_ACCEPT, Linux). 0 disables it.
+    """
+    def tcp_defer_accept(self):
+        return int(self.json['server'].get('tcp-defer-accept', 0))
+
+    """
+    length of the queue of TCP Fast Open connections, whose request comes
+    with the SYN (TCP_FASTOPEN). 0 disables it.
+    """
+    def tcp_fastopen(self):
+        return int(self.json['server'].get('tcp-fastopen', 0))
+
+    """
+    size of the receive (SO_RCVBUF) and send (SO_SNDBUF) buffers of the
+    client connections, in bytes. 0 leaves the system default.
+    """
+    def socket_receive_buffer(self):
+        return int(self.json['server'].get('socket-receive-buffer', 0))
+
+    def socket_send_buffer(self):
+        return int(self.json['server'].get('socket-send-buffer', 0))
+
     def server_host(self):
         return self.json['server']['host']
 
@@ -62,5 +113,243 @@ class Config:
     def index_file_name(self):
         return self.json['server']['directory-index']
 
+    """
+    number of worker threads serving connections concurrently. Defaults
+    to a single worker for config files written before the option existed.
+    """
+    def server_threads(self):
+        return int(self.json['server'].get('threads', 1))
+
+    """
+    number of worker threads of the render lane, which renders the pages
+    from their Markdown (see lanes.py). 0: the pages are rendered by the
+    workers serving the connections.
+    """
+    def render_threads(self):
+        return int(self.json['server'].get('render-threads', 0))
+
+    """
+    largest number of pages waiting for a thread of the render lane. The
+    requests beyond it are answered with 503 Service Unavailable.
+    """
+    def render_queue_size(self):
+        return int(self.json['server'].get('render-queue-size', 32))
+
+    """
+    whether the threads core speaks HTTP/2 over cleartext TCP (h2c) to the
+    clients which ask for it (see http2.py).
+    """
+    def http2(self):
+        return bool(self.json['server'].get('http2', True))
+
+    """
+    largest number of requests in progress at once on an HTTP/2
+    connection (SETTINGS_MAX_CONCURRENT_STREAMS). Further requests are
+    refused, and the client retries them later.
+    """
+    def http2_max_streams(self):
+        return int(self.json['server'].get('http2-max-streams', 100))
+
+    """
+    number of pre-forked worker processes. The --workers command line
+    option takes precedence over this setting.
+    """
+    def server_workers(self):
+        return int(self.json['server'].get('workers', 1))
+
+    """
+    whether each worker process binds its own SO_REUSEPORT socket instead
+    of sharing the listening socket of the parent process.
+    """
+    def server_reuse_port(self):
+        return bool(self.json['server'].get('reuse-port', False))
+
+    """
+    server core: "threads" serves each connection from a worker thread,
+    "events" multiplexes the connections in an event loop and only uses
+    the worker threads to run the application.
+    """
+    def server_core(self):
+        return self.json['server'].get('core', 'threads')
+
+    """
+    number of seconds a persistent (keep-alive) connection may stay idle
+    between two requests. 0 disables persistent connections.
+    """
+    def keepalive_timeout(self):
+        return float(self.json['server'].get('keep-alive-timeout', 5))
+
+    """
+    number of requests served on a persistent connection before it is
+    closed.
+    """
+    def max_keepalive_requests(self):
+        return int(self.json['server'].get('max-keep-alive-requests', 100))
+
+    """
+    number of seconds a client has to send the head (request line and
+    headers) of a request, from the connection (or from the first byte of
+    a request on a persistent connection).
+    """
+    def header_timeout(self):
+        return float(self.json['server'].get('header-timeout', 10))
+
+    """
+    number of seconds a client has to send the body of a request, once its
+    head is received.
+    """
+    def body_timeout(self):
+        return float(self.json['server'].get('body-timeout', 30))
+
+    """
+    number of seconds a client may take to accept more of a response
+    before the connection is closed.
+    """
+    def write_timeout(self):
+        return float(self.json['server'].get('write-timeout', 30))
+
+    """
+    largest request head (request line and headers), in bytes. Larger
+    requests are answered with 431 Request Header Fields Too Large.
+    """
+    def max_header_size(self):
+        return int(self.json['server'].get('max-header-size', 8192))
+
+    """
+    largest request body, in bytes. Larger requests are answered with
+    413 Payload Too Large.
+    """
+    def max_body_size(self):
+        return int(self.json['server'].get('max-body-size', 1048576))
+
+    """
+    whether responses are compressed (gzip or deflate) for the clients
+    which accept it.
+    """
+    def compression(self):
+        return bool(self.json['server'].get('compression', True))
+
+    """
+    compression level, from 1 (fastest) to 9 (smallest).
+    """
+    def compression_level(self):
+        return int(self.json['server'].get('compression-level', 6))
+
+    """
+    smallest response compressed, in bytes. Smaller responses are sent
+    as is: compressing them would barely save a packet. Rendered pages are
+    compressed whatever their size: they are streamed, and their
+    Content-Encoding is chosen before their size is known.
+    """
+    def compression_min_size(self):
+        return int(self.json['server'].get('compression-min-size', 1024))
+
+    """
+    largest static file compressed, in bytes. Larger files are sent as is
+    with sendfile, without being read into memory.
+    """
+    def compression_max_size(self):
+        return int(self.json['server'].get('compression-max-size', 1048576))
+
+    """
+    memory used by the cache of the compressed responses, in bytes.
+    """
+    def compression_cache_size(self):
+        return int(self.json['server'].get('compression-cache-size', 16777216))
+
+    """
+    memory used by the cache of the rendered pages, in bytes (0: pages are
+    rendered on every request).
+    """
+    def page_cache_size(self):
+        return int(self.json['server'].get('page-cache-size', 16777216))
+
+    """
+    whether the rendered pages are also cached on disk, in the cache
+    directory of the repository (see cache.DiskCache), so that they
+    survive a restart.
+    """
+    def disk_cache(self):
+        return bool(self.json['server'].get('disk-cache', True))
+
+    """
+    directory of the render cache on disk.
+    """
+    def cache_dir(self):
+        return self.rd().joinpath('cache')
+
+    """
+    number of seconds a page may be served stale once its markdown file or
+    template changed: the previously rendered page is served at once while
+    it is rendered again in the background (0: a changed page is always
+    rendered before it is served).
+    """
+    def stale_while_revalidate(self):
+        return float(self.json['server'].get('stale-while-revalidate', 0))
+
+    """
+    whether requests are shed (answered with 503 at once) when they wait
+    too long for a worker thread. See shedding.py.
+    """
+    def load_shedding(self):
+        return bool(self.json['server'].get('load-shedding', True))
+
+    """
+    acceptable time a request waits for a worker thread, in seconds.
+    """
+    def queue_delay_target(self):
+        return float(self.json['server'].get('queue-delay-target', 0.1))
+
+    """
+    how long the queue delay must stay above the target before requests
+    are shed, in seconds.
+    """
+    def queue_delay_interval(self):
+        return float(self.json['server'].get('queue-delay-interval', 1.0))
+
+    """
+    number of seconds a client is asked to wait (Retry-After header)
+    before retrying a request which was shed.
+    """
+    def retry_after(self):
+        return int(self.json['server'].get('retry-after', 1))
+
+    """
+    number of seconds a draining server (SIGTERM, or replaced by a new
+    process on SIGUSR2) waits for the requests in flight before closing
+    their connections.
+    """
+    def graceful_timeout(self):
+        return float(self.json['server'].get('graceful-timeout', 30))
+
+    """
+    number of requests a process serves before it is replaced by a fresh
+    one (see recycling.py). 0: never.
+    """
+    def max_requests(self):
+        return int(self.json['server'].get('max-requests', 0))
+
+    """
+    resident set size beyond which a process is replaced by a fresh one
+    (see recycling.py). The setting is in megabytes (MB), e.g. 512; it is
+    returned in bytes. 0: never.
+    """
+    def max_rss(self):
+        return int(self.json['server'].get('max-rss', 0)) * 1024 * 1024
+
+    """
+    file the access log is appended to: "-" is the standard output, and
+    an empty string disables the access log.
+    """
+    def access_log(self):
+        return self.json['server'].get('access-log', '-')
+
+    """
+    whether every request and response (headers and body) is printed, a
+    la curl -v. Meant for debugging only: it is slower than serving.
+    """
+    def debug(self):
+        return bool(self.json['server'].get('debug', False))
+
     def dump(self):
         print(self.json)
@@ -0,0 +1,493 @@
+"""
+Event loop server core. The threaded WSGIServer dedicates a worker thread
+to every connection, from the first byte received to the last byte sent,
+so idle or slow clients hold workers that could be rendering. This core
+keeps every connection in non-blocking mode and multiplexes them in a
+single thread with a selector: accepting, reading requests and writing
+responses cost no thread at all. Only running the application (i.e.
+rendering Markdown) is handed to the worker threads (see lanes.py), and
+the rendered response is given back to the loop to be written.
+
+Select it with "core": "events" in the server config.
+"""
+
+"""
+selectors provides high-level I/O multiplexing built upon the select
+module primitives. DefaultSelector is the most efficient implementation
+available on the current platform (epoll on Linux, kqueue on BSD/macOS).
+[register]
+selector.register(fileobj, events, data) starts monitoring a file object
+for I/O events (EVENT_READ and/or EVENT_WRITE). data is an opaque object
+handed back by select(): here it is the callback to run on the event.
+[select]
+selector.select(timeout=None) waits until some registered file objects
+are ready, and returns a list of (key, events) tuples.
+"""
+import selectors
+import socket
+"""
+collections.deque is a list-like container with fast appends and pops on
+either end. append() and popleft() are thread-safe, which makes it a
+simple queue between the worker threads and the loop.
+"""
+import collections
+"""
+heapq implements a priority queue on a list: heappush(heap, item) adds an
+item, heappop(heap) removes the smallest one, and heap[0] is the smallest.
+"""
+import heapq
+import itertools
+import time
+import traceback
+
+from server import WSGIServer, Connection
+from request import HTTPError
+import response
+
+# WSGI server multiplexing all its connections in a single thread
+class EventLoopServer(WSGIServer):
+
+    # connections are accepted as fast as they come, so the listen backlog
+    # only has to absorb bursts (e.g. a browser opening its connections)
+    request_queue_size = 128
+
+    """
+    starts serving: runs the event loop until stopped with CTRL+C or
+    similar. The lanes of worker threads run the application only.
+    """
+    def serve_forever(self):
+        threads = self.config.server_threads()
+        # reported to the application as wsgi.multithread
+        self.multithread = threads > 1
+        self.selector = selectors.DefaultSelector()
+        # callbacks scheduled by the worker threads with call_soon
+        self.callbacks = collections.deque()
+        """
+        timers of the connections waiting for their client, as a heap of
+        (time, sequence number, connection) entries: the first entry is the
+        next one due. A connection has a single current entry (its timer);
+        when its deadline moves later (e.g. the client accepted more of the
+        response), the entry is not updated but pushed again once due.
+        """
+        self.timers = []
+        self.sequence = itertools.count()
+        """
+        socketpair() returns a pair of connected sockets. Writing a byte
+        in one end wakes up the selector, which waits for the other end
+        to become readable. This is how the workers interrupt select().
+        """
+        self.waker, self.wakeup_socket = socket.socketpair()
+        self.waker.setblocking(False)
+        self.wakeup_socket.setblocking(False)
+        self.install_signal_handlers()
+        # time by which a drain must be over (see stop_accepting)
+        self.drain_deadline = None
+        # accept() must never block the loop
+        self.listen_socket.setblocking(False)
+        self.selector.register(self.listen_socket, selectors.EVENT_READ, self.accept)
+        self.selector.register(self.waker, selectors.EVENT_READ, self.wake)
+        self.start_lanes()
+        try:
+            # serves until stopped with CTRL+C or similar, or drained
+            while not (self.draining and not self.connections):
+                for key, events in self.selector.select(self.next_timeout()):
+                    callback = key.data
+                    callback(key.fileobj, events)
+                self.expire()
+                if self.drain_deadline is not None and time.monotonic() >= self.drain_deadline:
+                    # out of time: the remaining requests are cut short
+                    for connection in list(self.connections):
+                        connection.close()
+                    break
+        finally:
+            self.stop_lanes()
+            if not self.multiprocess:
+                self.remove_socket_file()
+
+    """
+    returns how long select() may wait before the next timer is due
+    (None: for ever).
+    """
+    def next_timeout(self):
+        deadlines = [timer[0] for timer in self.timers[:1]]
+        if self.drain_deadline is not None:
+            deadlines.append(self.drain_deadline)
+        if deadlines:
+            return max(min(deadlines) - time.monotonic(), 0)
+        return None
+
+    """
+    makes sure the timer of a connection is due no later than its deadline.
+    """
+    def schedule(self, connection):
+        if connection.timer is None or connection.deadline < connection.timer[0]:
+            connection.timer = (connection.deadline, next(self.sequence), connection)
+            heapq.heappush(self.timers, connection.timer)
+
+    """
+    closes the connections whose client missed its deadline (see
+    Connection.expect).
+    """
+    def expire(self):
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            timer = heapq.heappop(self.timers)
+            connection = timer[2]
+            if timer is not connection.timer:
+                # replaced by an earlier timer
+                continue
+            connection.timer = None
+            if connection.deadline is None:
+                # the connection is not waiting for its client any more
+                continue
+            if connection.deadline <= now:
+                connection.timed_out()
+                connection.close()
+            else:
+                self.schedule(connection)
+
+    """
+    schedules callback(*args) to be run by the loop. This is the only
+    method of the server which may be called by a worker thread.
+    """
+    def call_soon(self, callback, *args):
+        self.callbacks.append((callback, args))
+        try:
+            self.wakeup_socket.send(b'\0')
+        except BlockingIOError:
+            # the loop already has wake-ups pending
+            pass
+
+    """
+    SIGTERM handler: the selector may not be used from a signal handler,
+    so the drain is started by the loop.
+    """
+    def drain(self):
+        self.call_soon(self.stop_accepting)
+
+    """
+    starts draining: closes the listening socket, and the persistent
+    connections waiting idle for a request. The other connections are
+    closed once their current request is served (see should_keep_alive),
+    and the loop exits when none is left, or at the graceful timeout.
+    """
+    def stop_accepting(self):
+        if self.draining:
+            return
+        self.draining = True
+        self.drain_deadline = time.monotonic() + self.config.graceful_timeout()
+        # the connections already waiting in the backlog are served, rather
+        # than reset when the socket is closed
+        self.accept(self.listen_socket, selectors.EVENT_READ)
+        self.selector.unregister(self.listen_socket)
+        self.listen_socket.close()
+        for connection in list(self.connections):
+            if connection.phase == 'idle':
+                connection.close()
+
+    """
+    runs the callbacks scheduled by the worker threads.
+    """
+    def wake(self, waker, events):
+        try:
+            while waker.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.callbacks:
+            callback, args = self.callbacks.popleft()
+            callback(*args)
+
+    """
+    accepts every pending connection. The listen backlog is drained at
+    once, so that a burst of browser connections is not refused.
+    """
+    def accept(self, listen_socket, events):
+        while True:
+            try:
+                client_connection, client_address = listen_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # e.g. the client reset the connection before accept(),
+                # or the process ran out of file descriptors
+                traceback.print_exc()
+                return
+            client_connection.setblocking(False)
+            connection = EventConnection(self, client_connection, client_address)
+            self.connections.add(connection)
+            connection.expect('header')
+            self.selector.register(client_connection, selectors.EVENT_READ, connection.readable)
+
+# Connection driven by the event loop
+class EventConnection(Connection):
+
+    def __init__(self, server, client_connection, client_address):
+        Connection.__init__(self, server, client_connection, client_address)
+        # request whose body is being received
+        self.incoming = None
+        # buffers of the response still to be sent
+        self.response_buffers = []
+        # False while a streamed response is still being produced
+        self.response_complete = True
+        # True while the responses held back are written (see flush)
+        self.flushing = False
+        self.closed = False
+        # current entry of the connection in the timers of the server
+        self.timer = None
+
+    """
+    enters a phase of the connection (see Connection.expect), and arms
+    its timer.
+    """
+    def expect(self, phase):
+        Connection.expect(self, phase)
+        self.server.schedule(self)
+
+    """
+    called by the loop when the client socket is readable. Receives into
+    the buffer of the parser (or into the body of the incoming request),
+    then processes what was received.
+    """
+    def readable(self, client_connection, events):
+        if self.incoming is None:
+            target = self.parser.free()
+        else:
+            target = self.incoming.body_free()
+        try:
+            received = client_connection.recv_into(target)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.close()
+            return
+        if not received:
+            # the client went away
+            self.close()
+            return
+        if self.incoming is None:
+            self.parser.received(received)
+            if self.phase == 'idle':
+                self.expect('header')
+        else:
+            self.incoming.body_received += received
+        self.process()
+
+    """
+    parses the received bytes, and hands the first complete request to a
+    worker thread. Requests after it (pipelined on a persistent connection)
+    stay in the buffer of the parser. Called while the client socket is
+    registered for reading.
+    """
+    def process(self):
+        request = self.incoming
+        try:
+            if request is None:
+                request = self.parser.parse()
+            if request is not None and request.is_http2_preface():
+                # HTTP/2 is served by the threads core only (see http2.py)
+                raise HTTPError('505 HTTP Version Not Supported', 'HTTP/2 is not supported by the event loop core.')
+        except HTTPError as error:
+            self.server.selector.unregister(self.client_connection)
+            self.respond(self.error_response(error))
+            return
+        if request is None or not request.body_complete():
+            # keep reading
+            if request is not None and self.incoming is None:
+                self.expect('body')
+            self.incoming = request
+            if self.held:
+                # the responses held back are sent before waiting for the
+                # client
+                self.server.selector.unregister(self.client_connection)
+                self.flush()
+            return
+        self.incoming = None
+        # stop reading: the response is rendered, then written
+        self.server.selector.unregister(self.client_connection)
+        self.phase = self.deadline = None
+        shedder = self.server.shedder
+        if shedder is not None and not shedder.enqueue():
+            # overloaded: answered at once with 503, without a worker
+            self.respond(self.overloaded_response(request))
+            return
+        self.queued_at = time.monotonic()
+        if not self.server.fast_lane.submit(self.run, request):
+            # the server is exiting
+            if shedder is not None:
+                shedder.cancel()
+            self.close()
+
+    """
+    called by the loop once a response is sent on a persistent connection:
+    starts the next request if it was already received, waits for it
+    otherwise.
+    """
+    def wait_for_request(self):
+        if self.incoming is not None:
+            self.expect('body')
+        else:
+            self.expect('header' if self.parser.pending() else 'idle')
+        self.server.selector.register(self.client_connection, selectors.EVENT_READ, self.readable)
+        self.process()
+
+    """
+    runs in a worker thread of the fast lane: calls the application and
+    builds the response, then gives it back to the loop to be written. A
+    streamed response is rendered as it is iterated: it is handed to the
+    render lane (see lanes.py).
+    """
+    def run(self, request):
+        if not self.admitted():
+            # the request waited too long for a worker: the server is
+            # overloaded, and the request is shed
+            self.server.call_soon(self.respond, self.overloaded_response(request))
+            return
+        if self.disconnected():
+            # the client went away while the request was queued
+            self.request = request
+            self.abort()
+            self.server.call_soon(self.respond, None)
+            return
+        try:
+            result = self.run_application(request)
+            buffers = self.build_response(result)
+        except Exception:
+            # report the error without killing the worker thread
+            traceback.print_exc()
+            self.server.call_soon(self.respond, None)
+            return
+        if not isinstance(buffers[-1], response.Stream):
+            self.server.call_soon(self.respond, buffers)
+        elif self.server.render_lane is None:
+            self.render(buffers)
+        elif not self.server.render_lane.submit(self.render, buffers):
+            # the render lane is full
+            response.close(buffers)
+            self.server.call_soon(self.respond, self.overloaded_response(request))
+
+    """
+    runs in a worker thread of the render lane: iterates a streamed
+    response, and gives it to the loop piece by piece, as the application
+    yields it. The rendering stops if the client goes away (see
+    Connection.check_connected).
+    """
+    def render(self, buffers):
+        stream = buffers.pop()
+        stream.check = self.check_connected
+        try:
+            for piece in stream:
+                buffers.extend(piece)
+                self.server.call_soon(self.respond, buffers, False)
+                buffers = []
+            self.response_length = stream.length
+        except ConnectionAbortedError:
+            response.close(buffers)
+            buffers = None
+        except Exception:
+            # report the error without killing the worker thread. A
+            # response which was partly sent cannot be completed: the
+            # connection is closed.
+            traceback.print_exc()
+            buffers = None
+        finally:
+            stream.close()
+        self.server.call_soon(self.respond, buffers)
+
+    """
+    called by the loop with the response, or the next piece of a streamed
+    response ([complete] False while more pieces are to come).
+    """
+    def respond(self, buffers, complete=True):
+        if self.closed:
+            # e.g. the client went away while its response was streamed
+            response.close(buffers or [])
+            return
+        if buffers is None:
+            self.close()
+            return
+        self.response_complete = complete
+        if not self.response_buffers and self.pipelined() and self.held_size < self.PIPELINE_BATCH_SIZE:
+            # the next request is already received: the response is held
+            # back, and written along with the next ones (see Connection.send)
+            self.held.extend(buffers)
+            self.held_size += sum(len(buffer) for buffer in buffers)
+            if complete:
+                self.response_sent()
+            return
+        if self.held:
+            buffers = self.held + buffers
+            self.held, self.held_size = [], 0
+        if not buffers:
+            if not self.response_buffers and complete:
+                # the end of a streamed response, whose pieces are all sent
+                self.response_sent()
+            return
+        if not self.response_buffers:
+            self.expect('write')
+            self.server.selector.register(self.client_connection, selectors.EVENT_WRITE, self.writable)
+        self.response_buffers.extend(buffers)
+
+    """
+    writes the responses held back, whose requests are all answered (and
+    logged): the connection then waits for its next request.
+    """
+    def flush(self):
+        self.response_buffers, self.held, self.held_size = self.held, [], 0
+        self.response_complete = True
+        self.flushing = True
+        self.expect('write')
+        self.server.selector.register(self.client_connection, selectors.EVENT_WRITE, self.writable)
+
+    """
+    called by the loop when the client socket is writable. Sends as much
+    of the response as the socket accepts. Once everything is sent, the
+    connection is closed, or waits for the next request if persistent.
+    The socket is registered for writing only while buffers are pending.
+    """
+    def writable(self, client_connection, events):
+        try:
+            self.response_buffers = response.send(client_connection, self.response_buffers)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.close()
+            return
+        # the client accepted more of the response: the write timeout
+        # starts over
+        self.deadline = time.monotonic() + self.timeout('write')
+        if not self.response_buffers:
+            self.server.selector.unregister(client_connection)
+            # waiting for the application, not for the client
+            self.phase = self.deadline = None
+            if self.flushing:
+                self.flushing = False
+                self.wait_for_request()
+            elif self.response_complete:
+                self.response_sent()
+
+    """
+    called by the loop once the whole response is sent.
+    """
+    def response_sent(self):
+        self.log_request()
+        if self.close_connection or self.server.draining:
+            self.close()
+        else:
+            self.wait_for_request()
+
+    """
+    stops monitoring the client socket and closes it.
+    """
+    def close(self):
+        self.closed = True
+        self.phase = self.deadline = None
+        self.server.connections.discard(self)
+        response.close(self.response_buffers)
+        response.close(self.held)
+        try:
+            self.server.selector.unregister(self.client_connection)
+        except (KeyError, ValueError):
+            # not registered (e.g. while the response is rendered)
+            pass
+        self.client_connection.close()
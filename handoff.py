@@ -0,0 +1,70 @@
+"""
+Zero-downtime restart. On SIGUSR2 the server starts a new copy of itself
+(same command line, so with the new code, theme and config on disk), and
+hands it the listening socket: the socket is inherited by the new process
+as an open file descriptor, whose number is passed in an environment
+variable. Both processes accept connections on the same socket for a
+moment, then the new one, once ready to serve, sends SIGTERM to the old
+one, which stops accepting and drains its in-flight requests (see
+WSGIServer.drain). No connection is ever refused: the listening socket
+is never closed.
+
+    kill -USR2 <pid of muggle.py>
+
+The same scheme is used by nginx and unicorn.
+"""
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+
+# environment variables of the new process
+LISTEN_FD = 'MUGGLE_LISTEN_FD'
+PREDECESSOR_PID = 'MUGGLE_PREDECESSOR_PID'
+
+"""
+returns the listening socket inherited from the previous process, or None
+if the process was not started by a handoff. The variable is removed from
+the environment, so that the socket is only taken over once.
+[socket.socket(fileno=fd)]
+creates a socket object for an open file descriptor, whose address family
+and type are detected.
+"""
+def inherited_socket():
+    fd = os.environ.pop(LISTEN_FD, None)
+    if fd is None:
+        return None
+    return socket.socket(fileno=int(fd))
+
+"""
+starts the new process, with the listening socket open in it (None: the
+new process binds its own socket, e.g. with SO_REUSEPORT). Returns the
+subprocess.Popen of the new process.
+[pass_fds]
+the file descriptors which stay open in the new process. Every other file
+descriptor is closed.
+"""
+def spawn_successor(listen_socket=None):
+    env = dict(os.environ)
+    env[PREDECESSOR_PID] = str(os.getpid())
+    pass_fds = ()
+    if listen_socket is not None:
+        env[LISTEN_FD] = str(listen_socket.fileno())
+        pass_fds = (listen_socket.fileno(),)
+    print('Muggle[{pid}]: starting a new process to take over'.format(pid=os.getpid()), file=sys.stderr, flush=True)
+    return subprocess.Popen([sys.executable] + sys.argv, env=env, pass_fds=pass_fds)
+
+"""
+called by the new process once it is ready to serve: tells the previous
+process, if any, to drain and exit.
+"""
+def notify_predecessor():
+    pid = os.environ.pop(PREDECESSOR_PID, None)
+    if pid is None:
+        return
+    try:
+        os.kill(int(pid), signal.SIGTERM)
+    except ProcessLookupError:
+        pass
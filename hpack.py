@@ -0,0 +1,361 @@
+"""
+HPACK, the header compression of HTTP/2 (RFC 7541). The headers of a
+request or response are sent as a header block, in which each header is
+either:
+* an index into a table of headers already known to both ends: the
+  static table (61 common headers defined by the RFC, e.g. ':method: GET')
+  followed by the dynamic table (the headers the sender chose to add to
+  it, the most recent first);
+* a literal, whose name may still be an index, and which the sender may
+  add to the dynamic table, so that it is sent as an index next time.
+Each end of a connection has an encoder and a decoder, and the dynamic
+table of a decoder mirrors the one of the encoder at the other end: the
+header blocks must be decoded in the order they were encoded, and every
+header block must be decoded (even the one of a refused request).
+
+The strings may be Huffman coded, with a static code built for HTTP
+headers (lowercase letters and digits take 5 or 6 bits instead of 8).
+"""
+
+# Error in a header block: the connection can't go on (COMPRESSION_ERROR)
+class HPACKError(Exception):
+    pass
+
+# the static table (RFC 7541 appendix A): index 1 is the first entry
+STATIC_TABLE = [
+    (':authority', ''), (':method', 'GET'), (':method', 'POST'),
+    (':path', '/'), (':path', '/index.html'), (':scheme', 'http'),
+    (':scheme', 'https'), (':status', '200'), (':status', '204'),
+    (':status', '206'), (':status', '304'), (':status', '400'),
+    (':status', '404'), (':status', '500'), ('accept-charset', ''),
+    ('accept-encoding', 'gzip, deflate'), ('accept-language', ''),
+    ('accept-ranges', ''), ('accept', ''), ('access-control-allow-origin', ''),
+    ('age', ''), ('allow', ''), ('authorization', ''), ('cache-control', ''),
+    ('content-disposition', ''), ('content-encoding', ''),
+    ('content-language', ''), ('content-length', ''), ('content-location', ''),
+    ('content-range', ''), ('content-type', ''), ('cookie', ''), ('date', ''),
+    ('etag', ''), ('expect', ''), ('expires', ''), ('from', ''), ('host', ''),
+    ('if-match', ''), ('if-modified-since', ''), ('if-none-match', ''),
+    ('if-range', ''), ('if-unmodified-since', ''), ('last-modified', ''),
+    ('link', ''), ('location', ''), ('max-forwards', ''),
+    ('proxy-authenticate', ''), ('proxy-authorization', ''), ('range', ''),
+    ('referer', ''), ('refresh', ''), ('retry-after', ''), ('server', ''),
+    ('set-cookie', ''), ('strict-transport-security', ''),
+    ('transfer-encoding', ''), ('user-agent', ''), ('vary', ''), ('via', ''),
+    ('www-authenticate', '')
+]
+# index of each static entry, and of the first entry of each name
+STATIC_INDEX = {}
+STATIC_NAME_INDEX = {}
+for index, (name, value) in enumerate(STATIC_TABLE, 1):
+    STATIC_INDEX.setdefault((name, value), index)
+    STATIC_NAME_INDEX.setdefault(name, index)
+
+# size of the dynamic tables, unless the decoder of the client asks for
+# less (SETTINGS_HEADER_TABLE_SIZE)
+DEFAULT_TABLE_SIZE = 4096
+
+"""
+The Huffman code (RFC 7541 appendix B) is canonical: the codes are given
+out in order of length, then of symbol, each one the previous one plus 1
+(shifted left when the length grows). So the code is fully described by
+the length of the code of each symbol: the 256 byte values, then EOS
+(end of string), whose prefix pads the last byte of a string.
+"""
+HUFFMAN_LENGTHS = bytes.fromhex(
+    '0d171c1c1c1c1c1c1c181e1c1c1e1c1c1c1c1c1c1c1c1e1c1c1c1c1c1c1c1c1c060a0a'
+    '0c0d06080b0a0a080b080606060505050606060606060607080f060c0a0d0607070707'
+    '0707070707070707070707070707070707070807080d130d0e060f0506050605060606'
+    '0507070606060506070605050607070707070f0b0e0d1c141614141616161716171717'
+    '1717181718181617181717171715161716171718161514161617171517161618151617'
+    '17151516151716171714161616171616171a1a1413161716191a1a1a1b1b1a18191315'
+    '1a1b1b1a1b1815151a1a1c1b1b1b14181415161515171616191918181a171a1b1a1a1b'
+    '1b1b1b1b1c1b1b1b1b1b1a1e'
+)
+EOS = 256
+
+"""
+returns the codes of the symbols, as a list of (code, length), built
+from their lengths.
+"""
+def huffman_codes(lengths):
+    codes = [ None ] * len(lengths)
+    code, previous = -1, 0
+    for symbol in sorted(range(len(lengths)), key=lambda symbol: (lengths[symbol], symbol)):
+        code = (code + 1) << (lengths[symbol] - previous)
+        previous = lengths[symbol]
+        codes[symbol] = (code, previous)
+    return codes
+
+HUFFMAN_CODES = huffman_codes(HUFFMAN_LENGTHS)
+# the symbols by (length, code), for the decoder
+HUFFMAN_SYMBOLS = { (length, code): symbol for symbol, (code, length) in enumerate(HUFFMAN_CODES) }
+SHORTEST_CODE = min(HUFFMAN_LENGTHS)
+
+"""
+returns the Huffman coding of data (bytes). The last byte is padded with
+1 bits (a prefix of the EOS code).
+"""
+def huffman_encode(data):
+    bits, count = 0, 0
+    for byte in data:
+        code, length = HUFFMAN_CODES[byte]
+        bits = (bits << length) | code
+        count += length
+    padding = -count % 8
+    bits = (bits << padding) | ((1 << padding) - 1)
+    return bits.to_bytes((count + padding) // 8, 'big')
+
+"""
+decodes a Huffman coded string. Raises HPACKError if the padding is
+longer than 7 bits or not a prefix of EOS, or if EOS is decoded.
+"""
+def huffman_decode(data):
+    decoded = bytearray()
+    code, length = 0, 0
+    for byte in data:
+        for shift in range(7, -1, -1):
+            code = (code << 1) | ((byte >> shift) & 1)
+            length += 1
+            if length < SHORTEST_CODE:
+                continue
+            symbol = HUFFMAN_SYMBOLS.get((length, code))
+            if symbol is None:
+                if length > 30:
+                    raise HPACKError('invalid Huffman code')
+                continue
+            if symbol == EOS:
+                raise HPACKError('EOS in a Huffman coded string')
+            decoded.append(symbol)
+            code, length = 0, 0
+    if length > 7 or code != (1 << length) - 1:
+        raise HPACKError('invalid Huffman padding')
+    return bytes(decoded)
+
+"""
+encodes an integer with an n-bit prefix (RFC 7541 5.1): values below
+2^n - 1 fit in the prefix, larger ones continue in the next bytes, 7 bits
+at a time. flags are the bits of the first byte above the prefix.
+"""
+def encode_integer(value, n, flags=0):
+    limit = (1 << n) - 1
+    if value < limit:
+        return bytes([ flags | value ])
+    encoded = bytearray([ flags | limit ])
+    value -= limit
+    while value >= 128:
+        encoded.append((value & 127) | 128)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+"""
+decodes an integer with an n-bit prefix at data[position]. Returns the
+value and the position after it.
+"""
+def decode_integer(data, position, n):
+    if position >= len(data):
+        raise HPACKError('truncated header block')
+    limit = (1 << n) - 1
+    value = data[position] & limit
+    position += 1
+    if value < limit:
+        return value, position
+    shift = 0
+    while True:
+        if position >= len(data):
+            raise HPACKError('truncated header block')
+        byte = data[position]
+        position += 1
+        value += (byte & 127) << shift
+        shift += 7
+        if not byte & 128:
+            return value, position
+        if shift > 28:
+            raise HPACKError('integer too large')
+
+"""
+encodes a string literal, Huffman coded when that is shorter.
+"""
+def encode_string(data):
+    coded = huffman_encode(data)
+    if len(coded) < len(data):
+        return encode_integer(len(coded), 7, 0x80) + coded
+    return encode_integer(len(data), 7) + data
+
+"""
+decodes a string literal at data[position]. Returns it (str, latin-1 like
+every HTTP header) and the position after it.
+"""
+def decode_string(data, position):
+    huffman = position < len(data) and data[position] & 0x80
+    length, position = decode_integer(data, position, 7)
+    end = position + length
+    if end > len(data):
+        raise HPACKError('truncated header block')
+    string = bytes(data[position:end])
+    if huffman:
+        string = huffman_decode(string)
+    return string.decode('latin-1'), end
+
+# Dynamic table of an encoder or a decoder
+class DynamicTable(object):
+
+    def __init__(self, max_size=DEFAULT_TABLE_SIZE):
+        # entries, the most recent first: (name, value)
+        self.entries = []
+        # size of the table: the sum of the sizes of its entries, each the
+        # length of its name and value plus 32 (RFC 7541 4.1)
+        self.size = 0
+        self.max_size = max_size
+
+    """
+    adds an entry, evicting the oldest ones to make room for it. An entry
+    larger than the table empties it.
+    """
+    def add(self, name, value):
+        size = len(name) + len(value) + 32
+        self.entries.insert(0, (name, value))
+        self.size += size
+        self.evict()
+
+    """
+    changes the size of the table, evicting the entries which no longer fit.
+    """
+    def resize(self, max_size):
+        self.max_size = max_size
+        self.evict()
+
+    def evict(self):
+        while self.size > self.max_size:
+            name, value = self.entries.pop()
+            self.size -= len(name) + len(value) + 32
+
+    """
+    returns the entry at index (counted from 1, after the static table).
+    """
+    def get(self, index):
+        if index <= len(STATIC_TABLE):
+            if index < 1:
+                raise HPACKError('invalid index 0')
+            return STATIC_TABLE[index - 1]
+        index -= len(STATIC_TABLE) + 1
+        if index >= len(self.entries):
+            raise HPACKError('invalid index')
+        return self.entries[index]
+
+    """
+    returns the index of an entry, or of the first entry with its name
+    (0 if none), and whether the value matches.
+    """
+    def find(self, name, value):
+        index = STATIC_INDEX.get((name, value))
+        if index is not None:
+            return index, True
+        name_index = STATIC_NAME_INDEX.get(name, 0)
+        for position, entry in enumerate(self.entries):
+            if entry[0] == name:
+                if entry[1] == value:
+                    return len(STATIC_TABLE) + 1 + position, True
+                if not name_index:
+                    name_index = len(STATIC_TABLE) + 1 + position
+        return name_index, False
+
+# Decoder of the header blocks received on a connection
+class Decoder(object):
+
+    """
+    [max_table_size]
+    largest dynamic table the encoder may use: the size advertised in the
+    SETTINGS_HEADER_TABLE_SIZE setting (4096 by default).
+    """
+    def __init__(self, max_table_size=DEFAULT_TABLE_SIZE):
+        self.max_table_size = max_table_size
+        self.table = DynamicTable(max_table_size)
+
+    """
+    decodes a header block. Returns the list of (name, value) tuples.
+    Raises HPACKError if the block is malformed.
+    """
+    def decode(self, data):
+        data = memoryview(data)
+        headers = []
+        position = 0
+        while position < len(data):
+            byte = data[position]
+            if byte & 0x80:
+                # indexed header field
+                index, position = decode_integer(data, position, 7)
+                headers.append(self.table.get(index))
+                continue
+            if byte & 0xe0 == 0x20:
+                # dynamic table size update, only before the first header
+                size, position = decode_integer(data, position, 5)
+                if headers or size > self.max_table_size:
+                    raise HPACKError('invalid dynamic table size update')
+                self.table.resize(size)
+                continue
+            # literal: with incremental indexing (01), without indexing
+            # (0000) or never indexed (0001)
+            indexing = byte & 0x40
+            index, position = decode_integer(data, position, 6 if indexing else 4)
+            if index:
+                name = self.table.get(index)[0]
+            else:
+                name, position = decode_string(data, position)
+            value, position = decode_string(data, position)
+            if indexing:
+                self.table.add(name, value)
+            headers.append((name, value))
+        return headers
+
+# Encoder of the header blocks sent on a connection
+class Encoder(object):
+
+    # headers whose value changes with every response: adding them to the
+    # dynamic table would only evict the useful entries
+    NOT_INDEXED = frozenset([ 'date', 'content-length', 'etag', 'last-modified',
+        'content-range', 'set-cookie', 'age', 'expires', 'location' ])
+
+    def __init__(self):
+        self.table = DynamicTable()
+        # size of the table the encoder must announce at the beginning of
+        # the next header block (None: unchanged)
+        self.pending_size = None
+
+    """
+    called when the decoder at the other end announces the size of its
+    dynamic table (SETTINGS_HEADER_TABLE_SIZE). The encoder uses no more
+    than DEFAULT_TABLE_SIZE anyway.
+    """
+    def resize(self, max_size):
+        max_size = min(max_size, DEFAULT_TABLE_SIZE)
+        if max_size != self.table.max_size:
+            self.table.resize(max_size)
+            self.pending_size = max_size
+
+    """
+    encodes a list of (name, value) tuples (lowercase names) into a header
+    block (bytes).
+    """
+    def encode(self, headers):
+        block = bytearray()
+        if self.pending_size is not None:
+            block += encode_integer(self.pending_size, 5, 0x20)
+            self.pending_size = None
+        for name, value in headers:
+            index, exact = self.table.find(name, value)
+            if exact:
+                block += encode_integer(index, 7, 0x80)
+                continue
+            indexing = name not in self.NOT_INDEXED
+            if indexing:
+                block += encode_integer(index, 6, 0x40)
+            else:
+                block += encode_integer(index, 4)
+            if not index:
+                block += encode_string(name.encode('latin-1'))
+            block += encode_string(value.encode('latin-1'))
+            if indexing:
+                self.table.add(name, value)
+        return bytes(block)
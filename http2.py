@@ -0,0 +1,918 @@
+"""
+HTTP/2 over cleartext TCP (h2c, RFC 9113), for the threads core. A page
+of the docs pulls the rendered page and the assets of the theme: HTTP/1.1
+serves them one at a time per connection, HTTP/2 multiplexes them on a
+single connection, each request and its response on a stream of its own.
+
+A client starts HTTP/2 in either of two ways:
+* prior knowledge: it sends the connection preface
+      PRI * HTTP/2.0\\r\\n\\r\\nSM\\r\\n\\r\\n
+  right away (e.g. a reverse proxy configured for it, curl
+  --http2-prior-knowledge);
+* upgrade: it sends an HTTP/1.1 request with 'Upgrade: h2c' (e.g. curl
+  --http2). The server answers '101 Switching Protocols', the request
+  becomes stream 1 and is answered in HTTP/2, then the client sends the
+  preface.
+
+Everything is then sent in frames, each with a 9 byte header:
+    +-----------------------------------------------+
+    |                 Length (24)                   |
+    +---------------+---------------+---------------+
+    |   Type (8)    |   Flags (8)   |
+    +-+-------------+---------------+-------------------------------+
+    |R|                 Stream Identifier (31)                      |
+    +=+=============================================================+
+    |                   Frame Payload (0...)                      ...
+    +---------------------------------------------------------------+
+The headers of a request or response are compressed with HPACK (see
+hpack.py), the bodies are sent in DATA frames. Each DATA frame consumes
+the flow control windows of its stream and of the connection: the
+receiver gives credit back with WINDOW_UPDATE frames as it consumes the
+data, so that a slow client holds the responses back instead of having
+them all buffered.
+
+The thread serving the connection reads the frames and runs the
+application for each request as soon as it is complete (the application
+only looks up the files and the caches: it is cheap), and queues the
+response. A page to render goes to the render lane (see lanes.py): the
+pages of the streams of a connection are rendered at once, each by a
+thread of the lane, and their frames are interleaved on the connection.
+Server push and priorities are not implemented (a client may not rely on
+either).
+"""
+
+import selectors
+import socket
+import struct
+import threading
+import time
+import traceback
+
+import hpack
+import response
+from request import HTTPError, Request
+from server import Connection
+
+# the connection preface of the client
+PREFACE = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n'
+# the end of the preface, left once 'PRI * HTTP/2.0\r\n\r\n' has been
+# parsed as an HTTP/1.x request
+PREFACE_END = b'SM\r\n\r\n'
+
+# frame types
+DATA = 0x0
+HEADERS = 0x1
+PRIORITY = 0x2
+RST_STREAM = 0x3
+SETTINGS = 0x4
+PUSH_PROMISE = 0x5
+PING = 0x6
+GOAWAY = 0x7
+WINDOW_UPDATE = 0x8
+CONTINUATION = 0x9
+
+# frame flags
+END_STREAM = 0x1
+ACK = 0x1
+END_HEADERS = 0x4
+PADDED = 0x8
+PRIORITY_FLAG = 0x20
+
+# settings
+SETTINGS_HEADER_TABLE_SIZE = 0x1
+SETTINGS_ENABLE_PUSH = 0x2
+SETTINGS_MAX_CONCURRENT_STREAMS = 0x3
+SETTINGS_INITIAL_WINDOW_SIZE = 0x4
+SETTINGS_MAX_FRAME_SIZE = 0x5
+SETTINGS_MAX_HEADER_LIST_SIZE = 0x6
+
+# error codes of RST_STREAM and GOAWAY
+NO_ERROR = 0x0
+PROTOCOL_ERROR = 0x1
+INTERNAL_ERROR = 0x2
+FLOW_CONTROL_ERROR = 0x3
+STREAM_CLOSED = 0x5
+FRAME_SIZE_ERROR = 0x6
+REFUSED_STREAM = 0x7
+CANCEL = 0x8
+COMPRESSION_ERROR = 0x9
+
+# initial flow control windows, and largest frame payload, until the
+# settings of the client say otherwise. The server keeps these for what
+# it receives.
+DEFAULT_WINDOW_SIZE = 65535
+DEFAULT_FRAME_SIZE = 16384
+MAX_WINDOW_SIZE = 2 ** 31 - 1
+MAX_FRAME_SIZE = 2 ** 24 - 1
+
+# frame header: length (24 bits) and type, flags, stream identifier
+FRAME_HEADER = struct.Struct('>IBI')
+
+# headers of HTTP/1.1 which make no sense in HTTP/2 (the connection is
+# managed by the frames): they are not sent, and a request with them is
+# malformed
+CONNECTION_HEADERS = frozenset([ 'connection', 'keep-alive', 'proxy-connection',
+    'transfer-encoding', 'upgrade' ])
+
+# Error which ends the connection, with a GOAWAY frame
+class H2Error(Exception):
+
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+
+"""
+returns a frame as a list of buffers: its header, and its payload.
+"""
+def frame(frame_type, flags, stream_id, payload=b''):
+    header = FRAME_HEADER.pack(len(payload) << 8 | frame_type, flags, stream_id)
+    return [ header, payload ] if payload else [ header ]
+
+"""
+returns the payload of a SETTINGS frame.
+"""
+def settings_payload(settings):
+    return b''.join(struct.pack('>HI', setting, value) for setting, value in settings)
+
+"""
+returns the payload of a frame without its padding: with the PADDED flag,
+the first byte is the length of the padding at the end.
+"""
+def unpad(flags, payload):
+    if not flags & PADDED:
+        return payload
+    if not payload or payload[0] >= len(payload):
+        raise H2Error(PROTOCOL_ERROR, 'invalid padding')
+    return payload[1:len(payload) - payload[0]]
+
+"""
+builds the request of a stream out of its decoded headers. The request
+line is in pseudo-headers (':method', ':path'...), which come first; the
+host is ':authority'. Raises HTTPError for a malformed request.
+"""
+def make_request(headers):
+    pseudo = {}
+    fields = []
+    cookies = []
+    for name, value in headers:
+        if name.startswith(':'):
+            if fields or name in pseudo or name not in (':method', ':scheme', ':authority', ':path'):
+                raise HTTPError('400 Bad Request', 'The pseudo-headers are malformed.')
+            pseudo[name] = value
+        elif name != name.lower() or name in CONNECTION_HEADERS:
+            raise HTTPError('400 Bad Request', 'A header is malformed.')
+        elif name == 'te' and value.strip().lower() != 'trailers':
+            raise HTTPError('400 Bad Request', 'A header is malformed.')
+        elif name == 'cookie':
+            # the cookie header may be split in several ones
+            cookies.append(value)
+        else:
+            fields.append((name, value))
+    if not pseudo.get(':method') or not pseudo.get(':path') or ':scheme' not in pseudo:
+        raise HTTPError('400 Bad Request', 'The pseudo-headers are incomplete.')
+    if cookies:
+        fields.append(('cookie', '; '.join(cookies)))
+    if ':authority' in pseudo and not any(name == 'host' for name, value in fields):
+        fields.insert(0, ('host', pseudo[':authority']))
+    return Request(pseudo[':method'], pseudo[':path'], 'HTTP/2.0', fields)
+
+# A stream: one request of an HTTP/2 connection, and its response
+class H2Stream(Connection):
+
+    """
+    The stream is a Connection of its own for the application and the
+    access log (run_application, get_environ, start_response, log_request
+    are inherited), but it reads and writes the socket through the session
+    of the connection.
+    [session]
+    the H2Session of the connection.
+    [stream_id]
+    identifier of the stream (odd: opened by the client).
+    """
+    def __init__(self, session, stream_id):
+        self.session = session
+        self.stream_id = stream_id
+        self.server = session.server
+        self.client_connection = session.connection.client_connection
+        self.client_address = session.connection.client_address
+        self.headers_set = []
+        self.request = None
+        self.requests_handled = 0
+        self.close_connection = False
+        self.phase = self.deadline = None
+        self.queued_at = time.monotonic()
+        self.held = []
+        self.held_size = 0
+        self.response_status = None
+        self.response_length = 0
+        # whether the request is still being received (its body)
+        self.receiving = True
+        # the headers of the response, sent before the body (see respond)
+        self.response_headers = None
+        # the body still to be sent: bytes-like buffers and FileWrappers,
+        # sent as the flow control windows allow (see H2Session.pump)
+        self.outbound = []
+        # whether the end of the body is queued, and whether it was sent
+        self.end = False
+        self.ended = False
+        # flow control window of the stream, for sending
+        self.window = session.initial_window
+        # whether the stream was reset (by the client, or by the server)
+        self.reset = False
+
+    """
+    the connection of a stream is never closed after its response.
+    """
+    def should_keep_alive(self):
+        return True
+
+    """
+    raises ConnectionAbortedError (after abort) if the client reset the
+    stream or closed the connection: the page being rendered for it is
+    not needed any more.
+    """
+    def check_connected(self):
+        if self.reset or self.session.closed:
+            self.abort()
+            raise ConnectionAbortedError('the client reset the stream')
+
+    """
+    called in the thread of the connection once the request is complete:
+    runs the application, and queues the response. A page to render goes
+    to the render lane, or is rendered here if there is none.
+    """
+    def serve(self):
+        try:
+            result = self.run_application(self.request)
+        except Exception:
+            traceback.print_exc()
+            self.session.reset_stream(self.stream_id, INTERNAL_ERROR)
+            return
+        body = self.respond(result)
+        if body is None:
+            return
+        render_lane = self.server.render_lane
+        if render_lane is None:
+            self.render(body, False)
+        elif not render_lane.submit(self.render, body, True):
+            body.close()
+            self.fail(self.overloaded_error())
+
+    """
+    builds the headers of the response out of the result of the
+    application, as Connection.build_response does for HTTP/1.1, and queues
+    the response. Returns the body if it is to be rendered (a
+    response.Stream), None if the response is queued.
+    """
+    def respond(self, result):
+        status, response_headers = self.headers_set
+        headers = [ (':status', status.split(' ', 1)[0]) ]
+        headers.extend((name.lower(), str(value)) for name, value in response_headers
+            if name.lower() not in CONNECTION_HEADERS)
+        names = [ name for name, value in headers ]
+        body = []
+        stream = None
+        if self.request.method == 'HEAD':
+            if isinstance(result, (list, tuple)):
+                if 'content-length' not in names and not status.startswith('304'):
+                    headers.append(('content-length', str(sum(map(len, result)))))
+            elif hasattr(result, 'close'):
+                result.close()
+        elif isinstance(result, response.FileWrapper) and result.count is not None:
+            if 'content-length' in names:
+                result.count = min(result.count, int(headers[names.index('content-length')][1]))
+            body = [ result ]
+        elif isinstance(result, (list, tuple)):
+            body = list(result)
+            if 'content-length' not in names and not status.startswith('304'):
+                headers.append(('content-length', str(sum(map(len, body)))))
+        else:
+            # the end of the body is the END_STREAM flag: it is never chunked
+            stream = response.Stream(result, False)
+        self.response_status = status
+        self.response_length = sum(map(len, body))
+        if stream is not None:
+            self.response_headers = headers
+            return stream
+        if self.session.send_headers(self, headers, not body):
+            self.session.send_data(self, body, True, False)
+        else:
+            response.close(body)
+        self.log_request()
+        return None
+
+    """
+    sends a page as it is rendered.
+    [block]
+    whether to wait for the client to consume the page as it is sent (in
+    a thread of the render lane), or to queue all of it (in the thread of
+    the connection, which must go on reading the frames).
+    """
+    def render(self, body, block):
+        body.check = self.check_connected
+        try:
+            if self.session.send_headers(self, self.response_headers, False):
+                for piece in body:
+                    self.session.send_data(self, piece, False, block)
+                self.session.send_data(self, [], True, block)
+                self.response_length = body.length
+                self.log_request()
+        except ConnectionAbortedError:
+            # logged by check_connected
+            pass
+        except socket.timeout:
+            # the client does not consume the page
+            self.server.count_timeout('write')
+            self.session.reset_stream(self.stream_id, CANCEL)
+        except OSError:
+            # the connection failed
+            pass
+        except Exception:
+            traceback.print_exc()
+            self.session.reset_stream(self.stream_id, INTERNAL_ERROR)
+        finally:
+            body.close()
+
+    """
+    answers the stream with an error (e.g. a malformed request).
+    """
+    def fail(self, error):
+        body = error.message.encode('utf-8')
+        self.response_status = error.status
+        self.response_length = len(body)
+        headers = [
+            (':status', error.status.split(' ', 1)[0]),
+            ('content-type', 'text/plain; charset=utf-8'),
+            ('content-length', str(len(body)))
+        ]
+        headers.extend((name.lower(), str(value)) for name, value in error.headers)
+        if self.session.send_headers(self, headers, False):
+            self.session.send_data(self, [ body ], True, False)
+        self.log_request()
+        if self.receiving:
+            # the rest of the request is not needed (RFC 9113 8.1)
+            self.session.reset_stream(self.stream_id, NO_ERROR)
+
+    """
+    takes up to n bytes of the body to be sent, from the front of the
+    outbound buffers. Returns b'' if there is none.
+    """
+    def take(self, n):
+        while self.outbound:
+            item = self.outbound[0]
+            if isinstance(item, response.FileWrapper):
+                # the file is read as the windows allow, not all at once
+                data = b''
+                if item.count:
+                    item.filelike.seek(item.offset)
+                    data = item.filelike.read(min(n, item.count))
+                if not data:
+                    item.close()
+                    self.outbound.pop(0)
+                    continue
+                item.offset += len(data)
+                item.count -= len(data)
+                return data
+            if len(item) <= n:
+                self.outbound.pop(0)
+                if not len(item):
+                    continue
+                return item
+            view = memoryview(item)
+            self.outbound[0] = view[n:]
+            return view[:n]
+        return b''
+
+    """
+    drops the body not sent yet, e.g. when the stream is reset.
+    """
+    def cancel(self):
+        self.reset = True
+        response.close(self.outbound)
+        self.outbound = []
+
+# State of an HTTP/2 connection
+class H2Session(object):
+
+    """
+    [connection]
+    the server.Connection which received the preface or the upgrade
+    request. Its socket, address and buffered bytes are taken over.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.server = connection.server
+        self.client_connection = connection.client_connection
+        config = self.server.config
+        self.max_streams = config.http2_max_streams()
+        self.max_header_size = config.max_header_size()
+        self.max_body_size = config.max_body_size()
+        # header compression, in each direction
+        self.decoder = hpack.Decoder()
+        self.encoder = hpack.Encoder()
+        """
+        the lock serializes the frames sent by the thread of the connection
+        and by the threads of the render lane, and guards the streams and
+        the flow control windows. The render threads wait on the condition
+        for their body to be sent.
+        """
+        self.lock = threading.Lock()
+        self.sent = threading.Condition(self.lock)
+        # the open streams, by identifier (in the order they were opened)
+        self.streams = {}
+        # identifier of the last stream opened by the client
+        self.last_stream_id = 0
+        # flow control window of the connection, for sending; initial
+        # window of the streams and largest frame, set by the client
+        self.window = DEFAULT_WINDOW_SIZE
+        self.initial_window = DEFAULT_WINDOW_SIZE
+        self.max_frame_size = DEFAULT_FRAME_SIZE
+        # frames waiting to be sent, as buffers
+        self.frames = []
+        # bytes received and not parsed yet
+        self.buffer = bytearray()
+        # the header block being received in CONTINUATION frames:
+        # [stream identifier, flags of the HEADERS frame, fragments]
+        self.continuation = None
+        # whether GOAWAY was sent (no new stream is accepted) or received
+        self.goaway_sent = False
+        self.goaway_received = False
+        # whether the connection is closed
+        self.closed = False
+
+    """
+    serves the connection until it is closed.
+    [upgrade]
+    the request which asked for the upgrade to HTTP/2, answered on stream
+    1, and the settings of its HTTP2-Settings header (None: prior
+    knowledge).
+    """
+    def run(self, upgrade=None):
+        connection = self.connection
+        self.client_connection.settimeout(connection.timeout('write'))
+        # the bytes received after the preface or the upgrade request
+        parser = connection.parser
+        self.buffer += parser.view[parser.start:parser.end]
+        parser.start = parser.end = parser.scanned = 0
+        preface = PREFACE_END
+        with self.lock:
+            if upgrade is not None:
+                preface = PREFACE
+                self.frames.append(b'HTTP/1.1 101 Switching Protocols\r\nConnection: Upgrade\r\nUpgrade: h2c\r\n\r\n')
+            self.frames.extend(frame(SETTINGS, 0, 0, settings_payload([
+                (SETTINGS_MAX_CONCURRENT_STREAMS, self.max_streams),
+                (SETTINGS_MAX_HEADER_LIST_SIZE, self.max_header_size)
+            ])))
+            self.write()
+        try:
+            if upgrade is not None:
+                request, settings = upgrade
+                # the settings of the header are acknowledged by the 101
+                self.apply_settings(settings)
+                self.last_stream_id = 1
+                stream = self.open_stream(1, request)
+                stream.receiving = False
+                stream.serve()
+            self.serve(preface)
+        except H2Error as error:
+            self.goaway(error.code)
+        except hpack.HPACKError:
+            self.goaway(COMPRESSION_ERROR)
+        except socket.timeout:
+            # the client does not accept the frames
+            self.server.count_timeout('write')
+        except OSError:
+            # the client went away
+            pass
+        finally:
+            with self.lock:
+                self.closed = True
+                for stream in self.streams.values():
+                    stream.cancel()
+                self.streams.clear()
+                self.sent.notify_all()
+            connection.phase = None
+
+    """
+    reads and handles the frames until the client closes the connection,
+    or stays idle for longer than the keep-alive timeout. After GOAWAY,
+    the streams in progress are completed first.
+    """
+    def serve(self, preface):
+        connection = self.connection
+        # the frames received along with the preface or the upgrade request
+        # (e.g. a proxy sends the preface, SETTINGS and HEADERS at once)
+        if self.buffer:
+            preface = self.consume(preface)
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.client_connection, selectors.EVENT_READ)
+            while True:
+                with self.lock:
+                    active = bool(self.streams)
+                if not active and (self.goaway_sent or self.goaway_received):
+                    return
+                if self.server.draining and not self.goaway_sent:
+                    self.goaway(NO_ERROR)
+                    continue
+                """
+                an idle connection is marked so, for the drain (see
+                WSGIServer.finish_connections). While streams are in
+                progress, the connection is polled every second, to find
+                out when they are done after GOAWAY.
+                """
+                connection.phase = None if active else 'idle'
+                timeout = 1.0 if active else connection.timeout('idle')
+                if not selector.select(timeout):
+                    if active:
+                        continue
+                    self.server.count_timeout('idle')
+                    self.goaway(NO_ERROR)
+                    return
+                data = self.client_connection.recv(65536)
+                if not data:
+                    if self.server.draining:
+                        self.goaway(NO_ERROR)
+                    return
+                self.buffer += data
+                preface = self.consume(preface)
+
+    """
+    checks the (rest of the) preface at the start of the buffer, then
+    handles the frames which follow it. Returns the part of the preface
+    still expected (None once it is received).
+    """
+    def consume(self, preface):
+        if preface:
+            if len(self.buffer) < len(preface):
+                if not preface.startswith(bytes(self.buffer)):
+                    raise H2Error(PROTOCOL_ERROR, 'invalid connection preface')
+                return preface
+            if not self.buffer.startswith(preface):
+                raise H2Error(PROTOCOL_ERROR, 'invalid connection preface')
+            del self.buffer[:len(preface)]
+        self.read_frames()
+        return None
+
+    """
+    handles the complete frames in the buffer, then sends the frames
+    queued in return (acknowledgements, window updates, responses) at once.
+    """
+    def read_frames(self):
+        buffer = self.buffer
+        position = 0
+        while len(buffer) - position >= FRAME_HEADER.size:
+            length_type, flags, stream_id = FRAME_HEADER.unpack_from(buffer, position)
+            length, frame_type = length_type >> 8, length_type & 0xff
+            if length > DEFAULT_FRAME_SIZE:
+                raise H2Error(FRAME_SIZE_ERROR, 'frame too large')
+            end = position + FRAME_HEADER.size + length
+            if end > len(buffer):
+                break
+            payload = bytes(buffer[position + FRAME_HEADER.size:end])
+            position = end
+            self.handle_frame(frame_type, flags, stream_id & 0x7fffffff, payload)
+        del buffer[:position]
+        with self.lock:
+            self.write()
+
+    """
+    handles one frame.
+    """
+    def handle_frame(self, frame_type, flags, stream_id, payload):
+        if self.continuation is not None and (frame_type != CONTINUATION
+                or stream_id != self.continuation[0]):
+            raise H2Error(PROTOCOL_ERROR, 'header block interrupted')
+        if frame_type == DATA:
+            self.on_data(flags, stream_id, payload)
+        elif frame_type == HEADERS:
+            self.on_headers(flags, stream_id, payload)
+        elif frame_type == CONTINUATION:
+            if self.continuation is None:
+                raise H2Error(PROTOCOL_ERROR, 'unexpected CONTINUATION')
+            self.continuation[2].append(payload)
+            if flags & END_HEADERS:
+                stream_id, flags, fragments = self.continuation
+                self.continuation = None
+                self.on_header_block(flags, stream_id, b''.join(fragments))
+        elif frame_type == RST_STREAM:
+            if not stream_id:
+                raise H2Error(PROTOCOL_ERROR, 'RST_STREAM on stream 0')
+            if len(payload) != 4:
+                raise H2Error(FRAME_SIZE_ERROR, 'invalid RST_STREAM')
+            with self.lock:
+                stream = self.streams.pop(stream_id, None)
+                if stream is not None:
+                    stream.cancel()
+                    self.sent.notify_all()
+        elif frame_type == SETTINGS:
+            if stream_id:
+                raise H2Error(PROTOCOL_ERROR, 'SETTINGS on a stream')
+            if flags & ACK:
+                if payload:
+                    raise H2Error(FRAME_SIZE_ERROR, 'invalid SETTINGS acknowledgement')
+                return
+            self.apply_settings(payload)
+            with self.lock:
+                self.frames.extend(frame(SETTINGS, ACK, 0))
+        elif frame_type == PING:
+            if stream_id:
+                raise H2Error(PROTOCOL_ERROR, 'PING on a stream')
+            if len(payload) != 8:
+                raise H2Error(FRAME_SIZE_ERROR, 'invalid PING')
+            if not flags & ACK:
+                with self.lock:
+                    self.frames.extend(frame(PING, ACK, 0, payload))
+        elif frame_type == GOAWAY:
+            self.goaway_received = True
+        elif frame_type == WINDOW_UPDATE:
+            self.on_window_update(stream_id, payload)
+        elif frame_type == PUSH_PROMISE:
+            raise H2Error(PROTOCOL_ERROR, 'PUSH_PROMISE from a client')
+        # PRIORITY and unknown frames are ignored
+
+    """
+    HEADERS frame: opens a stream (or ends one with trailers). The header
+    block may continue in CONTINUATION frames.
+    """
+    def on_headers(self, flags, stream_id, payload):
+        if not stream_id or not stream_id % 2:
+            raise H2Error(PROTOCOL_ERROR, 'invalid stream identifier')
+        payload = unpad(flags, payload)
+        if flags & PRIORITY_FLAG:
+            # stream dependency and weight
+            payload = payload[5:]
+        if flags & END_HEADERS:
+            self.on_header_block(flags, stream_id, payload)
+        else:
+            self.continuation = [ stream_id, flags, [ payload ] ]
+
+    """
+    a complete header block. It is decoded even if the stream is refused,
+    to keep the dynamic table of the decoder in step.
+    """
+    def on_header_block(self, flags, stream_id, block):
+        headers = self.decoder.decode(block)
+        stream = self.streams.get(stream_id)
+        if stream is not None:
+            # trailers, which must end the request
+            if not stream.receiving or not flags & END_STREAM:
+                raise H2Error(PROTOCOL_ERROR, 'unexpected HEADERS')
+            self.end_request(stream)
+            return
+        if stream_id <= self.last_stream_id:
+            raise H2Error(STREAM_CLOSED, 'HEADERS on a closed stream')
+        self.last_stream_id = stream_id
+        if self.goaway_sent or len(self.streams) >= self.max_streams:
+            self.reset_stream(stream_id, REFUSED_STREAM)
+            return
+        stream = H2Stream(self, stream_id)
+        stream.receiving = not flags & END_STREAM
+        with self.lock:
+            self.streams[stream_id] = stream
+        try:
+            if sum(len(name) + len(value) + 32 for name, value in headers) > self.max_header_size:
+                raise HTTPError('431 Request Header Fields Too Large', 'The request header is too large.')
+            stream.request = make_request(headers)
+            length = stream.request.content_length()
+        except ValueError:
+            stream.fail(HTTPError('400 Bad Request', 'The Content-Length header is malformed.'))
+            return
+        except HTTPError as error:
+            stream.fail(error)
+            return
+        if length > self.max_body_size:
+            stream.fail(HTTPError('413 Payload Too Large', 'The request body is too large.'))
+            return
+        if not stream.receiving:
+            stream.serve()
+
+    """
+    opens a stream for a request already received (the upgrade request).
+    """
+    def open_stream(self, stream_id, request):
+        stream = H2Stream(self, stream_id)
+        stream.request = request
+        with self.lock:
+            self.streams[stream_id] = stream
+        return stream
+
+    """
+    DATA frame: a part of the body of a request. The flow control credit
+    is given back at once: the body is not consumed later, but kept in
+    memory, up to the largest body accepted.
+    """
+    def on_data(self, flags, stream_id, payload):
+        if not stream_id:
+            raise H2Error(PROTOCOL_ERROR, 'DATA on stream 0')
+        if stream_id > self.last_stream_id:
+            raise H2Error(PROTOCOL_ERROR, 'DATA on an idle stream')
+        with self.lock:
+            if payload:
+                self.frames.extend(frame(WINDOW_UPDATE, 0, 0, struct.pack('>I', len(payload))))
+        data = unpad(flags, payload)
+        stream = self.streams.get(stream_id)
+        if stream is None or not stream.receiving:
+            self.reset_stream(stream_id, STREAM_CLOSED)
+            return
+        request = stream.request
+        if len(request.body) + len(data) > self.max_body_size:
+            stream.fail(HTTPError('413 Payload Too Large', 'The request body is too large.'))
+            return
+        request.body += data
+        request.body_received += len(data)
+        if flags & END_STREAM:
+            self.end_request(stream)
+        elif payload:
+            with self.lock:
+                self.frames.extend(frame(WINDOW_UPDATE, 0, stream_id, struct.pack('>I', len(payload))))
+
+    """
+    the request of a stream is complete: it is served.
+    """
+    def end_request(self, stream):
+        stream.receiving = False
+        stream.serve()
+
+    """
+    WINDOW_UPDATE frame: the client gives credit back, for the connection
+    (stream 0) or a stream. The responses waiting for it are sent.
+    """
+    def on_window_update(self, stream_id, payload):
+        if len(payload) != 4:
+            raise H2Error(FRAME_SIZE_ERROR, 'invalid WINDOW_UPDATE')
+        increment = struct.unpack('>I', payload)[0] & 0x7fffffff
+        with self.lock:
+            if not stream_id:
+                if not increment:
+                    raise H2Error(PROTOCOL_ERROR, 'WINDOW_UPDATE of 0')
+                self.window += increment
+                if self.window > MAX_WINDOW_SIZE:
+                    raise H2Error(FLOW_CONTROL_ERROR, 'connection window too large')
+            else:
+                stream = self.streams.get(stream_id)
+                if stream is None:
+                    return
+                stream.window += increment
+                if not increment or stream.window > MAX_WINDOW_SIZE:
+                    self.reset_locked(stream_id, FLOW_CONTROL_ERROR if increment else PROTOCOL_ERROR)
+                    return
+            self.pump()
+
+    """
+    applies the settings of the client (the payload of a SETTINGS frame).
+    """
+    def apply_settings(self, payload):
+        if len(payload) % 6:
+            raise H2Error(FRAME_SIZE_ERROR, 'invalid SETTINGS')
+        with self.lock:
+            for setting, value in struct.iter_unpack('>HI', payload):
+                if setting == SETTINGS_HEADER_TABLE_SIZE:
+                    self.encoder.resize(value)
+                elif setting == SETTINGS_ENABLE_PUSH:
+                    if value > 1:
+                        raise H2Error(PROTOCOL_ERROR, 'invalid SETTINGS_ENABLE_PUSH')
+                elif setting == SETTINGS_INITIAL_WINDOW_SIZE:
+                    if value > MAX_WINDOW_SIZE:
+                        raise H2Error(FLOW_CONTROL_ERROR, 'invalid SETTINGS_INITIAL_WINDOW_SIZE')
+                    # the windows of the open streams move by the difference
+                    for stream in self.streams.values():
+                        stream.window += value - self.initial_window
+                    self.initial_window = value
+                elif setting == SETTINGS_MAX_FRAME_SIZE:
+                    if not DEFAULT_FRAME_SIZE <= value <= MAX_FRAME_SIZE:
+                        raise H2Error(PROTOCOL_ERROR, 'invalid SETTINGS_MAX_FRAME_SIZE')
+                    self.max_frame_size = value
+            self.pump()
+
+    """
+    queues the headers of a response, split in a HEADERS frame and as many
+    CONTINUATION frames as needed, and sends them. The header block is
+    encoded and sent under the lock: the client decodes the blocks in the
+    order they were encoded. Returns False if the stream is gone.
+    """
+    def send_headers(self, stream, headers, end_stream):
+        with self.lock:
+            if self.closed or stream.reset:
+                return False
+            block = self.encoder.encode(headers)
+            size = self.max_frame_size
+            fragments = [ block[offset:offset + size] for offset in range(0, len(block), size) ] or [ b'' ]
+            for index, fragment in enumerate(fragments):
+                flags = END_HEADERS if index == len(fragments) - 1 else 0
+                if index == 0:
+                    flags |= END_STREAM if end_stream else 0
+                    self.frames.extend(frame(HEADERS, flags, stream.stream_id, fragment))
+                else:
+                    self.frames.extend(frame(CONTINUATION, flags, stream.stream_id, fragment))
+            if end_stream:
+                stream.end = stream.ended = True
+                self.finish(stream)
+            self.write()
+            return True
+
+    """
+    queues buffers of the body of a response, and sends as much of it as
+    the flow control windows allow.
+    [end]
+    whether these are the last buffers of the body.
+    [block]
+    whether to wait until all of the body queued is sent. Raises
+    socket.timeout if the client gives no credit back within the write
+    timeout.
+    """
+    def send_data(self, stream, buffers, end, block):
+        with self.lock:
+            if self.closed or stream.reset:
+                response.close(buffers)
+                return
+            stream.outbound.extend(buffers)
+            stream.end = stream.end or end
+            self.pump()
+            self.write()
+            if not block:
+                return
+            deadline = time.monotonic() + self.connection.timeout('write')
+            while stream.outbound and not (self.closed or stream.reset):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.sent.wait(remaining):
+                    raise socket.timeout('timed out')
+
+    """
+    moves the body of the streams into DATA frames, as the windows of the
+    connection and of each stream allow: the streams take turns, one frame
+    each, so that a large response does not hold the others back. Called
+    with the lock held; the frames are then sent by write().
+    """
+    def pump(self):
+        progress = True
+        while progress:
+            progress = False
+            for stream in list(self.streams.values()):
+                if stream.reset or stream.ended:
+                    continue
+                data = b''
+                if stream.outbound:
+                    size = min(self.max_frame_size, self.window, stream.window)
+                    if size <= 0:
+                        continue
+                    data = stream.take(size)
+                last = stream.end and not stream.outbound
+                if not data and not last:
+                    continue
+                self.frames.extend(frame(DATA, END_STREAM if last else 0, stream.stream_id, data))
+                self.window -= len(data)
+                stream.window -= len(data)
+                progress = True
+                if last:
+                    stream.ended = True
+                    self.finish(stream)
+        self.sent.notify_all()
+
+    """
+    forgets a stream whose response is complete. Called with the lock held.
+    """
+    def finish(self, stream):
+        if not stream.receiving:
+            self.streams.pop(stream.stream_id, None)
+
+    """
+    sends the frames queued. Called with the lock held.
+    """
+    def write(self):
+        if not self.frames or self.closed:
+            return
+        frames, self.frames = self.frames, []
+        try:
+            response.send_all(self.client_connection, frames)
+        except BaseException:
+            self.closed = True
+            self.sent.notify_all()
+            raise
+
+    """
+    resets a stream: its response is dropped, and the client told so.
+    """
+    def reset_stream(self, stream_id, code):
+        with self.lock:
+            self.reset_locked(stream_id, code)
+            self.write()
+
+    def reset_locked(self, stream_id, code):
+        stream = self.streams.pop(stream_id, None)
+        if stream is not None:
+            stream.cancel()
+            self.sent.notify_all()
+        self.frames.extend(frame(RST_STREAM, 0, stream_id, struct.pack('>I', code)))
+
+    """
+    sends GOAWAY: no new stream is accepted, the streams in progress are
+    completed. The connection is closed afterwards.
+    """
+    def goaway(self, code):
+        with self.lock:
+            self.goaway_sent = True
+            self.frames.extend(frame(GOAWAY, 0, 0, struct.pack('>II', self.last_stream_id, code)))
+            try:
+                self.write()
+            except OSError:
+                pass
@@ -0,0 +1,125 @@
+"""
+Priority lanes of the worker threads. Most responses cost next to
+nothing: a static file, a 304 Not Modified, a page from the cache. A page
+rendered from its Markdown costs up to hundreds of milliseconds of CPU.
+With a single pool of workers, a burst of renders takes every worker,
+and the cheap requests wait behind them.
+
+The work is split in two lanes, each a pool of threads of its own:
+* the fast lane runs the application, which only looks up the files and
+  the caches, and returns either the response body (cheap), or a
+  generator which renders the page as it is iterated (expensive);
+* the render lane iterates those generators. It has few threads (the
+  rendering is CPU bound, more threads would not render more pages at
+  once) and a bounded queue: when it is full, the request is answered
+  with 503 at once.
+So the fast lane is never stuck behind a render. Each lane counts its
+queue depth and the time the work waits in its queue and takes to run,
+reported with the statistics of the server (SIGUSR1).
+"""
+
+"""
+concurrent.futures provides a high-level interface for asynchronously
+executing callables.
+[ThreadPoolExecutor]
+ThreadPoolExecutor(max_workers) executes calls (submitted with submit(fn,
+*args)) in a pool of at most max_workers threads.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import traceback
+
+# Pool of worker threads with a queue of its own
+class Lane(object):
+
+    """
+    [name]
+    name of the lane in the statistics and the names of its threads,
+    e.g. 'fast'.
+    [threads]
+    number of worker threads.
+    [max_queued]
+    largest number of calls waiting for a thread (None: unbounded).
+    """
+    def __init__(self, name, threads, max_queued=None):
+        self.name = name
+        self.max_queued = max_queued
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=name)
+        self.lock = threading.Lock()
+        # calls waiting for a thread, and calls running
+        self.queued = 0
+        self.active = 0
+        # calls completed, and calls refused because the queue was full
+        self.completed = 0
+        self.rejected = 0
+        # total and largest time waited in the queue, total running time,
+        # in seconds
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.run_time = 0.0
+
+    """
+    queues fn(*args) to be called by a thread of the lane. Returns False,
+    without queuing it, if the queue is full or the lane is shut down.
+    """
+    def submit(self, fn, *args):
+        with self.lock:
+            if self.max_queued is not None and self.queued >= self.max_queued:
+                self.rejected += 1
+                return False
+            self.queued += 1
+        try:
+            self.executor.submit(self.run, time.monotonic(), fn, args)
+        except RuntimeError:
+            # shut down (e.g. the server is exiting)
+            with self.lock:
+                self.queued -= 1
+            return False
+        return True
+
+    """
+    runs a call in a thread of the lane, and measures it.
+    """
+    def run(self, queued_at, fn, args):
+        started = time.monotonic()
+        waited = started - queued_at
+        with self.lock:
+            self.queued -= 1
+            self.active += 1
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+        try:
+            fn(*args)
+        except Exception:
+            # report the error without killing the thread
+            traceback.print_exc()
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.completed += 1
+                self.run_time += time.monotonic() - started
+
+    """
+    returns the counters of the lane, the times in milliseconds, e.g.
+    {'queued': 0, 'active': 2, 'completed': 120, 'rejected': 0,
+     'wait_avg_ms': 0.4, 'wait_max_ms': 12.1, 'run_avg_ms': 180.2}
+    """
+    def stats(self):
+        with self.lock:
+            completed = max(self.completed, 1)
+            return {
+                'queued': self.queued,
+                'active': self.active,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'wait_avg_ms': round(self.wait_time / completed * 1000, 1),
+                'wait_max_ms': round(self.max_wait_time * 1000, 1),
+                'run_avg_ms': round(self.run_time / completed * 1000, 1)
+            }
+
+    """
+    stops accepting calls, and waits for the calls queued to complete.
+    """
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -4,6 +4,9 @@ import argparse
 
 from pathlib import Path
 from server import WSGIServer
+from eventloop import EventLoopServer
+from prefork import Arbiter
+import handoff
 from app import Kernel
 from config import Config
 
@@ -14,11 +17,24 @@ The WSGI is something in between, which lets server and
 application/framework communicate. This is where the
 initialization is done.
 """
-def make_server(server_address, application, config):
+def make_server(server_address, application, config, application_stats=None):
+    # Picks the server core
+    if config.server_core() == 'events':
+        server_class = EventLoopServer
+    else:
+        server_class = WSGIServer
     # Builds WSGIServer object
-    server = WSGIServer(server_address)
+    server = server_class(
+        server_address,
+        reuse_port=config.server_reuse_port(),
+        backlog=config.listen_backlog(),
+        defer_accept=config.tcp_defer_accept(),
+        fastopen=config.tcp_fastopen(),
+        receive_buffer=config.socket_receive_buffer(),
+        send_buffer=config.socket_send_buffer()
+        )
     # Sets the application
-    server.set_app(application)
+    server.set_app(application, application_stats)
     # Set the config
     server.set_config(config)
     # Return 'server': the WSGIServer object
@@ -59,6 +75,16 @@ if __name__ == '__main__':
         nargs="?",
         const=os.getcwd()
         )
+    parser.add_argument("--workers",
+        help="with --serve, fork N worker processes to serve from. Defaults to the \"workers\" server setting.",
+        metavar="N",
+        type=int
+        )
+
+    parser.add_argument("--debug",
+        help="with --serve, print every request and response a la curl -v, instead of the access log only.",
+        action="store_true"
+        )
 
     CONFIG_FILE_NAME = 'config.json'
 
@@ -75,12 +101,37 @@ if __name__ == '__main__':
     elif args.serve:
         working_dir = args.serve
         config = Config(CONFIG_FILE_NAME, working_dir)
-        httpd = make_server(config.server_address(), Kernel.app, config)
-        # print information about the running server
-        print('{server}: Serving HTTP on port {port} ...\n'.format(server=WSGIServer.SERVER_NAME,port=config.server_port()))
-        # start serving, until manually interrupted, waiting for requests
-        # and serving responses by printing them in the terminal
-        httpd.serve_forever()
+        if args.debug:
+            # takes precedence over the "debug" server setting
+            config.json['server']['debug'] = True
+        workers = args.workers if args.workers is not None else config.server_workers()
+        # where the server listens, for the messages below
+        if config.unix_socket():
+            location = 'socket {path}'.format(path=config.unix_socket())
+        else:
+            location = 'port {port}'.format(port=config.server_port())
+        if workers > 1:
+            if not hasattr(os, 'fork'):
+                sys.exit("Worker processes are not supported on this platform. Run with --workers 1.")
+            # print information about the running server
+            print('{server}: Serving HTTP on {location} with {workers} workers ...\n'.format(server=WSGIServer.SERVER_NAME,location=location,workers=workers))
+            # fork the workers and supervise them, until manually interrupted
+            arbiter = Arbiter(
+                lambda: make_server(config.server_address(), Kernel.app, config, Kernel.stats),
+                workers,
+                # a Unix domain socket path can only be bound once
+                reuse_port=config.server_reuse_port() and not config.unix_socket()
+                )
+            arbiter.run()
+        else:
+            httpd = make_server(config.server_address(), Kernel.app, config, Kernel.stats)
+            # print information about the running server
+            print('{server}: Serving HTTP on {location} ...\n'.format(server=WSGIServer.SERVER_NAME,location=location))
+            # ready: the server this one replaces, if any, may drain
+            handoff.notify_predecessor()
+            # start serving, until manually interrupted, waiting for requests
+            # and serving responses, logging them to the access log
+            httpd.serve_forever()
     elif args.version:
          # display machine-friendly version information
         print(' '.join([ WSGIServer.SERVER_NAME, WSGIServer.VERSION_STRING ]))
@@ -0,0 +1,153 @@
+"""
+Parking of the idle connections (threads core). A connection waiting for
+a request, either a new one or a persistent (keep-alive) one between two
+requests, would otherwise hold a worker thread of the fast lane for up to
+the header or keep-alive timeout: a handful of idle browsers, or a client
+opening connections and sending nothing (slowloris), would take every
+worker, and the other clients would wait.
+
+Instead, a connection with nothing received is parked: its socket is
+watched in a selector by a single thread, and the connection is handed to
+a worker only once its client sends something. A connection which stays
+idle past the deadline of its phase is closed by that thread.
+"""
+
+import collections
+"""
+heapq keeps a list as a binary heap: heappush() adds an item and heappop()
+removes the smallest one, each in O(log n). heap[0] is the smallest item.
+"""
+import heapq
+import itertools
+import selectors
+import socket
+import threading
+import time
+
+# The connections waiting for their client, watched by one thread
+class Parking(object):
+
+    """
+    [schedule]
+    called (in the parking thread) with a connection whose client sent
+    something (or closed the connection): queues it for a worker.
+    """
+    def __init__(self, schedule):
+        self.schedule = schedule
+        self.selector = selectors.DefaultSelector()
+        # connections parked by other threads, registered by the parking
+        # thread once it is woken up
+        self.arriving = collections.deque()
+        """
+        deadlines of the parked connections, as a heap of (deadline,
+        sequence number, connection) entries. An entry is ignored once the
+        connection is no longer parked, or was parked again since.
+        """
+        self.timers = []
+        self.sequence = itertools.count()
+        # the parked connections
+        self.parked = set()
+        self.stopping = False
+        """
+        socketpair() returns a pair of connected sockets. Writing a byte in
+        one end wakes up the selector, which waits for the other end to
+        become readable.
+        """
+        self.waker, self.wakeup_socket = socket.socketpair()
+        self.waker.setblocking(False)
+        self.wakeup_socket.setblocking(False)
+        self.selector.register(self.waker, selectors.EVENT_READ)
+        self.thread = threading.Thread(target=self.run, name='Parking', daemon=True)
+        self.thread.start()
+
+    """
+    parks a connection until its client sends something, or the deadline
+    of its phase (Connection.deadline) passes. Called by any thread.
+    """
+    def park(self, connection):
+        self.arriving.append(connection)
+        self.wake()
+
+    """
+    returns the number of parked connections.
+    """
+    def count(self):
+        return len(self.parked) + len(self.arriving)
+
+    """
+    closes the parked connections, and waits for the parking thread to
+    exit.
+    """
+    def stop(self):
+        self.stopping = True
+        self.wake()
+        self.thread.join()
+
+    def wake(self):
+        try:
+            self.wakeup_socket.send(b'\0')
+        except OSError:
+            # e.g. BlockingIOError: the thread is being woken up already
+            pass
+
+    """
+    body of the parking thread.
+    """
+    def run(self):
+        try:
+            while not self.stopping:
+                timeout = None
+                if self.timers:
+                    timeout = max(0, self.timers[0][0] - time.monotonic())
+                for key, events in self.selector.select(timeout):
+                    if key.fileobj is self.waker:
+                        try:
+                            while self.waker.recv(4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                        continue
+                    # the client sent something: a worker serves it
+                    connection = key.data
+                    self.unpark(connection)
+                    self.schedule(connection)
+                while self.arriving:
+                    connection = self.arriving.popleft()
+                    try:
+                        self.selector.register(connection.client_connection, selectors.EVENT_READ, connection)
+                    except (ValueError, OSError):
+                        # closed meanwhile
+                        connection.close()
+                        continue
+                    self.parked.add(connection)
+                    heapq.heappush(self.timers, (connection.deadline, next(self.sequence), connection))
+                self.expire()
+        finally:
+            while self.arriving:
+                self.arriving.popleft().close()
+            for connection in list(self.parked):
+                self.unpark(connection)
+                connection.close()
+            self.selector.close()
+            self.waker.close()
+            self.wakeup_socket.close()
+
+    """
+    closes the parked connections whose deadline passed.
+    """
+    def expire(self):
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            deadline, sequence, connection = heapq.heappop(self.timers)
+            if connection not in self.parked or connection.deadline != deadline:
+                continue
+            self.unpark(connection)
+            connection.timed_out()
+            connection.close()
+
+    def unpark(self, connection):
+        self.parked.discard(connection)
+        try:
+            self.selector.unregister(connection.client_connection)
+        except (KeyError, ValueError):
+            pass
@@ -0,0 +1,238 @@
+"""
+Pre-fork worker processes. Markdown conversion is pure Python and CPU
+bound, so a single process can only ever use one core, no matter how many
+threads serve it. The Arbiter forks several worker processes which all
+run WSGIServer.serve_forever, and supervises them: a worker that dies is
+replaced by a new one.
+
+The workers receive connections in one of two ways:
+* shared socket: the listening socket is created by the parent before
+  forking, and every worker accepts on the same socket.
+* SO_REUSEPORT: every worker binds its own listening socket to the same
+  address, and the kernel balances new connections between them.
+"""
+
+"""
+os provides the process management functions used here:
+[fork]
+os.fork() creates a child process which is a copy of the parent. It
+returns 0 in the child and the process id of the child in the parent.
+[waitpid]
+os.waitpid(pid, options) waits for a child process to exit and returns
+(pid, status). With pid = -1 it waits for any child.
+[_exit]
+os._exit(n) exits the process without running cleanup handlers. This is
+how a forked child should leave, so that it does not run the code of
+the parent (e.g. the rest of muggle.py) on its way out.
+"""
+import os
+"""
+signal allows to install handlers for asynchronous events.
+signal.signal(signalnum, handler) sets the handler for a signal.
+signal.SIG_DFL restores the default behaviour of a signal.
+"""
+import signal
+import struct
+import sys
+import time
+import traceback
+
+import handoff
+from server import WSGIServer
+
+# Supervisor of the pre-forked worker processes
+class Arbiter(object):
+
+    # a worker exiting sooner than this after being spawned is considered
+    # a failed start (e.g. the address cannot be bound), and the arbiter
+    # waits as long before respawning, instead of forking in a tight loop.
+    MIN_WORKER_LIFETIME = 1.0
+
+    """
+    constructor.
+    [make_server]
+    callable taking no argument and returning a WSGIServer ready to serve
+    (with its application and config set).
+    [workers]
+    number of worker processes to keep running.
+    [reuse_port]
+    when true, make_server is called for every worker, just before it is
+    forked, and each worker binds its own SO_REUSEPORT socket. Otherwise
+    make_server is called once, in the parent, and the listening socket
+    is inherited by the workers.
+    """
+    def __init__(self, make_server, workers, reuse_port=False):
+        self.make_server = make_server
+        self.workers = workers
+        self.reuse_port = reuse_port
+        # the shared server (None in SO_REUSEPORT mode)
+        self.server = None
+        # spawned workers, by process id: { pid: spawn time }
+        self.children = {}
+        # workers being replaced: their exit is not respawned
+        self.retiring = set()
+        # pipe on which the workers to recycle write their process id (see
+        # request_replacement)
+        self.replace_reader, self.replace_writer = None, None
+        self.stopping = False
+        # the new arbiter started on SIGUSR2 (see handoff.py)
+        self.successor = None
+
+    """
+    forks the workers and supervises them until the arbiter is stopped
+    with SIGTERM or SIGINT (CTRL+C).
+    """
+    def run(self):
+        if not self.reuse_port:
+            self.server = self.make_server()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        if hasattr(signal, 'SIGUSR1'):
+            # every worker reports its own statistics
+            signal.signal(signal.SIGUSR1, self.forward)
+        if hasattr(signal, 'SIGUSR2'):
+            signal.signal(signal.SIGUSR2, self.handoff)
+        if hasattr(signal, 'SIGTTIN'):
+            self.replace_reader, self.replace_writer = os.pipe()
+            os.set_blocking(self.replace_reader, False)
+            signal.signal(signal.SIGTTIN, self.replace)
+        for _ in range(self.workers):
+            self.spawn()
+        # ready: the arbiter this one replaces, if any, may drain
+        handoff.notify_predecessor()
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            spawned = self.children.pop(pid, None)
+            if pid in self.retiring:
+                # recycled: its replacement is already running
+                self.retiring.discard(pid)
+                continue
+            if spawned is None or self.stopping:
+                continue
+            print('{server}: worker {pid} exited with status {status}, respawning'.format(
+                server=WSGIServer.SERVER_NAME, pid=pid, status=status), file=sys.stderr)
+            if time.monotonic() - spawned < self.MIN_WORKER_LIFETIME:
+                time.sleep(self.MIN_WORKER_LIFETIME)
+            if not self.stopping:
+                self.spawn()
+        # the workers are gone: the socket file of a Unix domain socket is
+        # removed, unless a new arbiter took the socket over
+        if self.server is not None and (self.successor is None or self.successor.poll() is not None):
+            self.server.remove_socket_file()
+
+    """
+    signal handler of the parent: stops respawning and terminates the
+    workers, which drain first. run() returns once they have all exited.
+    """
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    """
+    signal handler of the parent: sends the signal on to the workers.
+    """
+    def forward(self, signum, frame):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    """
+    signal handler of the parent: starts a new arbiter, with new workers,
+    which takes the listening socket over (see handoff.py). In SO_REUSEPORT
+    mode the new workers bind their own sockets. The new arbiter then
+    stops this one, whose workers drain.
+    """
+    def handoff(self, signum, frame):
+        self.successor = handoff.spawn_successor(self.server.listen_socket if self.server else None)
+
+    """
+    signal handler of the parent (SIGTTIN, sent by a worker to recycle, see
+    WSGIServer.count_request): forks a new worker for each worker which
+    asked, then makes the old one drain. The new worker is listening by
+    then, so that the connections go to it, even in SO_REUSEPORT mode
+    where the old worker closes its own socket.
+    """
+    def replace(self, signum, frame):
+        try:
+            data = os.read(self.replace_reader, 4096)
+        except BlockingIOError:
+            return
+        for (pid,) in struct.iter_unpack('i', data[:len(data) // 4 * 4]):
+            if self.stopping or pid not in self.children or pid in self.retiring:
+                continue
+            try:
+                self.spawn()
+            except OSError:
+                # e.g. the address cannot be bound: the old worker goes on
+                traceback.print_exc()
+                continue
+            self.retiring.add(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    """
+    called in a worker which is to be recycled: asks the parent for a
+    replacement. The process id is written to the pipe in a single write
+    (atomic on a pipe), since a signal does not tell its sender.
+    """
+    def request_replacement(self):
+        os.write(self.replace_writer, struct.pack('i', os.getpid()))
+        os.kill(os.getppid(), signal.SIGTTIN)
+
+    """
+    forks one worker process. In SO_REUSEPORT mode its server is made
+    before the fork, so that its socket is listening when spawn() returns.
+    """
+    def spawn(self):
+        server = self.server or self.make_server()
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.monotonic()
+            if server is not self.server:
+                # the socket and the access log are the worker's
+                server.close_in_parent()
+            return
+        # In the child: never return into the code of the parent.
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            if hasattr(signal, 'SIGUSR1'):
+                # until the server installs its own handler
+                signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+            if hasattr(signal, 'SIGUSR2'):
+                # handled by the arbiter only
+                signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+            if hasattr(signal, 'SIGTTIN'):
+                signal.signal(signal.SIGTTIN, signal.SIG_IGN)
+            server.multiprocess = True
+            # a limit of its own, so that the workers are not all replaced
+            # at the same moment
+            server.recycler.draw()
+            if self.replace_writer is not None:
+                server.request_replacement = self.request_replacement
+            server.serve_forever()
+            # drained: os._exit does not run the atexit handlers, so the
+            # access log is written out here
+            if server.access_log is not None:
+                server.access_log.close()
+        except KeyboardInterrupt:
+            pass
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
@@ -33,6 +33,18 @@ class Preprocessor:
         self.content = content
 
     def process(self):
+        return self.emitter().html()
+
+    """
+    Like process(), but yields the HTML piece by piece. The content may
+    be a callable returning the rendered markdown: it is only called once
+    the text before the content macro has been yielded, so that the text
+    can be sent to the client while the markdown is being rendered.
+    """
+    def stream(self):
+        return self.emitter().stream()
+
+    def emitter(self):
         # Call the lexer to get the tokens.
         lexer = Lexer(self.template)
         tokens = lexer.tokenize()
@@ -40,8 +52,7 @@ class Preprocessor:
         parser = Parser(tokens, self.content)
         nodes = parser.parse()
         # Get the HTML
-        emitter = Emitter(nodes)
-        return emitter.html()
+        return Emitter(nodes)
 
 """
 code generator: Analysis means looking for macros to interpret
@@ -55,13 +66,18 @@ HTML string. The string is then returned as the processed template HTML.
 class Emitter:
 
     def __init__(self, nodes):
-        self._html = ''
         self.nodes = nodes
-        for node in nodes:
-            self._html += node.value()
 
     def html(self):
-        return self._html
+        return ''.join(self.stream())
+
+    def stream(self):
+        for node in self.nodes:
+            value = node.value()
+            # content to be rendered on demand
+            if callable(value):
+                value = value()
+            yield value
 
 
 """
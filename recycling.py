@@ -0,0 +1,109 @@
+"""
+Worker recycling. A long-running process slowly grows: the memoizing
+caches of markdown2 are never emptied, and every render churns through
+short-lived Markdown instances and dictionaries, which fragments the heap
+of the Python allocator (memory freed by Python is seldom given back to
+the system). Rather than chasing every leak, a process is replaced by a
+fresh one after serving a number of requests, or once its resident set
+size (RSS, the memory it actually occupies) crosses a threshold.
+
+The replacement never drops a connection (see WSGIServer.recycle): a
+pre-forked worker drains and exits while the other workers, and then the
+new one forked by the arbiter, accept on the shared listening socket; a
+single process hands its listening socket over to a new process, as on
+SIGUSR2 (see handoff.py).
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+try:
+    import resource
+except ImportError:
+    # not on Windows
+    resource = None
+
+"""
+returns the resident set size of the process, in bytes. On Linux,
+/proc/self/statm holds the current size in pages (its second field).
+Elsewhere, getrusage() only tells the largest size the process ever had,
+which is good enough to decide to replace the process. Returns 0 where
+neither is available.
+[ru_maxrss]
+kilobytes on Linux, bytes on macOS.
+"""
+def rss():
+    try:
+        with open('/proc/self/statm', 'rb') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if resource is None:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+# Decides when the process is to be replaced
+class Recycler(object):
+
+    # the resident set size is read at most once per interval, in seconds
+    RSS_INTERVAL = 1.0
+
+    """
+    [max_requests]
+    number of requests after which the process is replaced (0: never).
+    Up to a tenth more is added at random, so that workers started
+    together are not all replaced at the same moment.
+    [max_rss]
+    resident set size, in bytes, beyond which the process is replaced
+    (0: never).
+    """
+    def __init__(self, max_requests, max_rss):
+        self.limit = max_requests
+        self.max_requests = max_requests
+        self.draw()
+        self.max_rss = max_rss
+        self.requests = 0
+        self.next_rss_check = 0.0
+        # why the process is to be replaced, once decided (None: it is not)
+        self.reason = None
+        self.lock = threading.Lock()
+
+    """
+    draws the random part of the number of requests after which the
+    process is replaced. A pre-forked worker draws it again once forked
+    (see Arbiter.spawn): the workers forked with the same server would
+    have the same number otherwise. The generator is seeded by the system,
+    the state of the random module being copied by fork too.
+    """
+    def draw(self):
+        self.max_requests = self.limit
+        if self.limit:
+            self.max_requests += random.SystemRandom().randint(0, self.limit // 10)
+
+    """
+    counts a request. Returns True, once, when the process is to be
+    replaced.
+    """
+    def count(self):
+        with self.lock:
+            self.requests += 1
+            if self.reason is not None:
+                return False
+            if self.max_requests and self.requests >= self.max_requests:
+                self.reason = 'after {0} requests'.format(self.requests)
+                return True
+            if not self.max_rss:
+                return False
+            now = time.monotonic()
+            if now < self.next_rss_check:
+                return False
+            self.next_rss_check = now + self.RSS_INTERVAL
+        size = rss()
+        with self.lock:
+            if self.reason is None and size >= self.max_rss:
+                self.reason = 'at {0} MB of RSS'.format(size // 1048576)
+                return True
+        return False
@@ -0,0 +1,268 @@
+"""
+Incremental HTTP/1.x request parser. The bytes of a connection are
+received straight into a buffer allocated once per connection
+(socket.recv_into on a memoryview of it), and the requests are parsed out
+of that buffer as soon as their head is complete. Nothing is copied but
+the decoded request line and header strings themselves, and the bytes
+following a request (the next requests on a persistent connection) stay
+in the buffer.
+
+A request looks like:
+    GET /hello?lang=en HTTP/1.1\r\n        <- request line
+    Host: localhost:8888\r\n                <- headers, one per line
+    Accept: text/html\r\n
+    \r\n                                    <- blank line: end of the head
+    ...                                     <- body (Content-Length bytes)
+"""
+
+"""
+urllib.parse splits and decodes URLs.
+unquote_to_bytes(string) replaces %xx escapes by their byte value.
+"""
+from urllib.parse import unquote_to_bytes
+"""
+base64.urlsafe_b64decode decodes the base64url alphabet ('-' and '_'
+instead of '+' and '/'), the encoding of the HTTP2-Settings header.
+"""
+import base64
+import binascii
+import time
+
+# end of a line of the head
+CRLF = b'\r\n'
+# end of the head
+CRLFCRLF = b'\r\n\r\n'
+
+# Error in a request, answered with an error status
+class HTTPError(Exception):
+
+    """
+    [status] e.g. '400 Bad Request'
+    [message] explanation sent as the body of the error response
+    [headers] additional headers of the error response, e.g. Retry-After
+    """
+    def __init__(self, status, message, headers=()):
+        Exception.__init__(self, message)
+        self.status = status
+        self.message = message
+        self.headers = list(headers)
+
+# A parsed request
+class Request(object):
+
+    def __init__(self, method, target, version, headers):
+        # e.g. 'GET'
+        self.method = method
+        # request target as sent by the client, e.g. '/hello%20world?lang=en'
+        self.target = target
+        # e.g. 'HTTP/1.1'
+        self.version = version
+        # list of (name, value) tuples, in the order they were received
+        self.headers = headers
+        """
+        the target is split into the path and the query string. The path
+        is %-decoded, and stored as a latin-1 str as required by the WSGI
+        specification (PEP 3333): the application gets the raw bytes back
+        with path.encode('latin-1').
+        """
+        path, question_mark, self.query_string = target.partition('?')
+        self.path = unquote_to_bytes(path).decode('latin-1')
+        # headers by lowercase name. Repeated headers are joined with ', '
+        self.fields = {}
+        for name, value in headers:
+            name = name.lower()
+            if name in self.fields:
+                self.fields[name] += ', ' + value
+            else:
+                self.fields[name] = value
+        # the body, filled by RequestParser.read_body
+        self.body = bytearray()
+        # number of bytes of the body received so far
+        self.body_received = 0
+        # time.monotonic() when the head was parsed, for the access log
+        self.received_at = time.monotonic()
+
+    """
+    returns the value of a header (case insensitive name), or default.
+    """
+    def header(self, name, default=None):
+        return self.fields.get(name.lower(), default)
+
+    """
+    whether the request is the beginning of the connection preface of a
+    client speaking HTTP/2 from the start ("prior knowledge"): it parses as
+    a request 'PRI * HTTP/2.0' without headers, followed by 'SM\r\n\r\n'
+    (see http2.py).
+    """
+    def is_http2_preface(self):
+        return self.method == 'PRI' and self.target == '*' and self.version == 'HTTP/2.0'
+
+    """
+    returns the HTTP/2 settings of a request asking to upgrade the
+    connection to cleartext HTTP/2, or None. Such a request carries
+        Connection: Upgrade, HTTP2-Settings
+        Upgrade: h2c
+        HTTP2-Settings: <the payload of a SETTINGS frame, in base64url>
+    """
+    def http2_settings(self):
+        if self.version != 'HTTP/1.1':
+            return None
+        upgrade = [ token.strip().lower() for token in self.fields.get('upgrade', '').split(',') ]
+        connection = [ token.strip().lower() for token in self.fields.get('connection', '').split(',') ]
+        settings = self.fields.get('http2-settings')
+        if 'h2c' not in upgrade or 'upgrade' not in connection or settings is None:
+            return None
+        if 'http2-settings' not in connection or ',' in settings:
+            return None
+        try:
+            # the padding may be left out
+            return base64.urlsafe_b64decode(settings.strip() + '=' * (-len(settings.strip()) % 4))
+        except (binascii.Error, ValueError):
+            return None
+
+    """
+    length of the body announced by the Content-Length header.
+    """
+    def content_length(self):
+        return int(self.fields.get('content-length', 0))
+
+    """
+    True once the whole body has been received.
+    """
+    def body_complete(self):
+        return self.body_received >= len(self.body)
+
+    """
+    returns the part of the body still to be received, as a writable
+    memoryview: the target of socket.recv_into.
+    """
+    def body_free(self):
+        return memoryview(self.body)[self.body_received:]
+
+# Buffer of a connection and parser of the requests it contains
+class RequestParser(object):
+
+    """
+    [max_header_size]
+    largest request head (request line and headers) accepted. It is also
+    the size of the buffer.
+    [max_body_size]
+    largest request body accepted.
+    """
+    def __init__(self, max_header_size, max_body_size):
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        """
+        bytearray is a mutable sequence of bytes. Allocated once, it is
+        reused for every request of the connection.
+        memoryview exposes the buffer of the bytearray without copying it:
+        a slice of a memoryview is a view on the same memory.
+        """
+        self.buffer = bytearray(max_header_size)
+        self.view = memoryview(self.buffer)
+        # the received and unparsed bytes are buffer[start:end]
+        self.start = 0
+        self.end = 0
+        # position up to which the end of head has been searched for
+        self.scanned = 0
+
+    """
+    returns the free part of the buffer, as a writable memoryview to be
+    passed to socket.recv_into. The unparsed bytes are moved to the front
+    of the buffer first if there is no room left after them.
+    """
+    def free(self):
+        if self.end == len(self.buffer) and self.start > 0:
+            pending = self.end - self.start
+            self.buffer[:pending] = self.view[self.start:self.end]
+            self.scanned -= self.start
+            self.start, self.end = 0, pending
+        return self.view[self.end:]
+
+    """
+    records that n bytes were received into the memoryview returned by
+    free().
+    """
+    def received(self, n):
+        self.end += n
+
+    """
+    number of received bytes not parsed yet.
+    """
+    def pending(self):
+        return self.end - self.start
+
+    """
+    parses the request at the front of the buffer. Returns a Request, or
+    None if its head is not complete yet. Raises HTTPError for a malformed
+    request or a head larger than max_header_size.
+    """
+    def parse(self):
+        # empty lines before a request line are ignored (RFC 7230 3.5)
+        while self.end - self.start >= 2 and self.view[self.start:self.start + 2] == CRLF:
+            self.start += 2
+        self.scanned = max(self.scanned, self.start)
+        # only the bytes received since the last call (and the 3 before
+        # them) can complete the end of head
+        search_from = max(self.scanned - 3, self.start)
+        head_end = self.buffer.find(CRLFCRLF, search_from, self.end)
+        if head_end < 0:
+            self.scanned = self.end
+            if self.end - self.start >= self.max_header_size:
+                raise HTTPError('431 Request Header Fields Too Large', 'The request header is too large.')
+            return None
+        """
+        the head is decoded line by line, straight from the buffer: str()
+        accepts a memoryview, so no intermediate bytes object is created.
+        Header values are latin-1 by definition of HTTP.
+        """
+        view = self.view
+        line_end = self.buffer.find(CRLF, self.start, head_end + 2)
+        request_line = str(view[self.start:line_end], 'latin-1')
+        # e.g. 'GET', '/hello', 'HTTP/1.1'
+        parts = request_line.split()
+        if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+            raise HTTPError('400 Bad Request', 'The request line is malformed.')
+        method, target, version = parts
+        headers = []
+        line_start = line_end + 2
+        while line_start < head_end + 2:
+            line_end = self.buffer.find(CRLF, line_start, head_end + 2)
+            colon = self.buffer.find(b':', line_start, line_end)
+            if colon < 0:
+                raise HTTPError('400 Bad Request', 'A header line is malformed.')
+            name = str(view[line_start:colon], 'latin-1')
+            value = str(view[colon + 1:line_end], 'latin-1').strip()
+            headers.append((name, value))
+            line_start = line_end + 2
+        self.start = self.scanned = head_end + 4
+        request = Request(method, target, version, headers)
+        if request.header('transfer-encoding') is not None:
+            raise HTTPError('501 Not Implemented', 'Chunked request bodies are not supported.')
+        # digits only: int() would take a sign, spaces or underscores, and a
+        # negative length would be taken for a body
+        content_length = request.header('content-length', '0')
+        if not (content_length.isascii() and content_length.isdigit()):
+            raise HTTPError('400 Bad Request', 'The Content-Length header is malformed.')
+        length = request.content_length()
+        if length > self.max_body_size:
+            raise HTTPError('413 Payload Too Large', 'The request body is too large.')
+        request.body = bytearray(length)
+        self.read_body(request)
+        return request
+
+    """
+    moves the bytes of the body of request already in the buffer into the
+    body. The rest of the body, if any, is to be received with
+    recv_into(request.body_free()).
+    """
+    def read_body(self, request):
+        count = min(len(request.body) - request.body_received, self.end - self.start)
+        if count:
+            request.body[request.body_received:request.body_received + count] = self.view[self.start:self.start + count]
+            request.body_received += count
+            self.start += count
+            self.scanned = self.start
+        if self.start == self.end:
+            # the buffer is empty: start over from its beginning
+            self.start = self.end = self.scanned = 0
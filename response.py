@@ -0,0 +1,268 @@
+"""
+Response writer. A response is kept as a list of bytes-like buffers: the
+header block, built once, followed by the body chunks exactly as the
+application yielded them. The buffers are handed together to
+socket.sendmsg (scatter/gather I/O, see writev(2)), so the body is never
+decoded, concatenated or copied on its way to the socket.
+"""
+
+import os
+import socket
+import selectors
+
+"""
+sendmsg accepts at most IOV_MAX buffers per call (1024 on Linux).
+"""
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 16
+if IOV_MAX <= 0:
+    IOV_MAX = 16
+
+# Raised when a file ends before the length announced for it (e.g. it was
+# truncated while being sent): the connection must be closed, since the
+# client still waits for the rest of the body.
+class TruncatedFileError(OSError):
+    pass
+
+# File to be sent as a response body, with os.sendfile when possible
+class FileWrapper(object):
+
+    """
+    This is the wsgi.file_wrapper of the server (PEP 3333, "Optional
+    Platform-Specific File Handling"). An application returns
+    environ['wsgi.file_wrapper'](file, block_size) as its result, and the
+    server sends the file with os.sendfile: the kernel copies the file to
+    the socket directly, and the file is never read into Python memory.
+    [filelike]
+    a file object opened in binary mode.
+    [blksize]
+    size of the blocks read when the file is iterated instead (e.g. by a
+    server without sendfile support).
+    """
+    def __init__(self, filelike, blksize=65536):
+        self.filelike = filelike
+        self.blksize = blksize
+        # the part of the file sent: offset and number of bytes
+        self.offset = filelike.tell() if hasattr(filelike, 'tell') else 0
+        self.count = None
+        if hasattr(filelike, 'fileno'):
+            self.count = os.fstat(filelike.fileno()).st_size - self.offset
+
+    def fileno(self):
+        return self.filelike.fileno()
+
+    """
+    iterating the wrapper reads the file block by block.
+    """
+    def __iter__(self):
+        self.filelike.seek(self.offset)
+        while self.count is None or self.count > 0:
+            size = self.blksize if self.count is None else min(self.blksize, self.count)
+            data = self.filelike.read(size)
+            if not data:
+                if self.count is not None:
+                    raise TruncatedFileError('the file ended {0} bytes early'.format(self.count))
+                return
+            self.offset += len(data)
+            if self.count is not None:
+                self.count -= len(data)
+            yield data
+
+    def __len__(self):
+        return self.count or 0
+
+    def close(self):
+        if hasattr(self.filelike, 'close'):
+            self.filelike.close()
+
+    """
+    sends (a part of) the rest of the file to the client connection with
+    a single system call, and returns the number of bytes sent.
+    [os.sendfile]
+    os.sendfile(out_fd, in_fd, offset, count) copies count bytes of the
+    file in_fd, starting at offset, to the socket out_fd, inside the
+    kernel. It returns the number of bytes sent, 0 at the end of the file
+    (a socket which accepts nothing raises BlockingIOError instead).
+    Raises TruncatedFileError if the file ends before the rest is sent.
+    """
+    def send(self, client_connection):
+        if hasattr(os, 'sendfile') and self.count is not None:
+            sent = os.sendfile(client_connection.fileno(), self.fileno(), self.offset, self.count)
+        else:
+            self.filelike.seek(self.offset)
+            sent = client_connection.send(self.filelike.read(min(self.blksize, len(self))))
+        if not sent and self.count:
+            raise TruncatedFileError('the file ended {0} bytes early'.format(self.count))
+        self.offset += sent
+        self.count -= sent
+        return sent
+
+# Response body of unknown length, sent as the application yields it
+class Stream(object):
+
+    """
+    [iterable]
+    the result of the application, e.g. a generator.
+    [chunked]
+    whether the body is sent with the chunked transfer coding (HTTP/1.1):
+    each piece is preceded by its length in hexadecimal, and the body ends
+    with a piece of length 0, so the client knows where the body ends
+    without a Content-Length header, e.g.
+        1a\r\n
+        <!doctype html><html>...\r\n
+        0\r\n
+        \r\n
+    Otherwise the body is sent as is (its end is the end of the connection,
+    or the application has set Content-Length).
+    """
+    def __init__(self, iterable, chunked):
+        self.iterable = iterable
+        self.chunked = chunked
+        # number of bytes of the body yielded so far
+        self.length = 0
+        # called before every piece is asked from the application, whose
+        # production may be expensive: it may raise to stop it (see
+        # Connection.check_connected)
+        self.check = None
+
+    """
+    yields the pieces of the body as lists of buffers ready to be sent.
+    """
+    def __iter__(self):
+        iterator = iter(self.iterable)
+        while True:
+            if self.check is not None:
+                self.check()
+            data = next(iterator, None)
+            if data is None:
+                break
+            if not data:
+                # an empty chunk would end a chunked body
+                continue
+            self.length += len(data)
+            if self.chunked:
+                yield [ b'%x\r\n' % len(data), data, b'\r\n' ]
+            else:
+                yield [ data ]
+        if self.chunked:
+            yield [ b'0\r\n\r\n' ]
+
+    """
+    the WSGI specification requires calling close() on the result, if it
+    has one, once it has been iterated (or if iterating it failed).
+    """
+    def close(self):
+        if hasattr(self.iterable, 'close'):
+            self.iterable.close()
+
+"""
+builds the header block of a response (status line, headers and the
+blank line ending them) as a bytes object. HTTP headers are latin-1.
+"""
+def header_block(status, headers):
+    lines = [ 'HTTP/1.1 {status}'.format(status=status) ]
+    lines.extend('{0}: {1}'.format(*header) for header in headers)
+    lines.append('\r\n')
+    return '\r\n'.join(lines).encode('latin-1')
+
+"""
+drops the first n bytes from a list of buffers (which were sent), and
+returns the buffers still to be sent, as memoryviews.
+"""
+def advance(buffers, n):
+    for index, buffer in enumerate(buffers):
+        if isinstance(buffer, FileWrapper):
+            return buffers[index:]
+        size = len(buffer)
+        if n < size:
+            remaining = [ memoryview(buffer)[n:] ]
+            remaining.extend(buffers[index + 1:])
+            return remaining
+        n -= size
+    return []
+
+"""
+sends the buffers with a single system call (as many of them as
+possible). A FileWrapper among the buffers is sent with os.sendfile once
+the buffers before it are sent. Returns the buffers, or parts of buffers,
+which were not sent. On a non-blocking socket raises BlockingIOError if
+nothing could be sent.
+"""
+def send(client_connection, buffers):
+    # skip the empty buffers (and close the files sent completely)
+    while buffers and not len(buffers[0]):
+        if isinstance(buffers[0], FileWrapper):
+            buffers[0].close()
+        buffers = buffers[1:]
+    if not buffers:
+        return []
+    if isinstance(buffers[0], FileWrapper):
+        wrapper = buffers[0]
+        wrapper.send(client_connection)
+        if not len(wrapper):
+            wrapper.close()
+            return buffers[1:]
+        return buffers
+    # the bytes buffers up to the next file
+    data = []
+    for buffer in buffers[:IOV_MAX]:
+        if isinstance(buffer, FileWrapper):
+            break
+        data.append(buffer)
+    """
+    socket.sendmsg(buffers[, ancdata[, flags[, address]]]) sends the
+    normal data of the sequence of buffers as a single message, gathering
+    it from each buffer in turn (like writev). It returns the number of
+    bytes sent, which may be less than the total (partial write).
+    [MSG_MORE]
+    when more buffers follow (e.g. a file), the kernel is told more data
+    is coming, so that the header block and the beginning of the file
+    can share a packet.
+    """
+    flags = 0
+    if len(data) < len(buffers):
+        flags = getattr(socket, 'MSG_MORE', 0)
+    sent = client_connection.sendmsg(data, [], flags)
+    return advance(buffers, sent)
+
+"""
+sends all the buffers on a blocking socket.
+"""
+def send_all(client_connection, buffers):
+    if not hasattr(client_connection, 'sendmsg'):
+        # platforms without sendmsg (e.g. Windows)
+        for buffer in buffers:
+            if isinstance(buffer, FileWrapper):
+                for data in buffer:
+                    client_connection.sendall(data)
+                buffer.close()
+            else:
+                client_connection.sendall(buffer)
+        return
+    while buffers:
+        try:
+            buffers = send(client_connection, buffers)
+        except BlockingIOError:
+            # A socket with a timeout is non-blocking underneath. The socket
+            # methods wait for it to be writable, but os.sendfile does not.
+            wait_writable(client_connection)
+
+"""
+waits until a socket with a timeout is writable, or raises socket.timeout.
+"""
+def wait_writable(client_connection):
+    with selectors.DefaultSelector() as selector:
+        selector.register(client_connection, selectors.EVENT_WRITE)
+        if not selector.select(client_connection.gettimeout()):
+            raise socket.timeout('timed out')
+
+"""
+closes the files among the buffers of a response which could not be
+sent completely (e.g. the client went away).
+"""
+def close(buffers):
+    for buffer in buffers:
+        if isinstance(buffer, (FileWrapper, Stream)):
+            buffer.close()
@@ -69,8 +69,52 @@ sys.argv contains the list of command line arguments passed to a
 Python script. argv[0] = script name. argv[n] = n-th argument
 """
 import sys
-
+import os
 import time
+"""
+stat interprets the results of os.stat(): S_ISSOCK(mode) tells whether
+a file is a socket.
+"""
+import stat
+"""
+collections.Counter is a dict subclass for counting: missing keys count 0.
+"""
+import collections
+"""
+signal allows to install handlers for asynchronous events.
+signal.signal(signalnum, handler) sets the handler for a signal.
+"""
+import signal
+"""
+threading provides higher-level threading interfaces (locks, semaphores,
+events) on top of the low-level _thread module.
+[BoundedSemaphore]
+a semaphore that raises ValueError if it is released more times than it
+was acquired. Here it bounds the number of accepted connections that are
+either being served or waiting for a worker thread.
+"""
+import threading
+"""
+selectors waits for I/O readiness on several file objects at once:
+selector.select(timeout) returns the registered file objects which are
+ready. Here the serving loop waits on the listening socket and on a
+wakeup socket, so that a signal handler can interrupt it.
+"""
+import selectors
+"""
+traceback prints stack traces of Python programs. print_exc() prints
+the exception currently being handled to sys.stderr.
+"""
+import traceback
+
+from request import RequestParser, HTTPError
+import response
+import accesslog
+import handoff
+from shedding import LoadShedder
+from lanes import Lane
+from parking import Parking
+from recycling import Recycler
 
 # WSGI program class definition
 class WSGIServer(object):
@@ -101,46 +145,80 @@ class WSGIServer(object):
     [server_address]
     the given argument is the address to which the internal socket()
     object will be bound to.
+    A string is the path of a Unix domain socket, e.g. for a reverse proxy
+    on the same machine: no TCP/IP processing is involved.
+    [reuse_port]
+    when true, the socket is bound with SO_REUSEPORT, so that several
+    processes can each bind their own socket to the same address and the
+    kernel balances the incoming connections between them.
+    [backlog]
+    the listen backlog (None: request_queue_size).
+    [defer_accept], [fastopen], [receive_buffer], [send_buffer]
+    TCP options of the listening socket, 0 to leave them unset (see
+    set_socket_options).
     """
-    def __init__(self, server_address):
-        """
-        Create a listening socket with socket()
-        As specified above, the protocol is IPv4 (by address_family)
-        and the socket type is TCP (by socket_type).
-        The instance socket object is: self.listen_socket.
-        A local (inside the method __init__) variable is also created:
-        listen_socket, whose name can be used later on in this function
-        to access the same socket object (just to avoid to write self.
-        every time)
-        """
-        self.listen_socket = listen_socket = socket.socket(
-            self.address_family,
-            self.socket_type
-        )
-        """
-        setsockopt(level,optname,value:int/buffer) sets the value for
-        some socket option (the symbolic constants are the ones like
-        socket.SO_*). The value can be an integer, None, or a bytes-like
-        object representing a buffer.
-        [SOL]
-        SOL_ means "socket option level". These symbols are used to set
-        socket options through setsockopt.
-        [SO_REUSEADDR]
-        indicates that the address can be reused. For an AF_INET socket, it
-        means that a socket may bind, except when there is an active listening
-        socket bound to the address.
-        [bind]
-        'socket binding' means assigning an address so it can accept connections
-        on that address.
-        """
-        listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        # Binds the socket to the address: server_address (argument of
-        # the WSGIServer constructor)
-        listen_socket.bind(server_address)
-        # listen([backlog]) enables the server to accept connections.
-        # the backlog argument specifies the number of unaccepted connections
-        # that the system will allow before refusing new connections.
-        listen_socket.listen(self.request_queue_size)
+    def __init__(self, server_address, reuse_port=False, backlog=None,
+            defer_accept=0, fastopen=0, receive_buffer=0, send_buffer=0):
+        # The listening socket of the previous process, on a restart (see
+        # handoff.py): it is already bound, configured and listening.
+        listen_socket = handoff.inherited_socket()
+        if listen_socket is None:
+            address_family = self.address_family
+            if isinstance(server_address, str):
+                address_family = socket.AF_UNIX
+                # a socket file left over by a previous run would make
+                # bind() fail with "Address already in use"
+                if os.path.exists(server_address) and stat.S_ISSOCK(os.stat(server_address).st_mode):
+                    os.unlink(server_address)
+            """
+            Create a listening socket with socket()
+            As specified above, the protocol is IPv4 (by address_family),
+            or local (AF_UNIX), and the socket type is TCP (by socket_type).
+            The instance socket object is: self.listen_socket.
+            A local (inside the method __init__) variable is also created:
+            listen_socket, whose name can be used later on in this function
+            to access the same socket object (just to avoid to write self.
+            every time)
+            """
+            listen_socket = socket.socket(
+                address_family,
+                self.socket_type
+            )
+            """
+            setsockopt(level,optname,value:int/buffer) sets the value for
+            some socket option (the symbolic constants are the ones like
+            socket.SO_*). The value can be an integer, None, or a bytes-like
+            object representing a buffer.
+            [SOL]
+            SOL_ means "socket option level". These symbols are used to set
+            socket options through setsockopt.
+            [SO_REUSEADDR]
+            indicates that the address can be reused. For an AF_INET socket, it
+            means that a socket may bind, except when there is an active listening
+            socket bound to the address.
+            [bind]
+            'socket binding' means assigning an address so it can accept connections
+            on that address.
+            """
+            if address_family != socket.AF_UNIX:
+                listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                if reuse_port:
+                    listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                self.set_socket_options(listen_socket, defer_accept, fastopen)
+            # the accepted sockets inherit the buffer sizes; they must be
+            # set before listen(), as they decide the TCP window scale
+            if receive_buffer:
+                listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+            if send_buffer:
+                listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer)
+            # Binds the socket to the address: server_address (argument of
+            # the WSGIServer constructor)
+            listen_socket.bind(server_address)
+            # listen([backlog]) enables the server to accept connections.
+            # the backlog argument specifies the number of unaccepted connections
+            # that the system will allow before refusing new connections.
+            listen_socket.listen(self.request_queue_size if backlog is None else backlog)
+        self.listen_socket = listen_socket
         """
         getsockname() returns the socket's own address. This can be useful
         to find out the port number of an IP socket. The format of the
@@ -150,7 +228,15 @@ class WSGIServer(object):
         The slicing at the end is probably to ensure that only two arguments
         are extracted from getsockname()
         """
-        host, port = self.listen_socket.getsockname()[:2]
+        # the path of the socket file of a Unix domain socket (None for an
+        # IP socket), removed on shutdown (see remove_socket_file)
+        self.socket_path = None
+        if listen_socket.family == socket.AF_UNIX:
+            # the address is a path: there is no host or port to report
+            host, port = '', 0
+            self.socket_path = listen_socket.getsockname() or None
+        else:
+            host, port = self.listen_socket.getsockname()[:2]
         """
         getfqdn() returns a Fully Qualified Domain Name for the argument name
         in this case, a fully qualified domain is returned for the host
@@ -160,86 +246,742 @@ class WSGIServer(object):
         self.server_name = socket.getfqdn(host)
         # saves port as instance attribute
         self.server_port = port
-        # Return headers set by Web framework/Web application
-        self.headers_set = []
+        # reported to the application as wsgi.multiprocess. Set by the
+        # prefork Arbiter when the server runs in several worker processes.
+        self.multiprocess = False
+        # set by the prefork Arbiter in its workers: asks it for a new
+        # worker, after which it makes this one drain (see count_request)
+        self.request_replacement = None
+        # connections closed because the client missed a deadline, by
+        # phase: { 'idle' | 'header' | 'body' | 'write': count }
+        self.timeouts = collections.Counter()
+        # renders stopped because their client went away
+        self.aborted = 0
+        self.stats_lock = threading.Lock()
+        # set on SIGTERM: no new connection is accepted, and the connections
+        # are closed once their current request is served
+        self.draining = False
+        # the open client connections
+        self.connections = set()
+        # the new process started on SIGUSR2 (see handoff.py)
+        self.successor = None
+        # the lanes of worker threads, once serving (see start_lanes)
+        self.lanes = []
+        # the connections waiting for their client without a worker, once
+        # serving on the threads core (see parking.py)
+        self.parking = None
+    """
+    sets the TCP options of the listening socket, where the platform has
+    them (they are Linux options, and FreeBSD / macOS for TCP_FASTOPEN):
+    [TCP_DEFER_ACCEPT]
+    accept() does not return a connection until its client sent data (or
+    defer_accept seconds passed): no worker or timer waits for a request
+    that is still on its way.
+    [TCP_FASTOPEN]
+    a returning client may send its request along with the SYN, saving a
+    round trip. fastopen is the length of the queue of such connections.
+    """
+    def set_socket_options(self, listen_socket, defer_accept, fastopen):
+        if defer_accept and hasattr(socket, 'TCP_DEFER_ACCEPT'):
+            listen_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_DEFER_ACCEPT, defer_accept)
+        if fastopen and hasattr(socket, 'TCP_FASTOPEN'):
+            listen_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_FASTOPEN, fastopen)
+
     """
     WSGI object has an instance object which represents the web application.
     This is a setter that takes an application, and stores it internally.
+    [stats]
+    optional callable returning the counters of the application (e.g. of
+    its caches) as a dictionary, reported with those of the server.
     """
-    def set_app(self, application):
+    def set_app(self, application, stats=None):
         self.application = application
+        self.application_stats = stats
 
     """
     Store the config in the WSGI object.
     """
     def set_config(self, config):
         self.config = config
+        # whether the clients may switch to HTTP/2 (see http2.py)
+        self.http2 = config.http2()
+        # TCP_NODELAY on the client connections (see Connection)
+        self.tcp_nodelay = config.tcp_nodelay() and self.listen_socket.family != socket.AF_UNIX
+        # the access log (None when disabled)
+        self.access_log = accesslog.create(config.access_log())
+        # admission control (None when disabled)
+        self.shedder = None
+        if config.load_shedding():
+            self.shedder = LoadShedder(config.queue_delay_target(), config.queue_delay_interval())
+        # replacement of the process when it served too many requests or
+        # grew too large (see recycling.py)
+        self.recycler = Recycler(config.max_requests(), config.max_rss())
 
     """
     starts serving, with an endless loop, doing continuously:
         self.listen_socket.accept() # accepting connection
-        self.handle_one_request()   # handling a single request
+        self.dispatch(...)          # handing it to a worker thread
+    The connections are served by a bounded pool of worker threads, so a
+    slow render or a slow client only holds up its own worker. The number
+    of workers is the "threads" option of the server config. The pages
+    are rendered by the workers of the render lane (see lanes.py).
     """
     def serve_forever(self):
         # just local name for self.listen_socket (internal socket object member)
         listen_socket = self.listen_socket
-        # serves until stopped with CTRL+C or similar
+        """
+        The loop waits for the listening socket to be readable, or for a
+        signal handler to write into the wakeup socket (see drain), and
+        only then calls accept(), without blocking: several processes may
+        accept on the same socket, and another one may have been faster.
+        """
+        selector = selectors.DefaultSelector()
+        self.waker, self.wakeup_socket = socket.socketpair()
+        self.wakeup_socket.setblocking(False)
+        selector.register(self.waker, selectors.EVENT_READ)
+        selector.register(listen_socket, selectors.EVENT_READ)
+        listen_socket.setblocking(False)
+        self.install_signal_handlers()
+        # number of worker threads
+        threads = self.config.server_threads()
+        # reported to the application as wsgi.multithread
+        self.multithread = threads > 1
+        # At most 'threads' connections are served and 'threads' more wait
+        # for a worker. When every slot is taken, accept() is not called
+        # and new clients wait in the listen backlog of the kernel instead
+        # of in an unbounded queue in memory.
+        # With load shedding, the slots are not used: every connection is
+        # accepted at once, so that the time it waits for a worker can be
+        # measured, and the shedder keeps that time bounded instead.
+        # A parked connection (see parking.py) holds no slot.
+        self.slots = threading.BoundedSemaphore(2 * threads)
+        self.start_lanes()
+        self.parking = Parking(self.schedule)
+        try:
+            # serves until stopped with CTRL+C or similar, or drained
+            while not self.draining:
+                if self.shedder is None:
+                    self.slots.acquire()
+                selector.select()
+                """
+                accept() accepts a connection. The socket must be:
+                * bound to an address (done in __init__ with bind())
+                * listening for connections (done with listen())
+                The returned value is a pair (conn, addr) where conn is a
+                new socket object, usable to send and receive data on the
+                connection, and addr is the address bound to the socket on
+                the other end of the connection
+                """
+                try:
+                    # New client connection
+                    client_connection, client_address = listen_socket.accept()
+                except (BlockingIOError, InterruptedError):
+                    # no connection (e.g. woken up by a signal)
+                    if self.shedder is None:
+                        self.slots.release()
+                    continue
+                except BaseException:
+                    if self.shedder is None:
+                        self.slots.release()
+                    raise
+                self.dispatch(client_connection, client_address)
+            selector.close()
+            # the connections already waiting in the backlog are served,
+            # rather than reset when the socket is closed (the socket of a
+            # SO_REUSEPORT worker is its own), then new connections are
+            # refused, instead of waiting in the backlog
+            self.accept_pending(listen_socket)
+            listen_socket.close()
+            self.finish_connections()
+        finally:
+            # the connections still parked are closed
+            self.parking.stop()
+            self.stop_lanes()
+            # the socket file is the arbiter's in a worker
+            if not self.multiprocess:
+                self.remove_socket_file()
+
+    """
+    removes the socket file of a Unix domain socket, when the server shuts
+    down. It is kept when the socket was handed over to a new process (see
+    handoff), which goes on listening on it.
+    """
+    def remove_socket_file(self):
+        if self.socket_path is None:
+            return
+        if self.successor is not None and self.successor.poll() is None:
+            return
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+    """
+    called in the parent process (see prefork.py) once a worker is forked
+    with this server: closes the copies of the listening socket and of the
+    access log file, which are the worker's.
+    """
+    def close_in_parent(self):
+        self.listen_socket.close()
+        if self.access_log is not None:
+            self.access_log.close()
+
+    """
+    starts the lanes of worker threads (see lanes.py): the fast lane, of
+    "threads" workers, which serves the connections, and the render lane,
+    which renders the pages (None if "render-threads" is 0: the fast lane
+    renders them too).
+    """
+    def start_lanes(self):
+        config = self.config
+        self.fast_lane = Lane('fast', config.server_threads())
+        self.lanes = [self.fast_lane]
+        self.render_lane = None
+        if config.render_threads() > 0:
+            self.render_lane = Lane('render', config.render_threads(), config.render_queue_size())
+            self.lanes.append(self.render_lane)
+
+    """
+    waits for the work queued in the lanes to complete.
+    """
+    def stop_lanes(self):
+        for lane in self.lanes:
+            lane.shutdown()
+
+    """
+    accepts and dispatches the connections waiting in the backlog, without
+    blocking.
+    """
+    def accept_pending(self, listen_socket):
         while True:
-            """
-            accept() accepts a connection. The socket must be:
-            * bound to an address (done in __init__ with bind())
-            * listening for connections (done with listen())
-            The returned value is a pair (conn, addr) where conn is a
-            new socket object, usable to send and receive data on the
-            connection, and addr is the address bound to the socket on
-            the other end of the connection
-            """
-            # New client connection
-            self.client_connection, client_address = listen_socket.accept()
-            # Handle one request and close the client connection. Then
-            # loop over to wait for another client connection.
-            # This method makes use of self.client_connection above
-            self.handle_one_request()
+            if self.shedder is None and not self.slots.acquire(blocking=False):
+                return
+            try:
+                client_connection, client_address = listen_socket.accept()
+            except OSError:
+                # e.g. BlockingIOError: the backlog is empty
+                if self.shedder is None:
+                    self.slots.release()
+                return
+            self.dispatch(client_connection, client_address)
+
     """
-    custom method that handles one request. This method is called in
-    self.serve_forever endlessly.
+    called once the server stopped accepting connections, in a drain:
+    closes the persistent connections waiting idle for a request, and
+    waits for the others to finish their current request, but not longer
+    than the graceful timeout.
     """
-    def handle_one_request(self):
+    def finish_connections(self):
+        deadline = time.monotonic() + self.config.graceful_timeout()
+        while True:
+            with self.stats_lock:
+                connections = list(self.connections)
+            if not connections:
+                return
+            if time.monotonic() >= deadline:
+                break
+            for connection in connections:
+                if connection.phase == 'idle':
+                    """
+                    shutdown(SHUT_RD) ends the receiving side of the socket:
+                    the worker blocked in recv() gets end of file at once,
+                    and closes the connection.
+                    """
+                    try:
+                        connection.client_connection.shutdown(socket.SHUT_RD)
+                    except OSError:
+                        pass
+            time.sleep(0.05)
+        # out of time: the remaining requests are cut short
+        for connection in connections:
+            try:
+                connection.client_connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    """
+    installs the signal handlers of a serving process:
+    [SIGUSR1] prints the statistics of the server to stderr, e.g.
+        kill -USR1 <pid>
+    [SIGTERM] graceful shutdown: the server drains, then exits.
+    [SIGUSR2] zero-downtime restart (see handoff.py). In a pre-forked
+              worker, the arbiter handles it instead.
+    """
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.drain())
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.report_stats())
+        if hasattr(signal, 'SIGUSR2') and not self.multiprocess:
+            signal.signal(signal.SIGUSR2, lambda signum, frame: self.handoff())
+
+    """
+    starts draining: stops accepting connections and lets the serving loop
+    finish the connections and return. Called by the SIGTERM handler, so it
+    only sets a flag and wakes up the loop.
+    """
+    def drain(self):
+        self.draining = True
+        try:
+            self.wakeup_socket.send(b'\0')
+        except OSError:
+            pass
+
+    """
+    starts a new process which takes the listening socket over. The new
+    process makes this one drain once it is ready.
+    """
+    def handoff(self):
+        if self.successor is None or self.successor.poll() is not None:
+            self.successor = handoff.spawn_successor(self.listen_socket)
+
+    """
+    counts a request, and replaces the process when the recycler says so:
+    a pre-forked worker asks the arbiter for a new worker, which is
+    listening before the arbiter makes this one drain; a single process
+    hands its listening socket over to a new process, which then makes it
+    drain. Called by the worker threads.
+    """
+    def count_request(self):
+        if not self.recycler.count():
+            return
+        print('{server}[{pid}]: recycling {reason}'.format(
+            server=self.SERVER_NAME,
+            pid=os.getpid(),
+            reason=self.recycler.reason
+        ), file=sys.stderr, flush=True)
+        if self.request_replacement is not None:
+            self.request_replacement()
+        elif self.multiprocess:
+            self.drain()
+        else:
+            self.handoff()
+
+    """
+    returns the statistics of the server, as a dictionary of counters.
+    """
+    def stats(self):
+        with self.stats_lock:
+            stats = { 'timeouts': dict(self.timeouts), 'aborted': self.aborted }
+        stats['requests'] = self.recycler.requests
+        if self.shedder is not None:
+            stats['shed'] = self.shedder.shed
+        if self.parking is not None:
+            stats['parked'] = self.parking.count()
+        for lane in self.lanes:
+            stats[lane.name] = lane.stats()
+        if self.application_stats is not None:
+            stats.update(self.application_stats())
+        return stats
+
+    """
+    prints the statistics of the server on a single line, e.g.
+    Muggle[1234]: timeouts={'header': 3, 'idle': 120}
+    """
+    def report_stats(self):
+        print('{server}[{pid}]: {stats}'.format(
+            server=self.SERVER_NAME,
+            pid=os.getpid(),
+            stats=' '.join('{0}={1}'.format(*item) for item in self.stats().items())
+        ), file=sys.stderr, flush=True)
+
+    """
+    counts a connection closed because the client missed the deadline of
+    a phase (see Connection.expect).
+    """
+    def count_timeout(self, phase):
+        with self.stats_lock:
+            self.timeouts[phase] += 1
+
+    """
+    counts a request whose work was stopped because its client went away
+    (see Connection.abort).
+    """
+    def count_abort(self):
+        with self.stats_lock:
+            self.aborted += 1
+
+    """
+    hands an accepted connection to the worker pool. All the state of a
+    request lives in a Connection object, so that the workers do not
+    share anything but the server itself. A connection whose request has
+    not arrived yet is parked until it does.
+    """
+    def dispatch(self, client_connection, client_address):
+        connection = Connection(self, client_connection, client_address)
+        connection.slot = self.shedder is None
+        if connection.park():
+            return
+        self.schedule(connection)
+
+    """
+    queues a connection whose client sent something for a worker thread.
+    Called by the accepting thread, and by the parking thread.
+    """
+    def schedule(self, connection):
+        if self.shedder is None and not connection.slot:
+            # back from the parking: a slot if there is one left, but the
+            # request is served either way
+            connection.slot = self.slots.acquire(blocking=False)
+        connection.queued_at = time.monotonic()
+        if self.shedder is not None and not self.shedder.enqueue():
+            # overloaded: the connection is answered with 503 at once, by the
+            # accepting (or parking) thread, instead of waiting for a worker
+            connection.serve(False)
+            return
+        if not self.fast_lane.submit(connection.handle):
+            # the server is exiting
+            if self.shedder is not None:
+                self.shedder.cancel()
+            connection.close()
+
+    """
+    called once a connection is closed: forgets it, and frees its slot.
+    """
+    def connection_closed(self, connection):
+        with self.stats_lock:
+            self.connections.discard(connection)
+        connection.release_slot()
+
+# Per-connection state and request handling
+class Connection(object):
+
+    # largest number of bytes of responses held back on a pipelined
+    # connection before they are sent (see Connection.send)
+    PIPELINE_BATCH_SIZE = 65536
+
+    """
+    constructor, takes the server which accepted the connection, and the
+    (conn, addr) pair returned by accept().
+    """
+    def __init__(self, server, client_connection, client_address):
+        self.server = server
+        self.client_connection = client_connection
+        self.client_address = client_address
         """
-        socket.recv(bufsize[,flags]) receives data from the socket.
-        It returns a bytes object representing the data received.
-        bufsize specifies the maximum amount of data to be received
-        at once (in this case, 1024 bytes). flags defaults to 0. See
-        Unix man page recv(2) for an explanation.
-        [bytes object]
-        native python object which is an immutable sequence of integers
-        in the range [0,256[
+        [TCP_NODELAY]
+        disables Nagle's algorithm, which holds back a small segment while
+        a previous one is not acknowledged: the pieces of a streamed
+        response, and the responses of a persistent connection, are sent
+        as soon as they are written.
         """
-        # Receives data by the client_connection socket object returned
-        # by accept() (in self.serve_forever).
-        self.request_data = request_data = self.client_connection.recv(1024)
+        if server.tcp_nodelay:
+            client_connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Return headers set by Web framework/Web application
+        self.headers_set = []
+        # buffer of the connection, and parser of the requests received
+        # in it (see request.py)
+        config = server.config
+        self.parser = RequestParser(config.max_header_size(), config.max_body_size())
+        # the request being served
+        self.request = None
+        # number of requests served on this connection
+        self.requests_handled = 0
+        # whether the connection must be closed after the current response
+        self.close_connection = True
         """
-        Print formatted request data a la 'curl -v'.
-        The bytearray object request_data is first converted to str
-        using .decode('utf-8'), then it is split in lines, and they
-        are printed in format (note the '<' for denoting a request):
-        < line1
-        < line2
-        ...
+        what the connection is waiting for, and until when (time.monotonic):
+        [idle]   the next request on a persistent connection
+        [header] the rest of the head of a request
+        [body]   the rest of the body of a request
+        [write]  the client to accept more of the response
+        [None]   nothing (e.g. the response is being rendered)
         """
-        print(''.join(
-            '< {line}\n'.format(line=line)
-            for line in request_data.decode('utf-8').splitlines()
-        ))
+        self.phase = None
+        self.deadline = None
+        # time.monotonic() when the connection (or, in the event loop, its
+        # request) was queued for a worker thread
+        self.queued_at = time.monotonic()
+        # buffers of the responses held back while the next pipelined
+        # requests are served, and their size (see Connection.send)
+        self.held = []
+        self.held_size = 0
+        # whether the client of the response being sent went away, and was
+        # counted (see abort)
+        self.aborted = False
+        # whether the connection holds one of the slots of the server (see
+        # WSGIServer.serve_forever)
+        self.slot = False
+
+    """
+    entry point of a worker thread: handles the requests of a persistent
+    (keep-alive) connection one after the other, and makes sure the client
+    connection is closed even if the application fails.
+    """
+    def handle(self):
+        self.serve(self.admitted())
+
+    """
+    serves the connection, or answers it with 503 Service Unavailable if
+    it is not admitted, then closes it.
+    [buffers]
+    the response being rendered, when the connection is handed over to
+    the render lane (see handle_one_request). Once it is rendered, the
+    connection goes back to the fast lane, which sends what the client
+    did not take yet, and serves the next request.
+    [rendered]
+    True in the fast lane, when the connection comes back from the render
+    lane.
+    """
+    def serve(self, admitted, buffers=None, rendered=False):
+        # whether the connection was handed over to another lane
+        handed_over = False
+        with self.server.stats_lock:
+            self.server.connections.add(self)
+        try:
+            if buffers is not None:
+                self.send_response(buffers, wait=False)
+                handed_over = self.server.fast_lane.submit(self.serve, True, None, True)
+            elif admitted:
+                keep_alive = True
+                if rendered:
+                    # the end of the rendered response
+                    try:
+                        self.flush()
+                    except ConnectionError:
+                        self.abort()
+                        raise
+                    self.log_request()
+                    keep_alive = not self.close_connection
+                while keep_alive:
+                    if self.park():
+                        # the worker is free until the next request arrives
+                        handed_over = True
+                        break
+                    keep_alive = self.handle_one_request()
+                else:
+                    handed_over = keep_alive is None
+            else:
+                self.reject()
+        except socket.timeout:
+            # the client missed a deadline (e.g. kept the connection idle for
+            # too long, or is sending its request very slowly)
+            self.timed_out()
+        except ConnectionError:
+            # the client went away
+            pass
+        except Exception:
+            # report the error without killing the worker thread
+            traceback.print_exc()
+        finally:
+            # a connection handed over lives on in the other lane
+            if not handed_over:
+                self.close()
+
+    """
+    parks the connection (see parking.py) if its client has sent nothing
+    since the last response (or since it connected): the worker thread
+    does not wait with it. Returns whether it was parked.
+    """
+    def park(self):
+        parking = self.server.parking
+        if parking is None or self.server.draining or self.parser.pending() or self.readable():
+            return False
+        # the responses held back are sent before waiting for the client
+        self.flush()
+        self.expect('idle' if self.requests_handled else 'header')
+        self.release_slot()
+        parking.park(self)
+        return True
+
+    """
+    whether something was received on the connection (or the client
+    closed it), checked without blocking nor consuming anything (see
+    disconnected).
+    """
+    def readable(self):
+        client_connection = self.client_connection
+        timeout = client_connection.gettimeout()
+        try:
+            if timeout != 0:
+                client_connection.setblocking(False)
+            client_connection.recv(1, socket.MSG_PEEK)
+            return True
+        except (BlockingIOError, InterruptedError):
+            return False
+        except OSError:
+            # e.g. reset by the client: the worker finds out
+            return True
+        finally:
+            if timeout != 0:
+                client_connection.settimeout(timeout)
+
+    """
+    frees the slot of the server held by the connection, if any.
+    """
+    def release_slot(self):
+        if self.slot:
+            self.slot = False
+            self.server.slots.release()
+
+    """
+    closes the connection.
+    """
+    def close(self):
+        """
+        mark the socket closed. The underlying system resource (e.g.
+        a file descriptor) is also closed when all file objects from
+        makefile() are closed.
+        One this happens, all future operations on the socket will fail.
+        The remote end will receive no more data.
+        """
+        # Closes socket, regardless of the success of the response
+        self.client_connection.close()
+        # responses which could not be sent
+        response.close(self.held)
+        self.server.connection_closed(self)
+
+
+    """
+    custom method that handles one request. This method is called in
+    self.handle by a worker thread. Returns True if the connection is
+    to be kept open for another request, None if it was handed over to
+    the render lane.
+    """
+    def handle_one_request(self):
+        try:
+            request = self.read_request()
+        except HTTPError as error:
+            # malformed or too large request: answer with the error and
+            # close the connection, whose remaining bytes make no sense
+            self.expect('write')
+            self.client_connection.settimeout(self.timeout('write'))
+            self.held.extend(self.error_response(error))
+            self.flush()
+            self.log_request()
+            return False
+
+        # The client closed the connection
+        if request is None:
+            return False
 
-        # If not request data is represent, then return. Don't know why this
-        # happens, but the connection drops out and an exception error is
-        # printed by Python due to an empty request.
-        if (request_data == ''):
+        # The client switches to HTTP/2
+        if request.is_http2_preface() or (self.server.http2 and request.http2_settings() is not None):
+            self.serve_http2(request)
+            return False
+
+        # Run the application on the request
+        result = self.run_application(request)
+        buffers = self.build_response(result)
+        if isinstance(buffers[-1], response.Stream) and self.server.render_lane is not None:
+            """
+            The body is a generator: the page is rendered as it is sent.
+            This is expensive work, for the render lane, so that this
+            worker of the fast lane is free for the cheap requests.
+            """
+            if self.server.render_lane.submit(self.serve, True, buffers):
+                # None: handed over
+                return None
+            # the render lane is full
+            response.close(buffers)
+            self.expect('write')
+            self.client_connection.settimeout(self.timeout('write'))
+            self.held.extend(self.overloaded_response(request))
+            self.flush()
+            self.log_request()
+            return False
+
+        """
+        The server or gateway transmits the yielded strings (by application)
+        to the client, in an unbuffered fashion, completing the
+        transmission of each string before requesting another one (in
+        other words, applications should perform their own buffering).
+        Construct a response and send it back to the client.
+        Calls self.send_response() by giving as argument the
+        response built out of the result outputted by the web application
+        after giving it the environment dictionary and the start_response
+        function. send_response actually sends it and logs it to the
+        access log.
+        """
+        self.send_response(buffers)
+        return not self.close_connection
+    """
+    serves the connection in HTTP/2 (see http2.py) once the client sent
+    either the preface of HTTP/2, or a request asking to upgrade to it,
+    which is answered in HTTP/2. A preface is answered with 505 HTTP
+    Version Not Supported when HTTP/2 is disabled.
+    """
+    def serve_http2(self, request):
+        if not self.server.http2:
+            self.request = request
+            self.expect('write')
+            self.client_connection.settimeout(self.timeout('write'))
+            self.held.extend(self.error_response(HTTPError('505 HTTP Version Not Supported', 'HTTP/2 is not enabled.')))
+            self.flush()
+            self.log_request()
             return
+        # http2.py builds on this module (like eventloop.py): it is
+        # imported when it is first needed
+        import http2
+        # the responses held back go first
+        self.flush()
+        session = http2.H2Session(self)
+        if request.is_http2_preface():
+            session.run()
+        else:
+            session.run((request, request.http2_settings()))
+
+    """
+    reads the next request on the client connection, with its body.
+    Returns the Request, or None if the client closes the connection.
+    Raises HTTPError if the request is malformed or too large.
+    """
+    def read_request(self):
+        parser = self.parser
+        request = parser.parse()
+        # a new connection must send its request within the header timeout,
+        # a persistent connection may first stay idle for a while. A parked
+        # connection keeps the deadline it was parked with.
+        if self.phase in ('idle', 'header'):
+            pass
+        elif self.requests_handled and not parser.pending():
+            self.expect('idle')
+        else:
+            self.expect('header')
+        while request is None:
+            # the responses held back are sent before waiting for the client
+            self.flush()
+            self.wait()
+            """
+            socket.recv_into(buffer[, nbytes[, flags]]) receives data from
+            the socket into a writable buffer (here, a memoryview on the
+            buffer of the parser) instead of creating a new bytes object.
+            It returns the number of bytes received, 0 when the client has
+            closed the connection.
+            """
+            # Receives data by the client_connection socket object returned
+            # by accept() (in WSGIServer.serve_forever).
+            received = self.client_connection.recv_into(parser.free())
+            if not received:
+                return None
+            parser.received(received)
+            if self.phase == 'idle':
+                self.expect('header')
+            request = parser.parse()
+        self.expect('body')
+        while not request.body_complete():
+            self.flush()
+            self.wait()
+            received = self.client_connection.recv_into(request.body_free())
+            if not received:
+                return None
+            request.body_received += received
+        return request
+    """
+    takes a parsed request (see request.py) and calls the application on
+    it. Returns the result of the application. This method does no I/O on
+    the client connection, so that it can also be called by servers which
+    read and write the socket themselves (see eventloop.py).
+    """
+    def run_application(self, request):
+        self.request = request
+        if self.server.config.debug():
+            self.dump_request(request)
 
-        # Call self.parse_request on the data received by the request)
-        self.parse_request(request_data)
+        self.requests_handled += 1
+        self.server.count_request()
+        self.close_connection = not self.should_keep_alive()
+        # headers of the previous request on the connection
+        self.headers_set = []
 
         # Construct environment dictionary using request data
         # this dictionary contains the data required by the application
@@ -259,62 +1001,27 @@ class WSGIServer(object):
         When called by the server, the application object must return
         an iterable yielding zero or more strings ('result' here).
         """
-        result = self.application(env, self.start_response, self.config)
-
-        """
-        The server or gateway transmits the yielded strings (by application)
-        to the client, in an unbuffered fashion, completing the
-        transmission of each string before requesting another one (in
-        other words, applications should perform their own buffering).
-        Construct a response and send it back to the client.
-        Calls self.finish_response() by giving as argument the
-        result outputted by the web application after giving it
-        the environment dictionary and the start_response function.
-        finish_response actually builds the response and prints it in
-        a curl-like format.
-        """
-        self.finish_response(result)
+        return self.server.application(env, self.start_response, self.server.config)
     """
-    method called when handling one request (with self.handle_one_request)
-    which takes un-parsed text (bytes object) coming from a recv() call
-    (when receiving data from a client request). This method parses the
-    first line of the request text, and saves various parts into:
-    * self.request_method : first part. e.g. GET
-    * self.path           : second part, the url. e.g. /hello
-    * self.request_version: third part, HTTP version. e.g. HTTP/1.0
+    decides whether the connection is kept open after the response to the
+    current request (HTTP persistent connection, a.k.a. keep-alive):
+    * HTTP/1.1 connections are persistent, unless the client sends the
+      header 'Connection: close'
+    * HTTP/1.0 connections are closed, unless the client sends the header
+      'Connection: keep-alive'
+    The server closes the connection anyway after max-keep-alive-requests
+    requests, or when keep-alive is disabled (a timeout of 0).
     """
-    def parse_request(self, text):
-        """
-        split the line when encountering a newline (e.g. \n, \r
-        \r\n, \v, \f, ...). Then, select only the first line
-        (the resulting splitted lines are strings which do NOT
-        contain newline characters)
-        """
-        request_line = text.decode('utf-8').splitlines()[0]
-        """
-        rstrip([chars]) trims the given string by removing all
-        instances of the given chars at the end (right) of the
-        given string. In this case, we strip the newline '\r\n'.
-        This is useful only if there are many '\r\n' left after
-        the first one, stripped by splitlines().
-        \r is the carriage return character. \n is the newline.
-        The pair carriagereturn-newline is needed as a newline
-        symbol in a network terminal session (for example when
-        using telnet).
-        """
-        request_line = request_line.rstrip('\r\n')
-        """
-        Break down the request line into components.
-        split() splits when it encounters whitespaces
-        therefore a line like:
-        GET /hello HTPP/1.1
-        is split into:
-        'GET', '/hello', 'HTTP/1.1'
-        """
-        (self.request_method,   # GET
-        self.path,              # /hello
-        self.request_version    # HTTP/1.1
-        ) = request_line.split()
+    def should_keep_alive(self):
+        config = self.server.config
+        if config.keepalive_timeout() <= 0 or self.server.draining:
+            return False
+        if self.requests_handled >= config.max_keepalive_requests():
+            return False
+        connection = self.request.header('connection', '').lower()
+        if self.request.version == 'HTTP/1.1':
+            return connection != 'close'
+        return connection == 'keep-alive'
     """
     method that creates the environment dictionary (required according
     to WSGI specifications) and returns it. This is used in
@@ -339,20 +1046,38 @@ class WSGIServer(object):
         env['wsgi.version']     = (1,0)
         env['wsgi.url_scheme']  = 'http'
         # as input, we use a BytesIO object (buffer-like class)
-        # initialized with the data (bytes object) of the request
-        env['wsgi.input']       = io.BytesIO(self.request_data)
+        # initialized with the body (bytes object) of the request
+        env['wsgi.input']       = io.BytesIO(self.request.body)
         # sys.stderr is the file object corresponding to the standard error
         env['wsgi.errors']      = sys.stderr
-        env['wsgi.multithread'] = False
-        env['wsgi.multiprocess']= False
+        env['wsgi.multithread'] = self.server.multithread
+        env['wsgi.multiprocess']= self.server.multiprocess
         env['wsgi.run_once']    = False
+        # files returned wrapped in it are sent with os.sendfile
+        env['wsgi.file_wrapper']= response.FileWrapper
         # Required CGI variables
-        # (these were extracted by self.parse_request in self.handle_one_request)
-        env['REQUEST_METHOD'] = self.request_method     # GET
-        env['PATH_INFO'] = self.path                    # /hello
-        env['SERVER_NAME'] = self.server_name           # localhost
+        # (these were extracted by the RequestParser in self.read_request)
+        env['REQUEST_METHOD'] = self.request.method     # GET
+        env['SCRIPT_NAME'] = ''
+        env['PATH_INFO'] = self.request.path            # /hello
+        env['QUERY_STRING'] = self.request.query_string # lang=en
+        env['SERVER_NAME'] = self.server.server_name    # localhost
         # since the request parameters must be strings, we stringify this
-        env['SERVER_PORT'] = str(self.server_port)      # 8888
+        env['SERVER_PORT'] = str(self.server.server_port) # 8888
+        env['SERVER_PROTOCOL'] = self.request.version   # HTTP/1.1
+        if isinstance(self.client_address, tuple):
+            env['REMOTE_ADDR'] = self.client_address[0]
+        """
+        The request headers are passed as HTTP_ variables: the name is
+        uppercased, with '-' replaced by '_'. E.g. the value of the header
+        'Accept-Encoding' is in env['HTTP_ACCEPT_ENCODING'].
+        Content-Type and Content-Length are passed without the prefix.
+        """
+        for name, value in self.request.fields.items():
+            key = name.upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            env[key] = value
         return env
     """
     start_response function. This is given as second argument to the
@@ -380,7 +1105,7 @@ class WSGIServer(object):
         # Add necessary server headers
         server_headers = [
             ('Date', time.strftime("%a, %d %b %Y %H:%M:%S GMT")), # Example: Tue, 31 Mar 2015 12:54:48 GMT
-            ('Server', '/'.join([ self.SERVER_NAME, self.VERSION_STRING ]))
+            ('Server', '/'.join([ WSGIServer.SERVER_NAME, WSGIServer.VERSION_STRING ]))
         ]
         # Stores headers by taking the status (passed to start_response),
         # the response_headers (passed to start_response by the app) and
@@ -391,58 +1116,396 @@ class WSGIServer(object):
         # for now.
         # return self.finish_response
     """
-    function that takes the response ouputted by the application, and
-    processes the answer and prints that, together with all the headers.
-    This method is invoked at the end of handle_one_request, and the
-    argument 'result' is of bytes type.
+    function that takes the response built out of the result of the
+    application (see build_response), and sends it to the client, header
+    block and body. This method is invoked at the end of
+    handle_one_request.
+    [wait]
+    False in the render lane: the response is only written as far as the
+    client takes it without waiting, the rest is held back, to be sent by
+    the fast lane (see serve). A slow client does not keep a worker of the
+    render lane from rendering.
     """
-    def finish_response(self, result):
-        # if there are problems when sending the response to the
-        # client, this block is skipped
+    def send_response(self, buffers, wait=True):
+        # the header block and the body chunks are sent together with
+        # sendmsg, without joining them (see response.py)
+        stream = None
+        if isinstance(buffers[-1], response.Stream):
+            stream = buffers.pop()
+        # each send may wait for the client for the write timeout (it is
+        # not a deadline for the whole response, which may be large)
+        self.expect('write')
+        self.client_connection.settimeout(self.timeout('write'))
+        self.aborted = False
         try:
-            # takes status string and all headers saved by start_response
-            # (start_response is called when it is passed to the application)
-            status, response_headers = self.headers_set
-            # formatted response. Note that as newline we use \r\n
-            response = 'HTTP/1.1 {status}\r\n'.format(status=status)
-            # format all the headers, one in each line.
-            # response_headers is a list of tuples (2 elements each).
-            # to pass the two elements as {0} and {1} arguments in the
-            # formatted string, we unzip the tuple with *
-            for header in response_headers:
-                response += '{0}: {1}\r\n'.format(*header)
-            # newline
-            response += '\r\n'
-            # format response given by the app, by glueing each
-            # string in the list of strings yielded as response
-            # (data is originally bytes, and we convert it to
-            # string with .decode('utf-8'))
-            for data in result:
-                response += data.decode('utf-8')
-            # Print formatted response data a la 'curl -v'
-            print(''.join(
-                '> {line}\n'.format(line=line)
-                for line in response.splitlines()
-            ))
-            """
-            socket.sendall(bytes[,flags]) sends data to the socket.
-            The socket must be connected to a remote socket.
-            The flags argument has the same meaning as flags in .recv()
-            Unlike send(), this method continues to send data from 'bytes'
-            untile either all data has been sent, or an error occurs.
-            On error, an exception is raised.
-            Note that the argument (response) must be converted from str
-            back to bytes again, since these mechanisms work with bytes
-            objects. That's why we use encode() on it.
-            """
-            self.client_connection.sendall(response.encode())
+            if stream is not None:
+                # the header block is sent with the first piece of the body,
+                # then every piece as soon as the application yields it.
+                # The next piece may cost a render: it is not produced for a
+                # client which went away.
+                stream.check = self.check_connected
+                for piece in stream:
+                    buffers.extend(piece)
+                    if wait:
+                        self.send(buffers)
+                    else:
+                        self.send_available(buffers)
+                    buffers = []
+                self.response_length = stream.length
+            if not wait:
+                self.send_available(buffers)
+                return
+            self.send(buffers)
+            buffers = []
+        except ConnectionError:
+            # the client went away before the whole response was sent (if it
+            # was found gone by check_connected, it is counted already)
+            if not self.aborted:
+                self.abort()
+            raise
         finally:
-            """
-            mark the socket closed. The underlying system resource (e.g.
-            a file descriptor) is also closed when all file objects from
-            makefile() are closed.
-            One this happens, all future operations on the socket will fail.
-            The remote end will receive no more data.
-            """
-            # Closes socket, regardless of the success of the response
-            self.client_connection.close()
+            # the file of a wrapped file response is closed once sent, but
+            # not if sending fails
+            response.close(buffers)
+            if stream is not None:
+                stream.close()
+        self.log_request()
+    """
+    sends buffers of the response. While the next request is already
+    received (pipelined), the buffers are held back instead, and sent
+    along with the following responses: a burst of small pipelined
+    requests is answered with a single sendmsg. The responses are still
+    sent in order, and never held while the server waits for the client
+    (see read_request), nor beyond PIPELINE_BATCH_SIZE.
+    """
+    def send(self, buffers):
+        self.held.extend(buffers)
+        self.held_size += sum(len(buffer) for buffer in buffers)
+        if not self.pipelined() or self.held_size >= self.PIPELINE_BATCH_SIZE:
+            self.flush()
+
+    """
+    sends buffers of the response, along with the responses held back, as
+    far as the socket takes them without waiting for the client. The rest
+    is held back.
+    """
+    def send_available(self, buffers):
+        self.held.extend(buffers)
+        client_connection = self.client_connection
+        timeout = client_connection.gettimeout()
+        client_connection.setblocking(False)
+        try:
+            while self.held:
+                self.held = response.send(client_connection, self.held)
+        except BlockingIOError:
+            # the send buffer of the socket is full
+            pass
+        finally:
+            client_connection.settimeout(timeout)
+        self.held_size = sum(len(buffer) for buffer in self.held)
+
+    """
+    whether the responses may be held back: the connection stays open, and
+    the client already sent (part of) its next request.
+    """
+    def pipelined(self):
+        return (not self.close_connection and not self.server.draining
+            and self.parser.pending() > 0)
+
+    """
+    sends the responses held back, within the write timeout, then returns
+    to the phase the connection was in.
+    """
+    def flush(self):
+        if not self.held:
+            return
+        phase = self.phase
+        if phase != 'write':
+            self.expect('write')
+            self.client_connection.settimeout(self.timeout('write'))
+        held, self.held, self.held_size = self.held, [], 0
+        try:
+            response.send_all(self.client_connection, held)
+        except BaseException:
+            response.close(held)
+            raise
+        if phase != 'write':
+            self.expect(phase)
+
+    """
+    builds the response (status line, headers and body) out of the
+    result of the application, and returns it as a list of
+    buffers ready to be sent to the client: the header block followed by
+    the body chunks, which are neither decoded nor copied.
+    When the application returns a generator (or any iterable other than
+    a list), the body is not known yet: the last buffer is then a
+    response.Stream, which yields the body as the application produces it.
+    """
+    def build_response(self, result):
+        # takes status string and all headers saved by start_response
+        # (start_response is called when it is passed to the application)
+        status, response_headers = self.headers_set
+        response_headers = list(response_headers)
+        names = [ name.lower() for name, value in response_headers ]
+        stream = None
+        if self.request.method == 'HEAD':
+            # the response to a HEAD request has the headers of the response
+            # to a GET, but no body. The result is not iterated at all.
+            body = []
+            if isinstance(result, (list, tuple)):
+                if 'content-length' not in names and not status.startswith('304'):
+                    response_headers.append(('Content-Length', str(sum(map(len, result)))))
+            elif hasattr(result, 'close'):
+                result.close()
+        elif isinstance(result, response.FileWrapper) and result.count is not None:
+            # a file, sent as is with os.sendfile. No more than Content-Length
+            # bytes are sent (e.g. a range of the file)
+            if 'content-length' in names:
+                length = int(response_headers[names.index('content-length')][1])
+                result.count = min(result.count, length)
+            body = [ result ]
+        elif isinstance(result, (list, tuple)):
+            # the body of the response: the list of bytes objects returned
+            # by the application
+            body = list(result)
+        else:
+            # the body is sent as it is yielded, so its length is unknown:
+            # it is chunked, unless the application has set Content-Length
+            body = []
+            chunked = 'content-length' not in names and self.request.version == 'HTTP/1.1'
+            stream = response.Stream(result, chunked)
+        """
+        On a persistent connection the client can only tell where the
+        body ends by its length, so the Content-Length header is added
+        if the application did not set it, or the body is chunked. An
+        HTTP/1.0 client does not know the chunked coding: the end of a
+        streamed body is then the end of the connection. The Connection
+        header tells the client whether the connection stays open.
+        """
+        if self.request.method == 'HEAD':
+            pass
+        elif stream is not None:
+            if stream.chunked:
+                response_headers.append(('Transfer-Encoding', 'chunked'))
+            elif 'content-length' not in names:
+                self.close_connection = True
+        # (a 304 Not Modified response has no body, and its length would
+        # be mistaken for the length of the cached body)
+        elif 'content-length' not in names and not status.startswith('304'):
+            response_headers.append(('Content-Length', str(sum(map(len, body)))))
+        if self.close_connection:
+            response_headers.append(('Connection', 'close'))
+        elif self.request.version != 'HTTP/1.1':
+            response_headers.append(('Connection', 'keep-alive'))
+        # the status line and the headers, one in each line, as bytes.
+        # Note that as newline we use \r\n
+        header_block = response.header_block(status, response_headers)
+        # for the access log
+        self.response_status = status
+        self.response_length = sum(map(len, body))
+        if self.server.config.debug():
+            self.dump_response(header_block, body if 'content-encoding' not in names else [])
+        if stream is not None:
+            body.append(stream)
+        return [ header_block ] + body
+    """
+    builds the response to a request which could not be parsed, and
+    marks the connection to be closed.
+    """
+    def error_response(self, error, request=None):
+        self.close_connection = True
+        # the request answered, if it could be parsed
+        self.request = request
+        body = error.message.encode('utf-8')
+        self.response_status = error.status
+        self.response_length = len(body)
+        header_block = response.header_block(error.status, [
+            ('Content-Type', 'text/plain; charset=utf-8'),
+            ('Content-Length', str(len(body))),
+            ('Connection', 'close')
+        ] + error.headers)
+        return [ header_block, body ]
+    """
+    returns whether the request (or connection) picked up by a worker
+    thread is to be served, given how long it waited in the queue (see
+    shedding.py).
+    """
+    def admitted(self):
+        shedder = self.server.shedder
+        return shedder is None or shedder.admit(time.monotonic() - self.queued_at)
+    """
+    builds the 503 Service Unavailable response to a request shed because
+    the server is overloaded. Retry-After tells the client when to retry.
+    """
+    def overloaded_response(self, request=None):
+        return self.error_response(self.overloaded_error(), request)
+    """
+    returns the error answered to a request shed because the server is
+    overloaded.
+    """
+    def overloaded_error(self):
+        return HTTPError(
+            '503 Service Unavailable',
+            'The server is overloaded. Please retry later.',
+            [ ('Retry-After', str(self.server.config.retry_after())) ]
+        )
+    """
+    answers a connection which waited too long for a worker thread with
+    503, without waiting for the request nor running the application.
+    The request is parsed if it has already arrived, for the access log.
+    The response is sent without waiting (it is called by the accepting
+    thread too): it fits in the send buffer of a new connection, and a
+    client which does not take it is not waited for. The connection is
+    then closed by the caller.
+    """
+    def reject(self):
+        request = None
+        self.client_connection.setblocking(False)
+        try:
+            self.parser.received(self.client_connection.recv_into(self.parser.free()))
+            request = self.parser.parse()
+        except (OSError, HTTPError):
+            pass
+        try:
+            self.client_connection.send(b''.join(self.overloaded_response(request)))
+        except OSError:
+            pass
+        self.log_request()
+    """
+    whether the client closed (or reset) the connection, checked without
+    blocking nor consuming anything.
+    [MSG_PEEK]
+    recv() returns the data without removing it from the receive buffer:
+    a pipelined request is still read afterwards. It returns b'' when the
+    client closed the connection.
+    A client which only shuts down its sending side after its request
+    (half-close) looks the same, and is taken as gone too, like nginx does.
+    """
+    def disconnected(self):
+        client_connection = self.client_connection
+        timeout = client_connection.gettimeout()
+        try:
+            # the socket methods wait up to the timeout for the socket to
+            # be readable: the check is made in non-blocking mode
+            if timeout != 0:
+                client_connection.setblocking(False)
+            return not client_connection.recv(1, socket.MSG_PEEK)
+        except (BlockingIOError, InterruptedError):
+            # nothing received: the client is waiting for the response
+            return False
+        except OSError:
+            # e.g. reset by the client
+            return True
+        finally:
+            if timeout != 0:
+                client_connection.settimeout(timeout)
+
+    """
+    called when the client went away before its response was complete:
+    the work on the request stops. The request is counted, and logged
+    with the 499 status of nginx (Client Closed Request).
+    """
+    def abort(self):
+        self.aborted = True
+        self.server.count_abort()
+        self.response_status = '499 Client Closed Request'
+        self.log_request()
+
+    """
+    raises ConnectionAbortedError (after abort) if the client went away.
+    """
+    def check_connected(self):
+        if self.disconnected():
+            self.abort()
+            raise ConnectionAbortedError('the client closed the connection')
+
+    """
+    queues the request just answered to the access log: request line,
+    status, body length, and the time elapsed since the request was
+    received.
+    """
+    def log_request(self):
+        access_log = self.server.access_log
+        if access_log is None:
+            return
+        request = self.request
+        if request is None:
+            request_line, latency = '-', 0.0
+        else:
+            request_line = ' '.join([ request.method, request.target, request.version ])
+            latency = time.monotonic() - request.received_at
+        access_log.log(self.client_address, request_line, self.response_status, self.response_length, latency)
+    """
+    prints a request a la 'curl -v', request line and headers, in format
+    (note the '<' for denoting a request):
+    < GET /hello HTTP/1.1
+    < Host: localhost:8888
+    ...
+    Only with the "debug" server setting (or --debug): printing every
+    request costs more than serving it.
+    """
+    def dump_request(self, request):
+        print(''.join(
+            '< {line}\n'.format(line=line)
+            for line in [ ' '.join([ request.method, request.target, request.version ]) ]
+                + [ '{0}: {1}'.format(*header) for header in request.headers ]
+        ))
+    """
+    prints a response a la 'curl -v', with a '>' before each line of the
+    header block and of the body (files sent with sendfile and compressed
+    bodies are left out). Only with the "debug" server setting.
+    """
+    def dump_response(self, header_block, body):
+        print(''.join(
+            '> {line}\n'.format(line=line)
+            for data in [ header_block ] + body
+            if not isinstance(data, response.FileWrapper)
+            for line in data.decode('utf-8', 'replace').splitlines()
+        ))
+    """
+    returns the timeout of a phase, in seconds.
+    """
+    def timeout(self, phase):
+        config = self.server.config
+        if phase == 'idle':
+            return config.keepalive_timeout()
+        if phase == 'header':
+            return config.header_timeout()
+        if phase == 'body':
+            return config.body_timeout()
+        return config.write_timeout()
+    """
+    enters a phase of the connection, whose deadline is the timeout of
+    the phase from now.
+    """
+    def expect(self, phase):
+        self.phase = phase
+        self.deadline = time.monotonic() + self.timeout(phase)
+    """
+    sets the timeout of the client socket to the time left until the
+    deadline, or raises socket.timeout if it has passed. The deadline
+    holds for the whole phase, not for each recv: a client sending a
+    byte every few seconds (slowloris) still misses it.
+    """
+    def wait(self):
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout('timed out')
+        self.client_connection.settimeout(remaining)
+    """
+    called when the client missed the deadline of the current phase: counts
+    it, and answers a request which was partly received with 408 Request
+    Timeout (without waiting: the client is slow). The connection is then
+    closed by the caller.
+    """
+    def timed_out(self):
+        self.server.count_timeout(self.phase)
+        if self.phase == 'body' or (self.phase == 'header' and self.parser.pending()):
+            buffers = self.error_response(HTTPError('408 Request Timeout', 'The request was not received in time.'))
+            try:
+                self.client_connection.setblocking(False)
+                self.client_connection.send(b''.join(buffers))
+            except OSError:
+                pass
+            self.log_request()
+        self.phase = self.deadline = None
@@ -0,0 +1,95 @@
+"""
+Load shedding. When requests arrive faster than the workers can render
+them, they wait in a queue, and every request waits longer than the one
+before: clients time out and retry, and the server ends up rendering
+pages nobody is waiting for any more. It is better to answer some
+requests at once with 503 Service Unavailable (and Retry-After), so that
+the requests which are admitted are served in time.
+
+The decision follows CoDel (Controlled Delay, Nichols and Jacobson), an
+active queue management algorithm of network routers. The queue delay of
+a request is how long it waited for a worker. A short burst makes the
+delay exceed the target for a moment, which is fine: the queue drains.
+A standing queue keeps the delay above the target: when no request has
+waited less than the target for a whole interval, the server is
+overloaded, and the requests which waited longer than the target are
+shed until one waits less again. While overloaded, new requests are shed
+before they are even queued, so that they are answered at once; the
+shedding stops when a request waits less than the target, or when the
+queue is empty.
+"""
+
+import threading
+import time
+
+# Admission control of the requests, by their queue delay
+class LoadShedder(object):
+
+    """
+    [target]
+    acceptable queue delay, in seconds.
+    [interval]
+    how long the delay must stay above the target before requests are
+    shed, in seconds. It should be about the time it takes to render a
+    page, so that a burst is absorbed.
+    """
+    def __init__(self, target, interval):
+        self.target = target
+        self.interval = interval
+        # time at which the delay will have been above the target for a
+        # whole interval (None: the last delay was below the target)
+        self.above_until = None
+        # whether requests are being shed
+        self.shedding = False
+        # number of requests queued and not picked up yet
+        self.queued = 0
+        # number of requests shed
+        self.shed = 0
+        self.lock = threading.Lock()
+
+    """
+    called before a request is queued for a worker. Returns True if it is
+    to be queued, False if it is to be shed at once.
+    """
+    def enqueue(self):
+        with self.lock:
+            if not self.queued:
+                # the queue drained
+                self.above_until = None
+                self.shedding = False
+            if self.shedding:
+                self.shed += 1
+                return False
+            self.queued += 1
+            return True
+
+    """
+    called when a request counted by enqueue will not be picked up by a
+    worker after all (e.g. it could not be queued: the server is exiting).
+    """
+    def cancel(self):
+        with self.lock:
+            self.queued -= 1
+
+    """
+    called when a worker picks up a queued request which waited for delay
+    seconds. Returns True if the request is to be served, False if it is
+    to be shed.
+    """
+    def admit(self, delay):
+        now = time.monotonic()
+        with self.lock:
+            self.queued -= 1
+            if delay < self.target:
+                # the queue drained: leave the shedding state
+                self.above_until = None
+                self.shedding = False
+                return True
+            if self.above_until is None:
+                self.above_until = now + self.interval
+            elif now >= self.above_until:
+                self.shedding = True
+            if self.shedding:
+                self.shed += 1
+                return False
+            return True
@@ -0,0 +1,143 @@
+"""
+Single-flight rendering. When a popular page changes, or the caches are
+cold after a restart, many requests for the same page arrive before the
+first render of it is complete: each would convert the same markdown
+again. Instead, the first request renders the page (it leads the flight),
+and the requests for the same page which arrive meanwhile (the followers)
+wait for its result: one render for all of them. If the render fails, the
+followers fail with the same error.
+
+A leader whose client goes away stops rendering (see WSGIServer.abort),
+unless followers are waiting for the page: the render is then completed
+for them.
+"""
+
+import threading
+
+# A render in progress, shared by the requests for the same page
+class Flight(object):
+
+    def __init__(self):
+        # set once the render is over: the page, or the error it failed with
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # number of requests waiting for the page
+        self.waiters = 0
+
+    """
+    waits for the render to be over, and returns the page, or raises the
+    error the render failed with.
+    """
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+# The renders in progress, by page
+class Flights(object):
+
+    def __init__(self):
+        # { key: Flight }
+        self.flights = {}
+        self.lock = threading.Lock()
+        # renders run, and renders saved: requests which waited for the
+        # render of another request instead of running their own
+        self.renders = 0
+        self.saved = 0
+
+    """
+    joins the flight of the page, started if there is none. Returns the
+    flight, and whether the caller leads it: the leader renders the page
+    and lands the flight, the others wait for it.
+    """
+    def join(self, key):
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = Flight()
+                return flight, True
+            flight.waiters += 1
+            return flight, False
+
+    """
+    starts the flight of the page, and returns it, unless it is in flight
+    already (None). The caller leads it.
+    """
+    def lead(self, key):
+        with self.lock:
+            if key in self.flights:
+                return None
+            flight = self.flights[key] = Flight()
+            return flight
+
+    """
+    waits for the page rendered by the leader of a flight (see Flight.wait),
+    which the caller joined as a follower.
+    """
+    def follow(self, flight):
+        try:
+            page = flight.wait()
+        finally:
+            with self.lock:
+                flight.waiters -= 1
+        with self.lock:
+            self.saved += 1
+        return page
+
+    """
+    counts a render run by the leader of a flight.
+    """
+    def count_render(self):
+        with self.lock:
+            self.renders += 1
+
+    """
+    counts a render saved without a flight: the page was rendered by
+    another request before this one needed it.
+    """
+    def spare(self):
+        with self.lock:
+            self.saved += 1
+
+    """
+    ends a flight with the page rendered, or the error the render failed
+    with, and wakes up its followers. The next request for the page starts
+    a new flight (if the page is not in the cache by then).
+    """
+    def land(self, key, flight, result=None, error=None):
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        flight.result = result
+        flight.error = error
+        flight.done.set()
+
+    """
+    called when the leader of a flight would stop rendering, or not render
+    at all (e.g. its client went away). Returns True, and ends the flight, if no request is waiting
+    for the page: the render may stop. Returns False otherwise: the render
+    is to be completed, and the flight landed.
+    """
+    def abandon(self, key, flight):
+        with self.lock:
+            if flight.waiters:
+                return False
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        flight.error = ConnectionAbortedError('the render was abandoned')
+        flight.done.set()
+        return True
+
+    """
+    returns the counters of the flights, e.g.
+    {'in_flight': 1, 'renders': 12, 'saved': 40}
+    """
+    def stats(self):
+        with self.lock:
+            return {
+                'in_flight': len(self.flights),
+                'renders': self.renders,
+                'saved': self.saved
+            }
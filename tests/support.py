@@ -0,0 +1,112 @@
+"""
+Helpers of the tests: a server started in a process of its own, as with
+muggle.py --serve, on a free port and in a temporary directory.
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+MUGGLE = ROOT.joinpath('muggle.py')
+
+# the modules of the server, for the tests which use them directly
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+# the template of the pages served in the tests
+TEMPLATE = '<!doctype html><html><body>{{ content }}</body></html>'
+
+"""
+returns a TCP port nobody listens on.
+"""
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+# Mixin of the test cases which need a running server
+class ServerTest(object):
+
+    # the server core under test
+    CORE = 'threads'
+    # settings of the server, over the settings of the repository
+    SETTINGS = {}
+    # files of the served directory: { path: text }
+    FILES = {}
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        directory = Path(self.directory.name)
+        repo_dir = directory.joinpath('.muggle')
+        repo_dir.joinpath('theme').mkdir(parents=True)
+        repo_dir.joinpath('theme', 'template.html').write_text(TEMPLATE)
+        for path, text in self.FILES.items():
+            directory.joinpath(path).write_text(text)
+        self.port = free_port()
+        # the settings of the repository, on a free port
+        config = json.loads(ROOT.joinpath('.muggle', 'config.json').read_text())
+        config['server'].update({
+            'host': '127.0.0.1',
+            'port': self.port,
+            'unix-socket': '',
+            'core': self.CORE,
+            'workers': 1,
+            'disk-cache': False,
+            'access-log': os.devnull
+        })
+        config['server'].update(self.SETTINGS)
+        repo_dir.joinpath('config.json').write_text(json.dumps(config))
+        self.server = subprocess.Popen(
+            [sys.executable, str(MUGGLE), '--serve', self.directory.name],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline or self.server.poll() is not None:
+                    self.tearDown()
+                    raise
+                time.sleep(0.05)
+
+    def tearDown(self):
+        if self.server.poll() is None:
+            self.server.terminate()
+            self.server.wait(10)
+        self.directory.cleanup()
+
+    """
+    opens a connection to the server.
+    """
+    def connect(self, timeout=5):
+        return socket.create_connection(('127.0.0.1', self.port), timeout=timeout)
+
+    """
+    sends a request on a new connection, and returns the response: its
+    status line, its headers ({ lowercase name: value }) and its body,
+    read until the server closes the connection.
+    """
+    def request(self, data):
+        with self.connect() as client:
+            client.sendall(data)
+            response = b''
+            while True:
+                received = client.recv(65536)
+                if not received:
+                    break
+                response += received
+        head, _, body = response.partition(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return lines[0], headers, body
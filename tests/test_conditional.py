@@ -0,0 +1,89 @@
+"""
+Partial, conditional and HEAD requests, on both server cores: a Range of
+a static file is answered with 206 Partial Content (or 416 when it is
+outside of the file), a client which has the current version with 304
+Not Modified, and a HEAD request with the headers of the response only.
+"""
+
+import unittest
+
+from support import ServerTest
+
+# 100 bytes, not compressible (application/octet-stream)
+DATA = ''.join(chr(ord('a') + i % 26) for i in range(100))
+
+class ConditionalTest(ServerTest):
+
+    FILES = { 'index.md': '# Hello\n', 'data.bin': DATA }
+
+    """
+    sends a request for path, with the given headers, and returns the
+    status line, headers and body of the response.
+    """
+    def get(self, path, headers=(), method='GET'):
+        return self.request(''.join(
+            [ '{method} {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n'.format(method=method, path=path) ]
+            + [ '{0}: {1}\r\n'.format(*header) for header in headers ]
+            + [ '\r\n' ]
+        ).encode('latin-1'))
+
+    def test_range(self):
+        status, headers, body = self.get('/data.bin', [ ('Range', 'bytes=10-19') ])
+        self.assertEqual(status, 'HTTP/1.1 206 Partial Content')
+        self.assertEqual(headers['content-range'], 'bytes 10-19/100')
+        self.assertEqual(body, DATA[10:20].encode())
+        # the last bytes, and the rest from a position
+        status, headers, body = self.get('/data.bin', [ ('Range', 'bytes=-5') ])
+        self.assertEqual(headers['content-range'], 'bytes 95-99/100')
+        self.assertEqual(body, DATA[-5:].encode())
+        status, headers, body = self.get('/data.bin', [ ('Range', 'bytes=90-') ])
+        self.assertEqual(body, DATA[90:].encode())
+
+    def test_range_not_satisfiable(self):
+        status, headers, body = self.get('/data.bin', [ ('Range', 'bytes=100-') ])
+        self.assertEqual(status, 'HTTP/1.1 416 Range Not Satisfiable')
+        self.assertEqual(headers['content-range'], 'bytes */100')
+        self.assertEqual(body, b'')
+
+    def test_range_ignored(self):
+        # multiple ranges, another unit, a malformed range, or a file which
+        # changed since (If-Range): the whole file
+        for headers in ([ ('Range', 'bytes=0-1,5-6') ], [ ('Range', 'items=0-1') ],
+                [ ('Range', 'bytes=5-1') ],
+                [ ('Range', 'bytes=0-1'), ('If-Range', 'Mon, 01 Jan 2001 00:00:00 GMT') ]):
+            status, response_headers, body = self.get('/data.bin', headers)
+            self.assertEqual(status, 'HTTP/1.1 200 OK', headers)
+            self.assertEqual(body, DATA.encode(), headers)
+
+    def test_not_modified(self):
+        for path in ('/data.bin', '/'):
+            status, headers, body = self.get(path)
+            self.assertEqual(status, 'HTTP/1.1 200 OK')
+            for validator in ([ ('If-None-Match', headers['etag']) ],
+                    [ ('If-Modified-Since', headers['last-modified']) ]):
+                status, response_headers, body = self.get(path, validator)
+                self.assertEqual(status, 'HTTP/1.1 304 Not Modified', (path, validator))
+                self.assertEqual(response_headers['etag'], headers['etag'])
+                self.assertEqual(body, b'')
+            # another version
+            status, response_headers, body = self.get(path, [ ('If-None-Match', 'W/"0-0"') ])
+            self.assertEqual(status, 'HTTP/1.1 200 OK')
+
+    def test_head(self):
+        status, headers, body = self.get('/data.bin', method='HEAD')
+        self.assertEqual(status, 'HTTP/1.1 200 OK')
+        self.assertEqual(headers['content-length'], '100')
+        self.assertEqual(body, b'')
+        status, headers, body = self.get('/', method='HEAD')
+        self.assertEqual(status, 'HTTP/1.1 200 OK')
+        self.assertTrue(headers['content-type'].startswith('text/html'))
+        self.assertEqual(body, b'')
+
+class ThreadsCoreTest(ConditionalTest, unittest.TestCase):
+    CORE = 'threads'
+
+class EventsCoreTest(ConditionalTest, unittest.TestCase):
+    CORE = 'events'
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+"""
+A request with a malformed Content-Length header is answered with 400 Bad
+Request, and the server goes on serving, on both server cores.
+"""
+
+import unittest
+
+from support import ServerTest
+
+class ContentLengthTest(ServerTest):
+
+    """
+    sends a request on a new connection, and returns the status line of
+    the response (b'' if the connection was closed without one).
+    """
+    def status(self, request):
+        with self.connect() as client:
+            client.sendall(request)
+            return client.makefile('rb').readline().rstrip(b'\r\n')
+
+    def test_malformed_content_length(self):
+        for content_length in (b'-1', b'+1', b' 1 1', b'1_0', b'x'):
+            request = b'POST / HTTP/1.1\r\nHost: localhost\r\nContent-Length: ' + content_length + b'\r\n\r\n'
+            self.assertEqual(self.status(request), b'HTTP/1.1 400 Bad Request', content_length)
+        # the server is still up
+        self.assertEqual(self.status(b'GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')[:9], b'HTTP/1.1 ')
+        self.assertIsNone(self.server.poll())
+
+class ThreadsCoreTest(ContentLengthTest, unittest.TestCase):
+    CORE = 'threads'
+
+class EventsCoreTest(ContentLengthTest, unittest.TestCase):
+    CORE = 'events'
+
+if __name__ == '__main__':
+    unittest.main()
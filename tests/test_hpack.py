@@ -0,0 +1,110 @@
+"""
+HPACK (see hpack.py): the integers, the Huffman coded strings and the
+header blocks of the examples of RFC 7541 (appendix C), and round trips
+through an encoder and a decoder sharing a dynamic table.
+"""
+
+import unittest
+
+# puts the modules of the server on the path
+import support
+import hpack
+
+class IntegerTest(unittest.TestCase):
+
+    def test_examples(self):
+        # RFC 7541 C.1: 10 and 1337 with a 5-bit prefix, 42 on a whole byte
+        self.assertEqual(hpack.encode_integer(10, 5), bytes.fromhex('0a'))
+        self.assertEqual(hpack.encode_integer(1337, 5), bytes.fromhex('1f9a0a'))
+        self.assertEqual(hpack.encode_integer(42, 8), bytes.fromhex('2a'))
+
+    def test_round_trip(self):
+        for n in (4, 5, 6, 7, 8):
+            for value in (0, 1, (1 << n) - 2, (1 << n) - 1, 1 << n, 127, 128, 1337, 2 ** 20):
+                encoded = hpack.encode_integer(value, n, 0)
+                self.assertEqual(hpack.decode_integer(encoded, 0, n), (value, len(encoded)))
+
+    def test_truncated(self):
+        with self.assertRaises(hpack.HPACKError):
+            hpack.decode_integer(bytes.fromhex('1f9a'), 0, 5)
+
+class HuffmanTest(unittest.TestCase):
+
+    def test_example(self):
+        # RFC 7541 C.4.1
+        self.assertEqual(hpack.huffman_encode(b'www.example.com'), bytes.fromhex('f1e3c2e5f23a6ba0ab90f4ff'))
+
+    def test_round_trip(self):
+        for data in (b'', b'no-cache', bytes(range(256)), b'\xff' * 10):
+            self.assertEqual(hpack.huffman_decode(hpack.huffman_encode(data)), data)
+
+    def test_invalid_padding(self):
+        # 'a' is 00011 (5 bits): padded with 0 bits instead of 1 bits
+        with self.assertRaises(hpack.HPACKError):
+            hpack.huffman_decode(bytes([ 0b00011000 ]))
+        # a whole byte of padding
+        with self.assertRaises(hpack.HPACKError):
+            hpack.huffman_decode(hpack.huffman_encode(b'a') + b'\xff')
+
+class HeaderBlockTest(unittest.TestCase):
+
+    # RFC 7541 C.4: three requests on a connection, with Huffman coding
+    REQUESTS = [
+        ([ (':method', 'GET'), (':scheme', 'http'), (':path', '/'), (':authority', 'www.example.com') ],
+            '828684418cf1e3c2e5f23a6ba0ab90f4ff'),
+        ([ (':method', 'GET'), (':scheme', 'http'), (':path', '/'), (':authority', 'www.example.com'),
+            ('cache-control', 'no-cache') ],
+            '828684be5886a8eb10649cbf'),
+        ([ (':method', 'GET'), (':scheme', 'https'), (':path', '/index.html'), (':authority', 'www.example.com'),
+            ('custom-key', 'custom-value') ],
+            '828785bf408825a849e95ba97d7f8925a849e95bb8e8b4bf'),
+    ]
+
+    def test_examples(self):
+        encoder, decoder = hpack.Encoder(), hpack.Decoder()
+        for headers, block in self.REQUESTS:
+            self.assertEqual(encoder.encode(headers).hex(), block)
+            self.assertEqual(decoder.decode(bytes.fromhex(block)), headers)
+        # the dynamic tables of both ends hold the same entries
+        self.assertEqual(decoder.table.entries, [
+            ('custom-key', 'custom-value'), ('cache-control', 'no-cache'), (':authority', 'www.example.com')
+        ])
+        self.assertEqual(encoder.table.entries, decoder.table.entries)
+        self.assertEqual(decoder.table.size, 164)
+
+    def test_round_trip(self):
+        encoder, decoder = hpack.Encoder(), hpack.Decoder()
+        responses = [
+            [ (':status', '200'), ('content-type', 'text/html'), ('content-length', '1234'),
+                ('date', 'Sat, 17 Oct 2026 20:18:25 GMT'), ('x-custom', 'caf\xe9') ],
+            [ (':status', '304'), ('content-type', 'text/html'), ('etag', 'W/"1-2"') ],
+            [ (':status', '200'), ('content-type', 'text/html'), ('x-custom', 'caf\xe9') ],
+        ]
+        for headers in responses:
+            self.assertEqual(decoder.decode(encoder.encode(headers)), headers)
+        # the values which change with every response are not indexed
+        self.assertNotIn(('content-length', '1234'), encoder.table.entries)
+        self.assertIn(('x-custom', 'caf\xe9'), encoder.table.entries)
+
+    def test_table_size_update(self):
+        encoder, decoder = hpack.Encoder(), hpack.Decoder()
+        decoder.decode(encoder.encode([ ('x-a', 'a' * 100) ]))
+        # the other end announces a smaller table: the encoder says so at
+        # the beginning of its next block, and both ends evict the entry
+        encoder.resize(64)
+        block = encoder.encode([ ('x-b', 'b') ])
+        self.assertEqual(block[0] & 0xe0, 0x20)
+        self.assertEqual(decoder.decode(block), [ ('x-b', 'b') ])
+        self.assertEqual(decoder.table.entries, [ ('x-b', 'b') ])
+        self.assertEqual(encoder.table.entries, decoder.table.entries)
+
+    def test_malformed(self):
+        decoder = hpack.Decoder()
+        for block in ('80', 'ff00', '4085', '3fe21f'):
+            # index 0, an index past the tables, a truncated string, a table
+            # larger than allowed
+            with self.assertRaises(hpack.HPACKError, msg=block):
+                decoder.decode(bytes.fromhex(block))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+HTTP/2 in clear text (h2c): with prior knowledge, whether the preface and
+the first frames come in one write (as from a reverse proxy) or several,
+and with an upgrade from HTTP/1.1.
+"""
+
+import base64
+import unittest
+
+from support import ServerTest
+import hpack
+import http2
+
+"""
+returns a frame as bytes.
+"""
+def frame(frame_type, flags, stream_id, payload=b''):
+    return b''.join(http2.frame(frame_type, flags, stream_id, payload))
+
+"""
+returns a HEADERS frame of a GET request without body.
+"""
+def get(stream_id, path):
+    block = hpack.Encoder().encode([
+        (':method', 'GET'), (':scheme', 'http'), (':authority', 'localhost'), (':path', path)
+    ])
+    return frame(http2.HEADERS, http2.END_HEADERS | http2.END_STREAM, stream_id, block)
+
+class HTTP2Test(ServerTest, unittest.TestCase):
+
+    FILES = { 'index.md': '# Hello\n' }
+
+    """
+    reads the frames of the server until the end of the response on
+    stream 1. Returns its headers and its body. Raises socket.timeout if
+    the response does not come.
+    """
+    def response(self, client, buffer=b''):
+        decoder = hpack.Decoder()
+        headers = None
+        body = b''
+        while True:
+            while len(buffer) < http2.FRAME_HEADER.size:
+                buffer += self.receive(client)
+            length_type, flags, stream_id = http2.FRAME_HEADER.unpack_from(buffer)
+            length, frame_type = length_type >> 8, length_type & 0xff
+            end = http2.FRAME_HEADER.size + length
+            while len(buffer) < end:
+                buffer += self.receive(client)
+            payload, buffer = buffer[http2.FRAME_HEADER.size:end], buffer[end:]
+            if stream_id != 1:
+                continue
+            if frame_type == http2.HEADERS:
+                headers = dict(decoder.decode(payload))
+            elif frame_type == http2.DATA:
+                body += payload
+            if frame_type in (http2.HEADERS, http2.DATA) and flags & http2.END_STREAM:
+                return headers, body
+
+    def receive(self, client):
+        data = client.recv(65536)
+        if not data:
+            raise ConnectionError('the server closed the connection')
+        return data
+
+    def test_prior_knowledge_in_one_write(self):
+        with self.connect(timeout=3) as client:
+            client.sendall(http2.PREFACE + frame(http2.SETTINGS, 0, 0) + get(1, '/'))
+            headers, body = self.response(client)
+        self.assertEqual(headers[':status'], '200')
+        self.assertIn(b'<h1>Hello</h1>', body)
+
+    def test_prior_knowledge_in_several_writes(self):
+        with self.connect(timeout=3) as client:
+            client.sendall(http2.PREFACE[:10])
+            client.sendall(http2.PREFACE[10:] + frame(http2.SETTINGS, 0, 0))
+            client.sendall(get(1, '/'))
+            headers, body = self.response(client)
+        self.assertEqual(headers[':status'], '200')
+        self.assertIn(b'<h1>Hello</h1>', body)
+
+    def test_upgrade(self):
+        settings = base64.urlsafe_b64encode(http2.settings_payload([])).rstrip(b'=')
+        with self.connect(timeout=3) as client:
+            client.sendall(
+                b'GET / HTTP/1.1\r\nHost: localhost\r\nConnection: Upgrade, HTTP2-Settings\r\n'
+                b'Upgrade: h2c\r\nHTTP2-Settings: ' + settings + b'\r\n\r\n'
+                + http2.PREFACE + frame(http2.SETTINGS, 0, 0)
+            )
+            buffer = b''
+            while b'\r\n\r\n' not in buffer:
+                buffer += self.receive(client)
+            head, _, buffer = buffer.partition(b'\r\n\r\n')
+            self.assertTrue(head.startswith(b'HTTP/1.1 101 '))
+            headers, body = self.response(client, buffer)
+        self.assertEqual(headers[':status'], '200')
+        self.assertIn(b'<h1>Hello</h1>', body)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+"""
+On the threads core, the connections waiting for a request (new ones, and
+persistent ones between two requests) hold no worker thread: the other
+clients are served at once, and the idle connections still get their
+response when their request comes.
+"""
+
+import time
+import unittest
+
+from support import ServerTest
+
+GET = b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n'
+
+class ParkingTest(ServerTest, unittest.TestCase):
+
+    SETTINGS = { 'threads': 2, 'keep-alive-timeout': 30, 'header-timeout': 30 }
+    FILES = { 'index.md': '# Hello\n' }
+
+    """
+    reads one response from a persistent connection, and returns its
+    status line.
+    """
+    def response(self, client):
+        reader = client.makefile('rb')
+        status = reader.readline().rstrip(b'\r\n')
+        headers = {}
+        while True:
+            line = reader.readline().rstrip(b'\r\n')
+            if not line:
+                break
+            name, _, value = line.partition(b':')
+            headers[name.strip().lower()] = value.strip()
+        if headers.get(b'transfer-encoding') == b'chunked':
+            while True:
+                size = int(reader.readline(), 16)
+                reader.read(size + 2)
+                if not size:
+                    break
+        else:
+            reader.read(int(headers.get(b'content-length', 0)))
+        return status
+
+    def test_idle_connections_hold_no_worker(self):
+        idle = []
+        try:
+            # persistent connections, idle after a first request
+            for _ in range(4):
+                client = self.connect()
+                client.sendall(GET)
+                self.assertEqual(self.response(client), b'HTTP/1.1 200 OK')
+                idle.append(client)
+            # connections which did not send anything yet
+            for _ in range(4):
+                idle.append(self.connect())
+            # more idle connections than workers (and slots), yet a new
+            # client is served at once
+            start = time.monotonic()
+            status, headers, body = self.request(b'GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+            self.assertEqual(status, 'HTTP/1.1 200 OK')
+            self.assertLess(time.monotonic() - start, 2)
+            # the idle connections are served when their request comes
+            for client in idle:
+                client.sendall(GET)
+                self.assertEqual(self.response(client), b'HTTP/1.1 200 OK')
+        finally:
+            for client in idle:
+                client.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+The number of requests after which a worker is replaced: up to a tenth
+more than the setting, drawn by each worker once forked, so that the
+workers are not all replaced at the same moment.
+"""
+
+import os
+import struct
+import unittest
+
+# puts the modules of the server on the path
+import support
+from prefork import Arbiter
+from recycling import Recycler
+
+# Server of a worker which only reports the limit of its recycler
+class LimitServer(object):
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.recycler = Recycler(100000, 0)
+        self.multiprocess = False
+        self.request_replacement = None
+        self.access_log = None
+
+    def serve_forever(self):
+        os.write(self.writer, struct.pack('i', self.recycler.max_requests))
+
+class RecyclerTest(unittest.TestCase):
+
+    def test_jitter(self):
+        for _ in range(100):
+            recycler = Recycler(1000, 0)
+            self.assertTrue(1000 <= recycler.max_requests <= 1100)
+        self.assertEqual(Recycler(0, 0).max_requests, 0)
+
+    def test_count(self):
+        recycler = Recycler(10, 0)
+        recycler.max_requests = 3
+        self.assertEqual([ recycler.count() for _ in range(5) ], [ False, False, True, False, False ])
+        self.assertEqual(recycler.reason, 'after 3 requests')
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'no fork on this platform')
+    def test_workers_draw_their_own_limit(self):
+        reader, writer = os.pipe()
+        try:
+            arbiter = Arbiter(None, 2)
+            # the shared server, made once before the workers are forked
+            arbiter.server = LimitServer(writer)
+            arbiter.spawn()
+            arbiter.spawn()
+            for pid in list(arbiter.children):
+                os.waitpid(pid, 0)
+            limits = struct.unpack('ii', os.read(reader, 8))
+        finally:
+            os.close(reader)
+            os.close(writer)
+        for limit in limits:
+            self.assertTrue(100000 <= limit <= 110000)
+        self.assertNotEqual(limits[0], limits[1])
+
+if __name__ == '__main__':
+    unittest.main()
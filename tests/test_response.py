@@ -0,0 +1,63 @@
+"""
+A file sent as a response body (wsgi.file_wrapper), with os.sendfile or
+read block by block: it is sent completely, and a file which shrinks
+while it is sent raises an error instead of leaving the client waiting
+(or the server spinning) for the missing bytes.
+"""
+
+import socket
+import tempfile
+import threading
+import unittest
+
+# puts the modules of the server on the path
+import support
+import response
+
+class FileWrapperTest(unittest.TestCase):
+
+    def setUp(self):
+        self.file = tempfile.TemporaryFile()
+        self.file.write(b'x' * 100000)
+        self.file.seek(0)
+        self.server, self.client = socket.socketpair()
+        self.server.settimeout(5)
+        self.received = []
+        # reads the other end, so that the sends do not block
+        self.reader = threading.Thread(target=self.read)
+        self.reader.start()
+
+    def tearDown(self):
+        self.server.close()
+        self.reader.join()
+        self.client.close()
+        self.file.close()
+
+    def read(self):
+        while True:
+            data = self.client.recv(65536)
+            if not data:
+                return
+            self.received.append(data)
+
+    def test_send_all(self):
+        wrapper = response.FileWrapper(self.file)
+        response.send_all(self.server, [ b'head', wrapper ])
+        self.server.shutdown(socket.SHUT_WR)
+        self.reader.join()
+        self.assertEqual(b''.join(self.received), b'head' + b'x' * 100000)
+
+    def test_truncated_file(self):
+        wrapper = response.FileWrapper(self.file)
+        self.file.truncate(1000)
+        with self.assertRaises(response.TruncatedFileError):
+            response.send_all(self.server, [ wrapper ])
+
+    def test_truncated_file_iterated(self):
+        wrapper = response.FileWrapper(self.file)
+        self.file.truncate(1000)
+        with self.assertRaises(response.TruncatedFileError):
+            list(wrapper)
+
+if __name__ == '__main__':
+    unittest.main()
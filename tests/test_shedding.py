@@ -0,0 +1,85 @@
+"""
+The decisions of the load shedder (see shedding.py): a burst is absorbed,
+a standing queue makes it shed the requests which waited too long, and
+the new ones at once, until a request waits less than the target or the
+queue drains.
+"""
+
+import unittest
+from unittest import mock
+
+# puts the modules of the server on the path
+import support
+from shedding import LoadShedder
+
+TARGET = 0.1
+INTERVAL = 0.5
+
+class LoadShedderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shedder = LoadShedder(TARGET, INTERVAL)
+        # the clock of the shedder, moved by the tests
+        self.now = 1000.0
+        patcher = mock.patch('shedding.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    """
+    queues a request, and has it picked up after delay seconds. Returns
+    whether it was served.
+    """
+    def request(self, delay):
+        self.assertTrue(self.shedder.enqueue())
+        return self.shedder.admit(delay)
+
+    def test_short_delays(self):
+        for _ in range(10):
+            self.assertTrue(self.request(TARGET / 2))
+        self.assertEqual(self.shedder.shed, 0)
+
+    def test_burst(self):
+        # above the target, but for less than an interval
+        for _ in range(4):
+            self.assertTrue(self.request(TARGET * 2))
+            self.now += INTERVAL / 5
+        self.assertFalse(self.shedder.shedding)
+
+    def test_standing_queue(self):
+        # a request always waiting in the queue, the others waiting longer
+        # than the target for a whole interval: they are shed
+        self.assertTrue(self.shedder.enqueue())
+        self.assertTrue(self.request(TARGET * 2))
+        self.now += INTERVAL
+        self.assertFalse(self.request(TARGET * 2))
+        self.assertTrue(self.shedder.shedding)
+        # while shedding, new requests are not even queued
+        self.assertFalse(self.shedder.enqueue())
+        self.assertEqual(self.shedder.shed, 2)
+        # a request which waited less than the target ends the shedding
+        self.assertTrue(self.shedder.admit(TARGET / 2))
+        self.assertFalse(self.shedder.shedding)
+        self.assertTrue(self.request(TARGET * 2))
+
+    def test_queue_drained(self):
+        self.assertTrue(self.shedder.enqueue())
+        self.assertTrue(self.request(TARGET * 2))
+        self.now += INTERVAL
+        self.assertFalse(self.shedder.admit(TARGET * 2))
+        self.assertTrue(self.shedder.shedding)
+        # nothing queued any more: the next request is queued
+        self.assertEqual(self.shedder.queued, 0)
+        self.assertTrue(self.shedder.enqueue())
+        self.assertFalse(self.shedder.shedding)
+
+    def test_cancel(self):
+        self.assertTrue(self.shedder.enqueue())
+        # the request could not be queued after all
+        self.shedder.cancel()
+        self.assertEqual(self.shedder.queued, 0)
+        # the queue is seen empty: a shedding state left over is dropped
+        self.shedder.shedding = True
+        self.assertTrue(self.shedder.enqueue())
+
+if __name__ == '__main__':
+    unittest.main()